@@ -1,11 +1,12 @@
 import numpy as np
 
 from collections import deque
-from keras.models import Model
-from keras.layers import Input, Dense
-from keras.optimizers import adam_v2
 import random
 
+from inference_cache import CACHE_SIZE, InferenceCache
+from numpy_model import NumpyModel
+from utility_functions import get_random
+
 REPLAY_MEMORY_SIZE = 2000  # How many last steps to keep for model training, 2000 means remember last 100 games
 MIN_REPLAY_MEMORY_SIZE = 1000  # Minimum number of steps in memory to start training, 1000 means at least 50 games
 MINIBATCH_SIZE = 32  # How many steps (samples) to use for training
@@ -13,24 +14,77 @@ MINIBATCH_SIZE = 32  # How many steps (samples) to use for training
 
 # Agent class
 class GuessingAgent:
-    def __init__(self, input_size, guess_max, soft_guess=False):
+    def __init__(self, input_size, guess_max, soft_guess=False, build_model=True, cache_size=CACHE_SIZE):
 
         self.input_size = input_size
         self.guess_max = guess_max
         self.accuracy = 0.02
         self.soft_guess = soft_guess
 
-        # Main model
-        self.model = self.create_model()
+        # outputs of revisited states, emptied whenever the model changes
+        self.cache = InferenceCache(cache_size)
+
+        # Main model, without build_model it is only made when it is used before a model is loaded
+        self._model = None
+        if build_model:
+            self.model = self.create_model()
+
+        # actors of a parallel run only collect experiences, their learner trains the model
+        self.training = True
 
         # An array with last n steps for training
         self.replay_memory = deque(maxlen=REPLAY_MEMORY_SIZE)
 
+    @property
+    def model(self):
+        if self._model is None:
+            self.model = self.create_model()
+        return self._model
+
+    @model.setter
+    def model(self, model):
+        self._model = model
+        self.cache.bump_version()
+        if isinstance(model, NumpyModel):
+            # exported model runs its own forward pass
+            self._forward = model
+        else:
+            # a new or loaded keras model gets its own compiled forward pass
+            from inference import CompiledForward
+            self._forward = CompiledForward(model, self.input_size)
+
+    @property
+    def forward(self):
+        if self._model is None:
+            self.model = self.create_model()
+        return self._forward
+
+    @forward.setter
+    def forward(self, forward):
+        # replace the forward pass of the model, like a batched one shared by several games
+        self._forward = forward
+
+    def share_model(self, agent) -> None:
+        """
+        Use the model of another agent together with its forward pass and cache,
+        for seats that play with the same model
+        :param agent: agent whose model is used
+        :return: None
+        """
+        self._model = agent.model
+        self._forward = agent.forward
+        self.cache = agent.cache
+
     @staticmethod
     def dense_layer(num_units):
+        from keras.layers import Dense
         return Dense(num_units, activation="relu")
 
     def create_model(self):
+        # keras is only imported when a model is built, exported models do not need it
+        from keras.models import Model
+        from keras.layers import Input, Dense
+        from keras.optimizers import adam_v2
 
         input1 = Input(self.input_size)  # input size for observation state is 68
         # input2 = Input(1)  # scalar input for action taken
@@ -60,7 +114,7 @@ class GuessingAgent:
     # Trains main network every step during episode
     def train(self):
         # Start training only if certain number of samples is already saved
-        if len(self.replay_memory) < MIN_REPLAY_MEMORY_SIZE:
+        if not self.training or len(self.replay_memory) < MIN_REPLAY_MEMORY_SIZE:
             return
 
         # Get a minibatch of random samples from memory replay table
@@ -83,6 +137,7 @@ class GuessingAgent:
             verbose=0,
             shuffle=False,
         )
+        self.cache.bump_version()
 
     def get_guess(self, state) -> int:
         """
@@ -92,7 +147,7 @@ class GuessingAgent:
 
         if self.soft_guess:
             probs = np.cumsum(output)
-            rand = random.uniform(0, 1)
+            rand = get_random().uniform(0, 1)
             for i in range(len(output)):
                 if rand < probs[i]:
                     break
@@ -103,4 +158,9 @@ class GuessingAgent:
 
     # Queries main network for Q values given current observation space (environment state)
     def get_qs(self, state):
-        return self.model.predict(state.reshape(-1, *state.shape))[0]
\ No newline at end of file
+        key = np.asarray(state).tobytes()
+        qs = self.cache.get(key)
+        if qs is None:
+            qs = self.forward(state)[0]
+            self.cache.put(key, qs)
+        return qs
\ No newline at end of file
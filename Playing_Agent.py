@@ -1,8 +1,8 @@
 import numpy as np
-import random
 
 import Playing_Network
-from utility_functions import key_to_state, state_to_key, temp_game, write_state
+from node_table import NodeTable
+from utility_functions import afterstate, get_random, key_to_state, state_to_key, write_state
 
 
 class Node:
@@ -11,9 +11,11 @@ class Node:
     Monte-Carlo Treesearch
     """
     def __init__(
-        self, state, root=0, card=None, parent=None
+        self, state, root=0, card=None, parent=None, state_hash=None, game_round=0
     ):
         self.state = state
+        self.hash = state_hash
+        self.game_round = game_round
         self.parent = parent
         self.wins = 0
         self.actual_encounters = 0
@@ -23,16 +25,30 @@ class Node:
         # card that was played to get to the state
         self.card = card
 
+        # first layer of the network for the state, only set while the node is a child being evaluated
+        self.accumulator = None
+
 
 # Agent class
 class PlayingAgent:
-    def __init__(self, input_size: int, name=None, verbose=0, interactive=False, diff=False, punish=False, score=False):
+    def __init__(
+        self,
+        input_size: int,
+        name=None,
+        verbose=0,
+        interactive=False,
+        diff=False,
+        punish=False,
+        score=False,
+        build_model=True,
+        nodes=None,
+    ):
 
         self.game = None
         self.input_size = input_size
         self.interactive = interactive
-        self.nodes = dict()
-        self.network_policy = Playing_Network.PlayingNetwork(input_size, name)
+        self.nodes = nodes if nodes is not None else NodeTable()
+        self.network_policy = Playing_Network.PlayingNetwork(input_size, name, build_model=build_model)
         self.verbose = verbose
         self.diff = diff
         self.punish = punish
@@ -43,20 +59,23 @@ class PlayingAgent:
         self.parent_node = None
         self.last_terminal_node = None
 
-    def get_node(self, state_space: np.ndarray) -> Node:
+        # last expanded playing state and its first layer, updated with the features that changed since
+        self.accumulator_state = None
+        self.accumulator = None
+
+    def get_node(self, state_hash: int, state_space: np.ndarray):
         """"
-        get node from node dictionary using key_state
+        get node from node table using the zobrist hash, None if the state is unseen
         """
-        key_state = state_to_key(state_space)
-        return self.nodes[key_state]
+        return self.nodes.get_state(state_hash, state_space)
 
     # function for randomly selecting a child node
-    def rollout_policy(self) -> tuple:
+    def rollout_policy(self) -> int:
         parent = self.parent_node
         if self.verbose >= 2:
             print("Rollout policy used...")
         if len(parent.children) > 0:
-            child = random.choice(parent.children)
+            child = get_random().choice(parent.children)
         else:
             print("Parent has no children!!! oh no!")
             exit()
@@ -65,6 +84,8 @@ class PlayingAgent:
         self.parent_node = child
 
         # Remove simulated children, no longer needed
+        for node in parent.children:
+            node.accumulator = None
         del parent.children[:]
 
         return self.parent_node.card
@@ -98,15 +119,16 @@ class PlayingAgent:
 
         self.backpropagate(node.parent, result, diff=diff, score=score, loss=loss)
 
-    def best_child(self, node: Node) -> tuple:
+    def best_child(self, node: Node) -> int:
+        # all children are scored in a single forward pass, ties are broken the same way as one by one
+        values = self.evaluate_states(node.children)
         best_child = node.children[0]
-        max_value = self.evaluate_state(best_child)
-        for child in node.children[1:]:
-            value = self.evaluate_state(child)
+        max_value = values[0]
+        for child, value in zip(node.children[1:], values[1:]):
             if value > max_value:
                 best_child = child
                 max_value = value
-            elif value == max_value and random.getrandbits(1):
+            elif value == max_value and get_random().getrandbits(1):
                 best_child = child
                 max_value = value
 
@@ -114,15 +136,49 @@ class PlayingAgent:
         self.parent_node = best_child
 
         # Remove simulated children
+        for child in node.children:
+            child.accumulator = None
         del self.parent_node.parent.children[:]
 
         return best_child.card
 
-    def evaluate_state(self, node: Node) -> float:
-        sparse_state = key_to_state(self.input_size, node.state)
-        return self.network_policy.predict(sparse_state)
+    def evaluate_states(self, nodes: list) -> np.ndarray:
+        accumulators = None
+        if nodes[0].accumulator is not None:
+            accumulators = [node.accumulator for node in nodes]
+        return self.network_policy.predict_keys([node.state for node in nodes], accumulators)
 
-    def predict(self) -> tuple:
+    def parent_accumulator(self, state_space: np.ndarray):
+        """
+        First layer of the network for the expanded state, updated from the previous expanded state
+        when only a few features changed later in the same round. The first expansion of a round
+        accumulates from scratch (see new_round), so a round evaluates the same however it is reached
+        :param state_space: playing state that gets expanded
+        :return: accumulator of the state, None if the network has no incremental first layer
+        """
+        if not self.network_policy.uses_accumulator:
+            return None
+        changed = None
+        if self.accumulator_state is not None:
+            changed = np.flatnonzero(state_space != self.accumulator_state)
+        if changed is not None and len(changed) < np.count_nonzero(state_space):
+            deltas = state_space[changed] - self.accumulator_state[changed]
+            self.accumulator = self.network_policy.update_accumulator(self.accumulator, changed, deltas)
+        else:
+            self.accumulator = self.network_policy.accumulate(state_space)
+        self.accumulator_state = state_space.copy()
+        return self.accumulator
+
+    def new_round(self) -> None:
+        """
+        Forget the last expanded state, the first expansion of the round is accumulated from scratch
+        whatever round or game the agent played before
+        :return: None
+        """
+        self.accumulator_state = None
+        self.accumulator = None
+
+    def predict(self) -> int:
         """
         Use network to get best move
         :return:
@@ -130,19 +186,21 @@ class PlayingAgent:
         node = self.parent_node
         return self.best_child(node)
 
-    def unseen_state(self, play_state: np.ndarray) -> None:
+    def unseen_state(self, play_state: np.ndarray, state_hash: int, game_round: int) -> None:
         """
         Create root node for unseen state
         :param play_state: playing state to create a node for
+        :param state_hash: zobrist hash of the playing state
+        :param game_round: round of the state
         :return:
         """
         if self.verbose >= 2:
             print("Adding unseen root node..")
         key_state = state_to_key(play_state)
-        root_node = Node(key_state, root=1)
+        root_node = Node(key_state, root=1, state_hash=state_hash, game_round=game_round)
         if self.verbose:
             write_state(play_state, "state_err1", self.input_size, True)
-        self.nodes[key_state] = root_node
+        self.nodes.add(root_node)
         self.parent_node = root_node
 
     def expand(
@@ -152,7 +210,9 @@ class PlayingAgent:
         game_instance,
         requested_color: int,
         played_cards: list,
-        player_hand: list,
+        hand_size: int,
+        state_space: np.ndarray,
+        state_hash=None,
         run_type="learning",
     ) -> None:
         """
@@ -162,7 +222,9 @@ class PlayingAgent:
         :param game_instance: instance of Game in current state
         :param requested_color: requested color
         :param played_cards: cards played in trick so far
-        :param player_hand: cards in the players' hand
+        :param hand_size: amount of cards in the players' hand
+        :param state_space: playing state of the player before the move
+        :param state_hash: zobrist hash of state_space, needed when learning
         :param run_type: type of agent {"learning", "learned", "heuristic", "random"}
         :return:
         """
@@ -172,113 +234,88 @@ class PlayingAgent:
 
         if self.verbose >= 2:
             print("Expanding the following moves: ", legal_moves)
-        if len(player_hand) > 1:
+
+        # which trick counter goes down for each player in the trick if they win it
+        player_index = len(played_cards)
+        player = player_order[player_index]
+        others = [p for p in game_instance.players if p != player]
+        win_slots = [-1 if p == player else others.index(p) for p in player_order]
+
+        # children are evaluated from the first layer of this state plus the few features they change
+        accumulator = self.parent_accumulator(state_space)
+
+        if hand_size > 1:
             for move in legal_moves:
                 self.create_child(
                     move,
-                    player_order,
+                    state_space,
+                    state_hash,
                     game_instance,
-                    requested_color,
                     played_cards,
+                    win_slots,
                     run_type,
+                    parent_accumulator=accumulator,
                 )
         else:
-            # terminal node
+            # terminal node, the other players play their last card to wrap up the round
+            following_cards = []
+            if not self.interactive:
+                following_cards = [p.get_hand()[0] for p in player_order[player_index + 1:]]
             self.create_child(
                 legal_moves[0],
-                player_order,
+                state_space,
+                state_hash,
                 game_instance,
-                requested_color,
                 played_cards,
+                win_slots,
                 run_type,
+                following_cards=following_cards,
                 terminal_node=True,
+                parent_accumulator=accumulator,
             )
 
     def create_child(
         self,
-        move: tuple,
-        player_order: list,
+        move: int,
+        parent_state: np.ndarray,
+        parent_hash,
         game_instance,
-        requested_color: int,
         played_cards: list,
+        win_slots: list,
         run_type: str,
+        following_cards=(),
         terminal_node=False,
+        parent_accumulator=None,
     ) -> None:
         """
-        simulates and saves a child node where the given move
-        is played in the given playing state
-        :param move: the move to play and simulate
-        :param player_order: list of players in turn order
+        saves a child node where the given move is played in the given playing state,
+        the child state is computed from the parent state instead of simulating the game
+        :param move: the move to play
+        :param parent_state: playing state before the move
+        :param parent_hash: zobrist hash of the parent state, None when not learning
         :param game_instance: instance of Game in current play state before move
-        :param requested_color: requested color
         :param played_cards: cards played in trick so far
+        :param win_slots: for each player in trick order, -1 for the player itself,
+                          else their index in tricks_needed_others
         :param run_type: type of agent {"learning", "learned", "heuristic", "random"}
+        :param following_cards: last cards of the players after the move, for terminal nodes
         :param terminal_node: boolean whether the child node is a terminal node
+        :param parent_accumulator: first layer of the network for the parent state, None to evaluate from the key
         :return:
         """
         if self.verbose >= 2:
             print("Creating a child node...", move, played_cards)
         parent = self.parent_node
 
-        # make temporary copy of the game
-        temp_instance = temp_game(game_instance, played_cards, interactive=self.interactive)
-
-        player_index = len(played_cards)
-        player_order_names = [p.player_name for p in player_order]
-        new_player_dict = {
-            "player1": temp_instance.player1,
-            "player2": temp_instance.player2,
-            "player3": temp_instance.player3,
-        }
-        new_player_order = [new_player_dict[p] for p in player_order_names]
-        game_class_players_order = [p.player_name for p in game_instance.players]
-        shuffle_seed = []
-
-        # game players are in some random order, temp_game players is still ordered
-        for i in game_class_players_order:
-            for p in temp_instance.players:
-                if p.player_name == i:
-                    shuffle_seed.append(p)
-        temp_instance.players = shuffle_seed
-
-        if self.verbose >= 3:
-            print("Temporary player order: ", [p.player_name for p in new_player_order])
-            print("Player that is learning: ", player_index, played_cards)
-
-        player = new_player_order[player_index]
-        # if theres more tricks to follow, children state is after move
-        if not terminal_node or self.interactive:
-            if player_index == 2:
-                # simulate the play with selected move (final move of trick)
-                _, new_player_order = temp_instance.play_trick(
-                    new_player_order,
-                    requested_color,
-                    player_index,
-                    card=move,
-                    player_limit=player_index + 1,
-                    temp=True
-                )
-            else:
-                # simulate play with selected non-final move
-                temp_instance.play_trick(
-                    new_player_order,
-                    requested_color,
-                    player_index,
-                    card=move,
-                    player_limit=player_index + 1,
-                    temp=True
-                )
-
-        # else, terminal node, wrap up the round (no more choices by the agent left)
-        else:
-            _, new_player_order = temp_instance.play_trick(new_player_order, requested_color,
-                                                           player_index, card=move, temp=True)
-
-        play_state = temp_instance.playing_state_space(
-            new_player_order,
-            player,
-            temp_instance.played_cards,
-            temp=True,
+        play_state, state_hash = afterstate(
+            parent_state,
+            self.input_size,
+            move,
+            played_cards,
+            game_instance.trump,
+            win_slots,
+            following_cards,
+            parent_hash,
         )
 
         if self.verbose:
@@ -286,11 +323,15 @@ class PlayingAgent:
 
         key_state = state_to_key(play_state)
 
-        node = Node(key_state, card=move, parent=parent)
+        node = Node(key_state, card=move, parent=parent, state_hash=state_hash, game_round=game_instance.game_round)
+        if parent_accumulator is not None:
+            changed = np.flatnonzero(play_state != parent_state)
+            node.accumulator = self.network_policy.update_accumulator(
+                parent_accumulator, changed, play_state[changed] - parent_state[changed]
+            )
         parent.children.append(node)
         if run_type == "learning":
-            if key_state not in self.nodes.keys():
-                self.nodes[key_state] = node
+            self.nodes.add(node)
 
             if terminal_node:
                 self.last_terminal_node = node
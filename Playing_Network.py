@@ -1,36 +1,89 @@
 import numpy as np
 
 from collections import deque
-from keras.models import Model
-from keras.layers import Input, Dense
-from keras.optimizers import adam_v2
 
 import random
 import utility_functions as util
+from inference_cache import CACHE_SIZE, InferenceCache
+from numpy_model import NumpyModel
 
 REPLAY_MEMORY_SIZE = 42000  # How many of last   to keep for model training, 42000 means remember last ~200 games
 MIN_REPLAY_MEMORY_SIZE = 4200  # Minimum number of tricks in memory to start training, 10500 means at least ~20 games
 MINIBATCH_SIZE = 32  # How many steps (samples) to use for training
+SPARSE_MIN_INPUT = 1000  # Exported models with at least this many inputs are evaluated from the non-zero features
 
 
 # Agent class
 class PlayingNetwork:
-    def __init__(self, input_size, name):
+    def __init__(self, input_size, name, build_model=True, cache_size=CACHE_SIZE):
 
         self.input_size = input_size
         self.name = name
 
-        # Main model
-        self.model = self.create_model()
+        # outputs of revisited states, emptied whenever the model changes
+        self.cache = InferenceCache(cache_size)
+
+        # Main model, without build_model it is only made when it is used before a model is loaded
+        self._model = None
+        if build_model:
+            self.model = self.create_model()
+
+        # actors of a parallel run only collect experiences, their learner trains the model
+        self.training = True
 
         # An array with last n steps for training
         self.replay_memory = deque(maxlen=REPLAY_MEMORY_SIZE)
 
+    @property
+    def model(self):
+        if self._model is None:
+            self.model = self.create_model()
+        return self._model
+
+    @model.setter
+    def model(self, model):
+        self._model = model
+        self.cache.bump_version()
+        if isinstance(model, NumpyModel):
+            # exported model runs its own forward pass
+            self._forward = model
+        else:
+            # a new or loaded keras model gets its own compiled forward pass
+            from inference import CompiledForward
+            self._forward = CompiledForward(model, self.input_size)
+
+    @property
+    def forward(self):
+        if self._model is None:
+            self.model = self.create_model()
+        return self._forward
+
+    @forward.setter
+    def forward(self, forward):
+        # replace the forward pass of the model, like a batched one shared by several games
+        self._forward = forward
+
+    def share_model(self, network) -> None:
+        """
+        Use the model of another network together with its forward pass and cache,
+        for seats that play with the same model
+        :param network: network whose model is used
+        :return: None
+        """
+        self._model = network.model
+        self._forward = network.forward
+        self.cache = network.cache
+
     @staticmethod
     def dense_layer(num_units):
+        from keras.layers import Dense
         return Dense(num_units, activation="relu")
 
     def create_model(self):
+        # keras is only imported when a model is built, exported models do not need it
+        from keras.models import Model
+        from keras.layers import Input, Dense
+        from keras.optimizers import adam_v2
 
         input1 = Input(self.input_size)  # input size for observation state is 3732
         # input2 = Input(1)  # scalar input for action taken
@@ -72,19 +125,14 @@ class PlayingNetwork:
     def train(self):
         # print("Calling train, Replay size: ", len(self.replay_memory))
         # Start training only if certain number of samples is already saved
-        if len(self.replay_memory) < MIN_REPLAY_MEMORY_SIZE:
+        if not self.training or len(self.replay_memory) < MIN_REPLAY_MEMORY_SIZE:
             return 0
 
         # Get a minibatch of random samples from memory replay table
         minibatch = random.sample(self.replay_memory, MINIBATCH_SIZE)
 
         # Get states (x) and rewards (y) from minibatch
-        states = np.array(
-            [
-                util.key_to_state(self.input_size, transition[0])
-                for transition in minibatch
-            ]
-        )
+        states = util.keys_to_states(self.input_size, [transition[0] for transition in minibatch])
         rewards = np.array([transition[1] for transition in minibatch])
 
         # Fit on all samples as one batch, log only on terminal state
@@ -95,8 +143,80 @@ class PlayingNetwork:
             verbose=0,
             shuffle=False,
         )
+        self.cache.bump_version()
         loss = history.history["loss"][0]
         return loss
 
     def predict(self, state):
-        return self.model.predict(state.reshape(-1, *state.shape))[0]
+        return self.forward(state)[0]
+
+    def predict_keys(self, keys: list, accumulators=None):
+        """
+        Evaluate states given by their keys, cached outputs are reused and only the other states are evaluated.
+        Exported models only use the non-zero features
+        :param keys: list of keys made by utility_functions.state_to_key
+        :param accumulators: first layer accumulators of the states, see accumulate
+        :return: array with the value of every state
+        """
+        values = np.empty(len(keys), dtype=np.float32)
+        missing = []
+        for i, key in enumerate(keys):
+            value = self.cache.get(key)
+            if value is None:
+                missing.append(i)
+            else:
+                values[i] = value
+        if not missing:
+            return values
+
+        missing_keys = [keys[i] for i in missing]
+        if accumulators is not None:
+            new_values = self.predict_accumulated([accumulators[i] for i in missing])
+        elif isinstance(self.forward, NumpyModel) and self.input_size >= SPARSE_MIN_INPUT:
+            indices, features = util.keys_to_features(self.input_size, missing_keys)
+            new_values = self.forward.sparse_forward(indices, features)[:, 0]
+        else:
+            new_values = self.forward(util.keys_to_states(self.input_size, missing_keys))[:, 0]
+        for i, key, value in zip(missing, missing_keys, new_values):
+            values[i] = value
+            self.cache.put(key, value)
+        return values
+
+    @property
+    def uses_accumulator(self) -> bool:
+        """
+        Whether states can be evaluated from an incrementally updated first layer
+        """
+        return isinstance(self.forward, NumpyModel) and self.input_size >= SPARSE_MIN_INPUT
+
+    def accumulate(self, state: np.ndarray) -> np.ndarray:
+        """
+        :param state: playing state
+        :return: first layer accumulator of the state
+        """
+        indices = np.flatnonzero(state)
+        return self.forward.accumulate([indices], [state[indices]])[0]
+
+    def update_accumulator(self, accumulator: np.ndarray, indices: np.ndarray, deltas: np.ndarray) -> np.ndarray:
+        """
+        :param accumulator: accumulator of a state
+        :param indices: indices of the features that changed
+        :param deltas: new minus old value of every changed feature
+        :return: accumulator of the changed state
+        """
+        return self.forward.update_accumulator(accumulator, indices, deltas)
+
+    def predict_accumulated(self, accumulators: list):
+        """
+        :param accumulators: first layer accumulators of the states
+        :return: array with the value of every state
+        """
+        return self.forward.forward_accumulated(np.stack(accumulators))[:, 0]
+
+    def predict_batch(self, states):
+        """
+        Evaluate many states in one forward pass
+        :param states: array of shape (n, input_size)
+        :return: array with the value of every state
+        """
+        return self.forward(states)[:, 0]
@@ -0,0 +1,397 @@
+import multiprocessing
+import os
+
+import cards
+import game
+from Guessing_Agent import GuessingAgent
+from node_table import NodeTable
+from numpy_model import NumpyModel, from_keras, mapped_version
+from Playing_Agent import PlayingAgent
+from thread_budget import apply_thread_budget
+
+PUBLISH_EVERY = 10  # Games the learner trains on before it publishes new weights, unless --publish_every is given
+QUEUED_GAMES = 2  # Finished games per actor that can wait for the learner, actors block when it falls behind
+
+
+def exploration(game_index: int, settings: dict) -> tuple:
+    """
+    Epsilons of a game, the same as decaying them after every game of a serial run
+    :param game_index: how manieth game of the run it is, from 0
+    :param settings: settings of the run, see ActorLearner
+    :return: guessing and playing epsilon
+    """
+    epsilon = settings["epsilon"]
+    if epsilon > settings["min_epsilon"]:
+        epsilon = max(settings["min_epsilon"], epsilon * settings["epsilon_decay"] ** game_index)
+    player_epsilon = settings["player_epsilon"]
+    if player_epsilon > settings["min_epsilon"]:
+        player_epsilon = max(0.25, player_epsilon * settings["player_decay"] ** game_index)
+    return epsilon, player_epsilon
+
+
+def refresh(network, path: str, versions: dict) -> None:
+    """
+    Map the newest published weights of a network when they changed
+    :param network: GuessingAgent or PlayingNetwork
+    :param path: folder of the published weights
+    :param versions: version every path is mapped at, updated in place
+    :return: None
+    """
+    version = mapped_version(path)
+    if version != versions.get(path):
+        network.model = NumpyModel.load_mapped(path)
+        versions[path] = network.model.version
+
+
+def create_agents(settings: dict) -> tuple:
+    """
+    Agents of an actor without models, their models are set from the weights of the learner
+    :param settings: settings of the run, see ActorLearner
+    :return: guessing agent, playing agent, opponents (guess_agent2, guess_agent3, playing_agent2, playing_agent3)
+             and the (network, name) of every network that gets weights
+    """
+    guess_agent = GuessingAgent(
+        input_size=settings["guesser_size"], guess_max=21, soft_guess=settings["soft_guess"], build_model=False
+    )
+    playing_agent = PlayingAgent(
+        input_size=settings["player_size"],
+        verbose=settings["verbose"],
+        punish=settings["punish"],
+        score=settings["score"],
+        diff=settings["diff"],
+        build_model=False,
+        nodes=NodeTable(settings["max_nodes"], settings["node_bytes"], settings["round_quotas"]),
+    )
+    guess_agent.training = False
+    playing_agent.network_policy.training = False
+    networks = [(guess_agent, "guessing"), (playing_agent.network_policy, "playing")]
+
+    # learned opponents, both seats use the same weights
+    opponents = [None] * 4
+    if settings["opp_guesstype"] == "learned":
+        opponents[0] = GuessingAgent(input_size=settings["opp_guesser_size"], guess_max=21, build_model=False)
+        opponents[1] = GuessingAgent(input_size=settings["opp_guesser_size"], guess_max=21, build_model=False)
+        networks.append((opponents[0], "opp_guessing"))
+    if settings["opp_playertype"] == "learned":
+        opponents[2] = PlayingAgent(input_size=settings["opp_player_size"], build_model=False)
+        opponents[3] = PlayingAgent(input_size=settings["opp_player_size"], build_model=False)
+        networks.append((opponents[2].network_policy, "opp_playing"))
+    return guess_agent, playing_agent, opponents, networks
+
+
+def share_opponent_models(opponents: list) -> None:
+    if opponents[0] is not None:
+        opponents[1].share_model(opponents[0])
+    if opponents[2] is not None:
+        opponents[3].network_policy.share_model(opponents[2].network_policy)
+
+
+def play_actor_game(
+    game_index: int, settings: dict, guess_agent: GuessingAgent, playing_agent: PlayingAgent, opponents: list
+) -> dict:
+    """
+    Play a game without training and take the experiences of player 1
+    :param game_index: how manieth game of the run it is, from 0
+    :param settings: settings of the run, see ActorLearner
+    :return: the result of the game for the learner
+    """
+    epsilon, player_epsilon = exploration(game_index, settings)
+    wizard = game.Game(
+        cards.new_deck(),
+        guess_type=settings["guess_type"],
+        player_type=settings["player_type"],
+        output_path="state_err1",
+        guess_agent=guess_agent,
+        playing_agent=playing_agent,
+        epsilon=epsilon,
+        player_epsilon=player_epsilon,
+        verbose=settings["verbose"],
+        opp_guesstype=settings["opp_guesstype"],
+        opp_playertype=settings["opp_playertype"],
+        guess_agent2=opponents[0],
+        guess_agent3=opponents[1],
+        playing_agent2=opponents[2],
+        playing_agent3=opponents[3],
+        save_folder=settings["save_folder"],
+        train_every="learner",
+    )
+    _, scores, offs, round_offs = wizard.play_game()
+
+    result = {
+        "scores": scores,
+        "offs": offs,
+        "round_offs": round_offs,
+        "performance": wizard.get_game_performance(),
+        "guess_memory": list(guess_agent.replay_memory),
+        "play_memory": list(playing_agent.network_policy.replay_memory),
+        "cntr": playing_agent.cntr,
+        "full_cntr": playing_agent.full_cntr,
+    }
+    guess_agent.replay_memory.clear()
+    playing_agent.network_policy.replay_memory.clear()
+    playing_agent.cntr = [0] * 20
+    playing_agent.full_cntr = [0] * 20
+    return result
+
+
+def actor(index: int, settings: dict, experiences, games_started, stop) -> None:
+    """
+    Actor process, plays games against the latest published weights and sends
+    the experiences of player 1 to the learner instead of training
+    :param index: index of the actor, for its thread budget and cores
+    :param settings: settings of the run, see ActorLearner
+    :param experiences: queue to the learner
+    :param games_started: shared counter of the games of the run that are started
+    :param stop: event set by the learner to end the run early
+    :return: None
+    """
+    apply_thread_budget(settings["thread_config"], worker=index)
+    paths = settings["paths"]
+    guess_agent, playing_agent, opponents, networks = create_agents(settings)
+
+    versions = dict()
+    while not stop.is_set():
+        with games_started.get_lock():
+            game_index = games_started.value
+            if game_index >= settings["games"]:
+                break
+            games_started.value += 1
+
+        for network, name in networks:
+            if name in paths:
+                refresh(network, paths[name], versions)
+        share_opponent_models(opponents)
+        experiences.put(play_actor_game(game_index, settings, guess_agent, playing_agent, opponents))
+
+    # this actor is done
+    experiences.put(None)
+
+
+def mpi_actor(comm) -> None:
+    """
+    Actor rank of an MPI run, gets its games and the newest weights from rank 0 and
+    sends back the experiences of every game, like an actor process
+    :param comm: world communicator
+    :return: None
+    """
+    settings = comm.bcast(None, root=0)
+    guess_agent, playing_agent, opponents, networks = create_agents(settings)
+
+    result = None
+    while True:
+        comm.send((comm.Get_rank(), result), dest=0)
+        task = comm.recv(source=0)
+        if task is None:
+            break
+        game_index, models = task
+        for network, name in networks:
+            if name in models:
+                network.model = models[name]
+        share_opponent_models(opponents)
+        result = play_actor_game(game_index, settings, guess_agent, playing_agent, opponents)
+
+
+def actor_seats(guess_agent: GuessingAgent, playing_agent: PlayingAgent, opp_agents: tuple, settings: dict) -> list:
+    """
+    :return: (name, network) of every model the actors need and whether the learner trains it
+    """
+    seats = [
+        ("guessing", guess_agent, settings["guess_type"]),
+        ("playing", playing_agent.network_policy, settings["player_type"]),
+        ("opp_guessing", opp_agents[0], settings["opp_guesstype"]),
+        ("opp_playing", opp_agents[1] and opp_agents[1].network_policy, settings["opp_playertype"]),
+    ]
+    return [
+        (name, network, agent_type == "learning")
+        for name, network, agent_type in seats if agent_type in ("learning", "learned")
+    ]
+
+
+class ActorLearner:
+    """
+    Parallel self-play for main.py: actor processes play the games with a snapshot of the weights
+    and stream the experiences of player 1 to this process, the learner, which owns the models,
+    trains them and publishes new weights every publish_every games
+    """
+    def __init__(
+        self,
+        actors: int,
+        guess_agent: GuessingAgent,
+        playing_agent: PlayingAgent,
+        opp_agents: tuple,
+        settings: dict,
+        publish_every=PUBLISH_EVERY,
+    ):
+        self.guess_agent = guess_agent
+        self.playing_agent = playing_agent
+        self.settings = settings
+        self.publish_every = publish_every or PUBLISH_EVERY
+        self.finished = 0
+
+        # learned models are only published once
+        folder = os.path.join("models", settings["save_folder"], "actors")
+        self.learning = []
+        settings["paths"] = dict()
+        for name, network, learning in actor_seats(guess_agent, playing_agent, opp_agents, settings):
+            path = os.path.join(folder, f"{name}.weights")
+            settings["paths"][name] = path
+            from_keras(network.model).publish(path)
+            if learning:
+                self.learning.append((network, path))
+
+        context = multiprocessing.get_context("spawn")
+        self.experiences = context.Queue(maxsize=QUEUED_GAMES * actors)
+        self.games_started = context.Value("i", 0)
+        self.stop = context.Event()
+        self.processes = [
+            context.Process(target=actor, args=(index, settings, self.experiences, self.games_started, self.stop))
+            for index in range(actors)
+        ]
+        for process in self.processes:
+            process.start()
+        self.running = actors
+
+    def results(self):
+        """
+        Train on the experiences of every game the actors finish
+        :return: generator of (loss, scores, offs, round offs, game performance) for every game, like Game.play_game
+        """
+        while self.running:
+            result = self.experiences.get()
+            if result is None:
+                self.running -= 1
+                continue
+            self.finished += 1
+            loss = self.train(result)
+            if self.finished % self.publish_every == 0:
+                for network, path in self.learning:
+                    from_keras(network.model).publish(path)
+            yield loss, result["scores"], result["offs"], result["round_offs"], result["performance"]
+
+    def train(self, result: dict) -> float:
+        """
+        Add the experiences of a game to the replay memories and train as often as a serial run would
+        :param result: game sent by an actor
+        :return: summed loss of the playing network
+        """
+        self.guess_agent.replay_memory.extend(result["guess_memory"])
+        network = self.playing_agent.network_policy
+        network.replay_memory.extend(result["play_memory"])
+        for i in range(20):
+            self.playing_agent.cntr[i] += result["cntr"][i]
+            self.playing_agent.full_cntr[i] += result["full_cntr"][i]
+
+        loss = 0.0
+        if self.settings["guess_type"] == "learning":
+            # a serial run trains the guesser after every round
+            for _ in range(20):
+                self.guess_agent.train()
+        if self.settings["player_type"] == "learning":
+            train_every = self.settings["train_every"]
+            steps = 0
+            if train_every == "round":
+                steps = 20
+            elif train_every == "game" or (train_every.isnumeric() and self.finished % int(train_every) == 0):
+                steps = 1
+            for _ in range(steps):
+                loss += network.train()
+        return loss
+
+    def close(self) -> None:
+        """
+        Stop the actors, games that were still being played are thrown away
+        :return: None
+        """
+        self.stop.set()
+        while self.running:
+            if self.experiences.get() is None:
+                self.running -= 1
+        for process in self.processes:
+            process.join()
+
+
+class MPIActorLearner(ActorLearner):
+    """
+    ActorLearner whose actors are the other ranks of an MPI run, possibly on other nodes.
+    Rank 0 is the learner: it hands out the games and sends an actor the newest weights
+    with its next game whenever they changed, instead of publishing them to a folder
+    """
+    def __init__(
+        self,
+        comm,
+        guess_agent: GuessingAgent,
+        playing_agent: PlayingAgent,
+        opp_agents: tuple,
+        settings: dict,
+        publish_every=PUBLISH_EVERY,
+    ):
+        self.comm = comm
+        self.guess_agent = guess_agent
+        self.playing_agent = playing_agent
+        self.settings = settings
+        self.publish_every = publish_every or PUBLISH_EVERY
+        self.finished = 0
+        self.started = 0
+        self.stopped = False
+
+        # newest weights by name, only the learning models change
+        self.models = dict()
+        self.learning = []
+        for name, network, learning in actor_seats(guess_agent, playing_agent, opp_agents, settings):
+            self.models[name] = from_keras(network.model)
+            if learning:
+                self.learning.append((network, name))
+        self.version = 0
+        self.sent = dict()  # version of the weights every actor plays with
+
+        comm.bcast(settings, root=0)
+        self.running = comm.Get_size() - 1
+
+    def results(self):
+        """
+        Train on the experiences of every game the actors finish
+        :return: generator of (loss, scores, offs, round offs, game performance) for every game, like Game.play_game
+        """
+        while self.running:
+            rank, result = self.comm.recv()
+            # the actor plays its next game while the learner trains
+            self.reply(rank)
+            if result is None:
+                continue
+            self.finished += 1
+            loss = self.train(result)
+            if self.finished % self.publish_every == 0:
+                for network, name in self.learning:
+                    self.models[name] = from_keras(network.model)
+                self.version += 1
+            yield loss, result["scores"], result["offs"], result["round_offs"], result["performance"]
+
+    def reply(self, rank: int) -> None:
+        """
+        Send an actor its next game and the weights that changed since its last game, or None when the run is over
+        :param rank: rank of the actor
+        :return: None
+        """
+        if self.stopped or self.started >= self.settings["games"]:
+            self.comm.send(None, dest=rank)
+            self.running -= 1
+            return
+        if rank not in self.sent:
+            models = self.models
+        elif self.sent[rank] != self.version:
+            models = {name: self.models[name] for _, name in self.learning}
+        else:
+            models = dict()
+        self.comm.send((self.started, models), dest=rank)
+        self.sent[rank] = self.version
+        self.started += 1
+
+    def close(self) -> None:
+        """
+        Stop the actors, games that were still being played are thrown away
+        :return: None
+        """
+        self.stopped = True
+        while self.running:
+            rank, _ = self.comm.recv()
+            self.reply(rank)
@@ -0,0 +1,187 @@
+import numpy as np
+import threading
+import time
+
+MAX_BATCH = 256  # Most states evaluated in one forward pass
+MAX_WAIT = 0.002  # Seconds a request waits for other games before it is evaluated on its own
+
+
+class BatchedForward:
+    """
+    Forward pass of one model that is shared by the games of an InferenceBatcher,
+    used by the agents like any other forward pass
+    """
+    def __init__(self, batcher, forward, input_size: int):
+        self.batcher = batcher
+        self.forward = forward
+        self.input_size = input_size
+
+    def __call__(self, states) -> np.ndarray:
+        """
+        :param states: a single state or an array of shape (n, input_size)
+        :return: model output for every state, of shape (n, output_size)
+        """
+        states = np.asarray(states, dtype=np.float32).reshape(-1, self.input_size)
+        return self.batcher.evaluate(self, states)
+
+
+class InferenceBatcher:
+    """
+    Gathers the evaluation requests of games running in their own threads and runs
+    all pending requests of a model as one forward pass. A batch is evaluated when it
+    reaches max_batch states, when every running game is waiting for a result,
+    or when its oldest request waited max_wait seconds
+    """
+    def __init__(self, max_batch=MAX_BATCH, max_wait=MAX_WAIT):
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.condition = threading.Condition()
+
+        # requests by batched forward pass, every request is [states, output, error, time of request]
+        self.pending = dict()
+        self.games = 0
+        self.waiting = 0
+
+        # for reporting
+        self.batches = 0
+        self.states = 0
+
+    def wrap(self, forward, input_size: int) -> BatchedForward:
+        """
+        :param forward: forward pass of a model, NumpyModel or CompiledForward
+        :param input_size: input size of the model
+        :return: batched forward pass to give to the agents of every game
+        """
+        return BatchedForward(self, forward, input_size)
+
+    def evaluate(self, batched: BatchedForward, states: np.ndarray) -> np.ndarray:
+        """
+        Queue states for evaluation and wait until their batch has been evaluated
+        :param batched: batched forward pass the states are for
+        :param states: array of shape (n, input_size)
+        :return: model output for the states
+        """
+        request = [states, None, None, time.monotonic()]
+        with self.condition:
+            self.pending.setdefault(batched, []).append(request)
+            self.waiting += 1
+            while request[1] is None and request[2] is None:
+                ready = self.ready_batches()
+                if ready:
+                    self.run_batches(ready)
+                    continue
+                # requests that are being evaluated by another game are woken up when they are done
+                oldest = [requests[0][3] for requests in self.pending.values()]
+                timeout = max(min(oldest) + self.max_wait - time.monotonic(), 0) if oldest else None
+                self.condition.wait(timeout=timeout)
+        if request[2] is not None:
+            raise request[2]
+        return request[1]
+
+    def ready_batches(self) -> list:
+        """
+        :return: forward passes whose pending requests should be evaluated now, the condition must be held
+        """
+        everyone_waits = self.waiting >= self.games
+        now = time.monotonic()
+        return [
+            batched for batched, requests in self.pending.items()
+            if requests and (
+                everyone_waits
+                or sum(len(request[0]) for request in requests) >= self.max_batch
+                or now - requests[0][3] >= self.max_wait
+            )
+        ]
+
+    def run_batches(self, ready: list) -> None:
+        """
+        Evaluate the pending requests of the given forward passes, the condition is released
+        while the models run so other games can keep queueing
+        :param ready: forward passes to evaluate
+        :return: None
+        """
+        taken = [(batched, self.pending.pop(batched)) for batched in ready]
+        self.waiting -= sum(len(requests) for _, requests in taken)
+        self.condition.release()
+        try:
+            for batched, requests in taken:
+                for start in range(0, len(requests), self.max_batch):
+                    self.run_batch(batched, requests[start: start + self.max_batch])
+        finally:
+            self.condition.acquire()
+        self.condition.notify_all()
+
+    def run_batch(self, batched: BatchedForward, requests: list) -> None:
+        try:
+            output = batched.forward(np.concatenate([request[0] for request in requests]))
+        except Exception as error:
+            for request in requests:
+                request[2] = error
+            return
+        self.batches += 1
+        self.states += len(output)
+        start = 0
+        for request in requests:
+            request[1] = output[start: start + len(request[0])]
+            start += len(request[0])
+
+    def join(self) -> None:
+        """
+        A game thread starts sending requests
+        :return: None
+        """
+        with self.condition:
+            self.games += 1
+
+    def leave(self) -> None:
+        """
+        A game thread is done, the others no longer wait for it
+        :return: None
+        """
+        with self.condition:
+            self.games -= 1
+            self.condition.notify_all()
+
+    def __str__(self) -> str:
+        average = self.states / self.batches if self.batches else 0
+        return f"{self.batches} batches, {self.states} states, {average:.1f} states per batch"
+
+
+def run_lockstep(games: list, worker_agents: list, batcher: InferenceBatcher) -> list:
+    """
+    Play games concurrently, one thread for every set of agents. Each thread plays
+    the next game that has not been started yet, while their network calls are batched.
+    The results only match playing the games one by one when every game seeds the random state
+    of its thread (Game with a seed, see utility_functions.seed_thread), the global one is shared
+    :param games: functions that play one game given a set of agents and return its result
+    :param worker_agents: one set of agents per thread, the agents of a thread are only used by that thread
+    :param batcher: batcher the forward passes of the agents belong to
+    :return: the result of every game, in the order of games
+    """
+    results = [None] * len(games)
+    errors = []
+    next_game = iter(enumerate(games))
+    lock = threading.Lock()
+
+    def worker(agents):
+        batcher.join()
+        try:
+            while not errors:
+                with lock:
+                    index, play = next(next_game, (None, None))
+                if play is None:
+                    return
+                results[index] = play(agents)
+        except Exception as error:
+            errors.append(error)
+        finally:
+            batcher.leave()
+
+    threads = [threading.Thread(target=worker, args=(agents,)) for agents in worker_agents]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return results
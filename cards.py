@@ -0,0 +1,232 @@
+import numpy as np
+
+# cards are suit {0-3} (blue, yellow, red, green), value {0-14} (0 == joker, 14 == wizard)
+# inside the engine a card is its index in the full deck (value + suit * 15, 0-59)
+# and a hand is a bitmask over those indices
+NUM_CARDS = 60
+
+SUIT = tuple(card // 15 for card in range(NUM_CARDS))
+VALUE = tuple(card % 15 for card in range(NUM_CARDS))
+
+FULL_MASK = (1 << NUM_CARDS) - 1
+SUIT_MASKS = tuple(((1 << 15) - 1) << (15 * suit) for suit in range(4))
+
+# jokers and wizards can always be played
+WHITE_MASK = sum(1 << card for card in range(NUM_CARDS) if VALUE[card] in (0, 14))
+
+# regular cards (1-13) per suit, these have to be followed if possible
+COLORED_MASKS = tuple(suit_mask & ~WHITE_MASK for suit_mask in SUIT_MASKS)
+
+
+def new_deck() -> list:
+    """
+    :return: the full deck of 60 card ids in order
+    """
+    return list(range(NUM_CARDS))
+
+
+def card_id(card: tuple) -> int:
+    """
+    Convert a (suit, value) card to its integer id
+    :param card: card as (suit, value) tuple
+    :return: card id
+    """
+    return card[1] + card[0] * 15
+
+
+def card_tuple(card: int) -> tuple:
+    """
+    Convert an integer card id to its (suit, value) tuple
+    :param card: card id
+    :return: card as (suit, value) tuple
+    """
+    return SUIT[card], VALUE[card]
+
+
+def deck_to_ids(deck: list) -> list:
+    """
+    Convert a list of (suit, value) cards, e.g. a pre-generated deck, to card ids
+    :param deck: list of (suit, value) cards
+    :return: list of card ids
+    """
+    return [card[1] + card[0] * 15 for card in deck]
+
+
+def mask_of(card_list) -> int:
+    """
+    :param card_list: iterable of card ids
+    :return: bitmask with a bit set for every card
+    """
+    mask = 0
+    for card in card_list:
+        mask |= 1 << card
+    return mask
+
+
+def cards_of(mask: int) -> list:
+    """
+    :param mask: bitmask of cards
+    :return: card ids in the mask, in ascending order (sorted by suit, then value)
+    """
+    card_list = []
+    while mask:
+        lowest = mask & -mask
+        card_list.append(lowest.bit_length() - 1)
+        mask ^= lowest
+    return card_list
+
+
+def count(mask: int) -> int:
+    """
+    :param mask: bitmask of cards
+    :return: amount of cards in the mask
+    """
+    return bin(mask).count("1")
+
+
+def legal_mask(hand: int, requested_color: int) -> int:
+    """
+    Mask of the cards in hand that are allowed to be played
+    :param hand: bitmask of the hand
+    :param requested_color: the requested color that has to be played if possible
+                            (blue, yellow, red, green, None yet, None this round)
+    :return: bitmask of legal cards
+    """
+    if requested_color < 4 and hand & COLORED_MASKS[requested_color]:
+        return hand & (COLORED_MASKS[requested_color] | WHITE_MASK)
+    return hand
+
+
+def legal_cards(hand: int, requested_color: int) -> list:
+    """
+    Legal cards in the order the players consider them,
+    requested cards first followed by the white cards, otherwise the sorted hand
+    :param hand: bitmask of the hand
+    :param requested_color: the requested color that has to be played if possible
+    :return: list of legal card ids
+    """
+    if requested_color < 4:
+        requested = hand & COLORED_MASKS[requested_color]
+        if requested:
+            return cards_of(requested) + cards_of(hand & WHITE_MASK)
+    return cards_of(hand)
+
+
+def one_hot(mask: int) -> list:
+    """
+    :param mask: bitmask of cards
+    :return: one-hot list of length 60
+    """
+    return [int(bit) for bit in reversed(format(mask, "060b"))]
+
+
+def one_hot_array(mask: int) -> np.ndarray:
+    """
+    :param mask: bitmask of cards
+    :return: one-hot uint8 array of length 60
+    """
+    as_bytes = np.frombuffer(mask.to_bytes(8, "little"), dtype=np.uint8)
+    return np.unpackbits(as_bytes, bitorder="little")[:NUM_CARDS]
+
+
+
+def _build_trick_table() -> np.ndarray:
+    """
+    Winner of every possible trick, indexed by [lead card, second card, third card, trump]
+    :return: int8 array of shape (60, 60, 60, 5)
+    """
+    lead, second, third, trump = np.meshgrid(
+        np.arange(NUM_CARDS), np.arange(NUM_CARDS), np.arange(NUM_CARDS), np.arange(5), indexing="ij"
+    )
+    suits = np.array(SUIT)
+    values = np.array(VALUE)
+    played = [lead, second, third]
+
+    strongest = np.zeros(lead.shape, dtype=np.int8)
+    strongest_suit = suits[lead]
+    strongest_value = values[lead]
+
+    # a wizard wins immediately, the first one played is decisive
+    decided = strongest_value == 14
+    winner = np.zeros(lead.shape, dtype=np.int8)
+
+    for i in range(1, 3):
+        suit = suits[played[i]]
+        value = values[played[i]]
+
+        wizard = ~decided & (value == 14)
+        winner[wizard] = i
+        decided |= wizard
+
+        # if i-th card is trump and strongest card is not, joker does not count as trump card
+        take = (suit == trump) & (strongest_suit != trump) & (value > 0)
+        strongest = np.where(take, i, strongest)
+        strongest_suit = np.where(take, suit, strongest_suit)
+        strongest_value = np.where(take, value, strongest_value)
+
+        # if cards are the same suit
+        take = (suit == strongest_suit) & (value > strongest_value)
+        strongest = np.where(take, i, strongest)
+        strongest_suit = np.where(take, suit, strongest_suit)
+        strongest_value = np.where(take, value, strongest_value)
+
+        # if strongest card is a joker and i-th card is not
+        take = (strongest_value == 0) & (value != 0)
+        strongest = np.where(take, i, strongest)
+        strongest_suit = np.where(take, suit, strongest_suit)
+        strongest_value = np.where(take, value, strongest_value)
+
+    return np.where(decided, winner, strongest).astype(np.int8)
+
+
+TRICK_TABLE = _build_trick_table()
+TRICK_TABLE.setflags(write=False)
+# flat copy for fast scalar lookups, index is ((lead * 60 + second) * 60 + third) * 5 + trump
+_TRICK_BYTES = TRICK_TABLE.tobytes()
+_TRICK_FLAT = TRICK_TABLE.ravel()
+
+# contiguous rows over the card at a given turn, later cards are blue jokers (card 0)
+_LEAD_ROWS = np.ascontiguousarray(TRICK_TABLE[:, 0, 0, :].T)  # [trump, lead]
+_SECOND_ROWS = np.ascontiguousarray(TRICK_TABLE[:, :, 0, :].transpose(0, 2, 1))  # [lead, trump, second]
+_THIRD_ROWS = np.ascontiguousarray(TRICK_TABLE.transpose(0, 1, 3, 2))  # [lead, second, trump, third]
+
+
+def trick_winner(lead: int, second: int, third: int, trump: int) -> int:
+    """
+    Look up the winner of a single trick
+    :param lead: card id played first
+    :param second: card id played second
+    :param third: card id played third
+    :param trump: trump-suit (4 for no trump)
+    :return: index of the winning card
+    """
+    return _TRICK_BYTES[((lead * 60 + second) * 60 + third) * 5 + trump]
+
+
+def trick_winners(lead, second, third, trump) -> np.ndarray:
+    """
+    Resolve many tricks at once, arguments are broadcast against each other
+    :param lead: array of card ids played first
+    :param second: array of card ids played second
+    :param third: array of card ids played third
+    :param trump: array of trump-suits (4 for no trump)
+    :return: array with the index of the winning card of every trick
+    """
+    index = ((np.asarray(lead, dtype=np.intp) * 60 + second) * 60 + third) * 5 + trump
+    return _TRICK_FLAT[index]
+
+
+def trick_winner_rows(played: np.ndarray, turn: int, trump: np.ndarray) -> np.ndarray:
+    """
+    Winner of many tricks for every card option of the player at position turn,
+    cards of players that still have to play are probed as blue jokers (card 0)
+    :param played: array of shape (n, 3) with the cards played before turn
+    :param turn: how manieth player is choosing a card
+    :param trump: array of trump-suits of shape (n,)
+    :return: array of shape (n, 60) with the index of the winning card for every option
+    """
+    if turn == 0:
+        return _LEAD_ROWS[trump]
+    if turn == 1:
+        return _SECOND_ROWS[played[:, 0], trump]
+    return _THIRD_ROWS[played[:, 0], played[:, 1], trump]
@@ -0,0 +1,80 @@
+import argparse
+import numpy as np
+import os
+import pickle
+import tensorflow as tf
+
+import utility_functions as util
+from numpy_model import accuracy_report, from_keras
+
+
+def parse_args() -> argparse.Namespace:
+    """
+    Function to parse arguments.
+    Returns:
+    parser: Argument parser containing arguments.
+    """
+
+    parser = argparse.ArgumentParser(description="Export saved models to .npz for NumPy inference")
+    parser.add_argument("models", nargs="+", help="Which models to export", type=str)
+    parser.add_argument("--folder", help="Where the models are saved", default="models", type=str)
+    parser.add_argument(
+        "--quantize",
+        help="optional post-training quantization of the weights, written to <name>.int8.npz "
+             "(or <name>.int8.weights) next to the float export, load it by that name",
+        choices=["int8"],
+        default=None,
+    )
+    parser.add_argument(
+        "--mapped",
+        help="publish a new version of models/<name>.weights that worker processes memory-map, instead of a .npz",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--states",
+        help="states to report the accuracy of the quantized model on, "
+             "a .npy array or a pickle with state keys (like the reoccur pickles)",
+        default=None,
+        type=str,
+    )
+    return parser.parse_args()
+
+
+def load_states(path: str, input_size: int) -> np.ndarray:
+    """
+    :param path: .npy file with states or pickle file with state keys
+    :param input_size: input size of the model
+    :return: array of shape (n, input_size)
+    """
+    if path.endswith(".npy"):
+        return np.load(path).astype(np.float32)
+    with open(path, "rb") as f:
+        keys = pickle.load(f)
+    return util.keys_to_states(input_size, keys)
+
+
+def export_models(model_names: list, folder: str, quantize=None, states_path=None, mapped=False) -> None:
+    for model_name in model_names:
+        model = from_keras(tf.keras.models.load_model(os.path.join(folder, model_name)))
+        export_name = model_name
+        if quantize:
+            quantized_model = model.quantized()
+            if states_path:
+                report = accuracy_report(model, quantized_model, load_states(states_path, model.input_size))
+                print(f"Accuracy of {quantize} {model_name}: {report}")
+            model = quantized_model
+            # never replaces the float export, callers load the quantized model by its own name
+            export_name = f"{model_name}.{quantize}"
+        if mapped:
+            mapped_path = os.path.join(folder, f"{export_name}.weights")
+            version = model.publish(mapped_path)
+            print(f"Published {model_name} as {version} of {mapped_path}")
+            continue
+        npz_path = os.path.join(folder, f"{export_name}.npz")
+        model.save(npz_path)
+        print(f"Exported {model_name} to {npz_path}")
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    export_models(args.models, args.folder, args.quantize, args.states, args.mapped)
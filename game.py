@@ -1,9 +1,11 @@
 from math import floor
 
+import cards
 import player as player_class
+import state_schema
 import numpy as np
 import os
-import random
+from playing_state import PlayingStateBuffer
 import utility_functions as util
 
 
@@ -11,7 +13,6 @@ class Game:
     def __init__(
         self,
         full_deck: list,
-        deck_dict: dict,
         guess_type: str,
         player_type: str,
         shuffled_decks=None,
@@ -31,10 +32,11 @@ class Game:
         save_folder="",
         reoccur_bool=False,
         train_every="round",
+        seed=None,
     ) -> None:
         self.verbose = verbose
+        self.seed = seed
         self.full_deck = full_deck
-        self.deck_dict = deck_dict
         self.shuffled_decks = shuffled_decks
         self.deck = None
         self.output_path = output_path
@@ -88,11 +90,14 @@ class Game:
                         temp_players.append(player)
             self.players = temp_players
         else:
-            random.shuffle(self.players)
+            util.get_random().shuffle(self.players)
 
         # at the start of the game
         self.scores = {self.player1: 0, self.player2: 0, self.player3: 0}
 
+        # playing state of every learning player, updated in place
+        self.state_buffers = dict()
+
         # for keeping track of what goes wrong for the learning agent (too high guess, too low guess)
         self.offs = [
             0,
@@ -126,32 +131,39 @@ class Game:
         return 0.0
 
 
-    def play_game(self) -> tuple:
+    def play_game(self, rounds=None) -> tuple:
         """
         Plays a single game of wizard
+        :param rounds: the rounds (1-20) to play, all by default. Other rounds are skipped without scoring,
+                       so the rounds of a game with pre-generated decks can be played separately and summed
         :return: tuple with all scores and player1 mistakes
         """
         for game_round in range(20):
-            self.played_round = []
-            if self.shuffled_decks is None:
-                self.deck = self.full_deck[:]
-                random.shuffle(self.deck)
-            else:
-                self.deck = self.shuffled_decks[game_round][:]
-            if self.verbose >= 1:
-                print(
-                    f"\nInitial player order at start of round {self.game_round}: "
-                    f"{[p.player_name for p in self.players]}")
+            if rounds is None or self.game_round in rounds:
+                self.played_round = []
+                if self.seed is not None:
+                    # every round has its own random state, so it plays the same when played on its own
+                    # or next to other games in other threads
+                    util.seed_thread(self.seed * 20 + game_round)
+                if self.shuffled_decks is None:
+                    self.deck = self.full_deck[:]
+                    util.get_random().shuffle(self.deck)
+                else:
+                    self.deck = self.shuffled_decks[game_round][:]
+                if self.verbose >= 1:
+                    print(
+                        f"\nInitial player order at start of round {self.game_round}: "
+                        f"{[p.player_name for p in self.players]}")
 
-            self.play_round()
+                self.play_round()
 
-            if self.train_every == "round":
-                # Train networks after every round/backprop
-                for player in self.players:
-                    self.train_network(player)
+                if self.train_every == "round":
+                    # Train networks after every round/backprop
+                    for player in self.players:
+                        self.train_network(player)
 
-            if self.verbose >= 2:
-                print(f"Round {self.game_round} over.. \n\n")
+                if self.verbose >= 2:
+                    print(f"Round {self.game_round} over.. \n\n")
 
             for player in self.players:
                 player.possible_cards_one = [1] * 60
@@ -188,23 +200,25 @@ class Game:
         # Players get dealt their hands
         for player in self.players:
             self.deck = player.draw_cards(self.game_round, self.deck)
+            if player.player_type.startswith("learn"):
+                player.play_agent.new_round()
         if self.game_round < 20:
             # Trump card becomes top card after hands are dealt
             trump_card = self.deck.pop()
-            if trump_card[1] == 0:
+            if cards.VALUE[trump_card] == 0:
                 # trump is a joker, no trump this round
                 self.trump = 4
-            elif trump_card[1] == 14:
+            elif cards.VALUE[trump_card] == 14:
                 # trump is a wizard, starting player decides
-                self.trump = trump_card[0]
+                self.trump = cards.SUIT[trump_card]
             else:
                 # trump is regular card
-                self.trump = trump_card[0]
+                self.trump = cards.SUIT[trump_card]
             if self.verbose >= 2:
-                print(f"Trump card: {trump_card}")
+                print(f"Trump card: {cards.card_tuple(trump_card)}")
             for player in self.players:
-                player.possible_cards_one[self.deck_dict[trump_card]] = 0
-                player.possible_cards_two[self.deck_dict[trump_card]] = 0
+                player.possible_cards_one[trump_card] = 0
+                player.possible_cards_two[trump_card] = 0
         else:
             # No trump card in final round
             self.trump = 4
@@ -243,12 +257,10 @@ class Game:
             self.played_cards = []
 
             for player in self.players:
-                if player.player_type.startswith("learn") and player.play_agent.input_size in [313, 315]:
+                if util.tracks_possible_cards(player):
                     # TODO: set possible cards to invert of one_hot_hand
                     # normal player only sees their own hand
-                    cards_in_hand = player.get_hand()
-                    for card in cards_in_hand:
-                        move = self.deck_dict[card]
+                    for move in player.get_hand():
                         player.possible_cards_one[move] = 0
                         player.possible_cards_two[move] = 0
 
@@ -318,9 +330,9 @@ class Game:
                 )
                 self.update_possible_hands(self.played_cards[-1], requested_color, player_order, player_index)
                 for player in self.players:
-                    if player.player_type.startswith("learn") and player.play_agent.input_size in [313, 315]:
+                    if util.tracks_possible_cards(player):
                         # normal player only sees their own hand
-                        move = self.deck_dict[self.played_cards[-1]]
+                        move = self.played_cards[-1]
                         player.possible_cards_one[move] = 0
                         player.possible_cards_two[move] = 0
             else:
@@ -341,20 +353,20 @@ class Game:
                     )
                     print(
                         "Players hand in playtrick with card: ",
-                        player_order[player_index].hand,
+                        player_order[player_index].get_hand(),
                     )
-                player_order[player_index].hand.remove(card)
+                player_order[player_index].remove_card(card)
                 self.played_cards.append(card)
 
             if requested_color == 4:
 
                 # Wizard means no requested color this round
-                if self.played_cards[player_index][1] == 14:
+                if cards.VALUE[self.played_cards[player_index]] == 14:
                     requested_color = 5
 
                 # Joker does not change requested color
-                elif self.played_cards[player_index][1] != 0:
-                    requested_color = self.played_cards[player_index][0]
+                elif cards.VALUE[self.played_cards[player_index]] != 0:
+                    requested_color = cards.SUIT[self.played_cards[player_index]]
 
             player_index += 1
             card = None
@@ -370,7 +382,7 @@ class Game:
 
     def update_possible_hands(self, card, requested_color, player_order, player):
         # card is not a white card, yet it is not requested color either
-        if 0 < card[1] < 14 and requested_color < 4 and requested_color != card[0]:
+        if 0 < cards.VALUE[card] < 14 and requested_color < 4 and requested_color != cards.SUIT[card]:
             if self.verbose >= 2:
                 print(f"{player} did not follow suit, they played {card} while requested color was {requested_color}")
                 print(f"Player order is {[p.player_name for p in player_order]}")
@@ -388,46 +400,6 @@ class Game:
                     self.player1.possible_cards_two[i] = 0
                     self.player2.possible_cards_two[i] = 0
 
-    def hand_state_space(self, player_order: list, player, called: str) -> list:
-        """
-        returns state space representing the hand(s) of players
-        :param player_order: list with the players in turn order
-        :param player: the player for which state is retrieved
-        :param called: whether it is a guessing or playing state space
-        :return:
-        """
-        if (called == "guess" and player.guess_agent.input_size == 188) or \
-           (called == "play" and False):
-            # Cheating player sees all three hands
-            one_hot_hand = 60 * [0]
-            one_hot_hand2 = 60 * [0]
-            one_hot_hand3 = 60 * [0]
-
-            other_players = [p for p in player_order if p != player]
-
-            cards_in_hand = player.get_hand()
-            cards_in_hand2 = other_players[0].get_hand()
-            cards_in_hand3 = other_players[1].get_hand()
-
-            for card in cards_in_hand:
-                one_hot_hand[self.deck_dict[card]] = 1
-
-            for card in cards_in_hand2:
-                one_hot_hand2[self.deck_dict[card]] = 1
-
-            for card in cards_in_hand3:
-                one_hot_hand3[self.deck_dict[card]] = 1
-
-            return one_hot_hand + one_hot_hand2 + one_hot_hand3
-        else:
-            # normal player only sees their own hand
-            cards_in_hand = player.get_hand()
-            one_hot_hand = 60 * [0]
-            for card in cards_in_hand:
-                one_hot_hand[self.deck_dict[card]] = 1
-
-            return one_hot_hand
-
     def guessing_state_space(self, player) -> np.ndarray:
         # TODO: maybe add player order?
         """
@@ -435,28 +407,31 @@ class Game:
         :param player: Player that needs the state space to make a guess
         :return: guessing state space
         """
-        state = []
-        state += self.hand_state_space(self.players, player, "guess")
-        trump = [0, 0, 0, 0, 0]
-        trump[self.trump] = 1
-        previous_guesses = self.guesses[:]
-        if len(previous_guesses) >= 2:
-            previous_guesses = previous_guesses[:2]
+        schema = state_schema.guessing_schema(player.guess_agent.input_size)
+        # cheating player sees all three hands
+        other_players = [p for p in self.players if p != player]
+        previous_guesses = self.guesses[:2]
         avg_guess = floor(self.game_round / 3)
         previous_guesses += [avg_guess] * (2 - len(previous_guesses))
-        round_number = [self.game_round]
-        state += trump + previous_guesses + round_number
-
-        if player.guess_agent.input_size == 69:
-            players_turn = self.players.index(player)
-            state += [players_turn]
-
-        if player.guess_agent.input_size == 71:
-            order_names = [int(p.player_name[-1]) for p in self.players]
-            state += order_names
+        return schema.encode(
+            {
+                "hand": player.hand,
+                "hand2": other_players[0].hand,
+                "hand3": other_players[1].hand,
+                "trump": self.trump,
+                "previous_guesses": previous_guesses,
+                "round": self.game_round,
+                "turn": self.players.index(player),
+                "order": [int(p.player_name[-1]) for p in self.players],
+            }
+        )
 
-        state_space = np.array(state, dtype=int)
-        return state_space
+    def playing_state_hash(self, player) -> int:
+        """
+        :param player: player that last requested its playing state
+        :return: zobrist hash of that playing state
+        """
+        return self.state_buffers[player].hash
 
     def playing_state_space(
         self, player_order: list, player, played_trick: list, temp=False
@@ -469,87 +444,19 @@ class Game:
         :param temp: boolean whether this is for the actual game or simulated
         :return: playing state space
         """
-        state = []
-        inp_size = player.play_agent.input_size
         if self.verbose >= 2:
             if temp:
                 print("This is a temp game call of playing_state!\n")
             else:
                 print("This is a real game call of playing_state!\n")
-
-        state += self.hand_state_space(player_order, player, "play")
-
-        trump = [0, 0, 0, 0, 0]
-        trump[self.trump] = 1
-        state += trump
-
-        if inp_size == 3731:
-            # old system, only uses other players' guesses
-            previous_guesses = []
-        else:
-            previous_guesses = [player.get_guesses()]
-
-        round_number = [self.game_round]
-        tricks_needed = [player.get_guesses() - player.get_trick_wins()]
-        tricks_needed_others = []
-
-        if self.verbose >= 2:
             print("Creating gamespace, players are in the following order: ")
             print([p.player_name for p in player_order], player.player_name)
-        for other_player in self.players:
-            # print(
-            #     f"Player {other_player.player_name}, "
-            #     f"guessed {other_player.get_guesses()} "
-            #     f"and won {other_player.get_trick_wins()}"
-            # )
-            if player != other_player:
-                tricks = other_player.get_guesses() - other_player.get_trick_wins()
-                tricks_needed_others.append(tricks)
-                previous_guesses.append(other_player.get_guesses())
-
-        state += previous_guesses + round_number + tricks_needed + tricks_needed_others
-        if inp_size % 100 == 31:
-            # old system, played_trick is unordered
-            played_this_trick = 60 * [0]
-            for card in played_trick:
-                played_this_trick[self.deck_dict[card]] = 1
-            state += played_this_trick
-        else:
-            # played trick is ordered in order of play
-            played_this_trick = 120 * [0]
-
-            if inp_size % 100 == 93 or inp_size == 313:
-                players_turn = player_order.index(player)
-                state += [players_turn]
-            elif inp_size % 100 == 95 or inp_size == 315:
-                order_names = [int(p.player_name[-1]) for p in player_order]
-                state += order_names
-
-            for card in played_trick:
-                one_hot = self.deck_dict[card]
-                offset = played_trick.index(card) * 60
-                played_this_trick[one_hot + offset] = 1
-            state += played_this_trick
-
-        if inp_size > 3600:
-            # 20 rounds of 3 cards that are one-hot encoded
-            played_this_round = 3600 * [0]
-            for trick in range(len(self.played_round)):
-                trick_plays = self.played_round[trick]
-                for turn in range(3):
-                    card = trick_plays[turn]
-                    one_hot = self.deck_dict[card]
-                    played_this_round[one_hot + turn * 60 + trick * 180] = 1
-            state += played_this_round
-
-        if inp_size in [313, 315]:
-            state += player.possible_cards_one + player.possible_cards_two
-
-        state_space = np.array(state, dtype=int)
-        if len(state) != inp_size:
-            print(f"Input size is wrong, state is length {len(state)} while inp_size is {inp_size}")
-            exit()
-        return state_space
+
+        if player not in self.state_buffers:
+            self.state_buffers[player] = PlayingStateBuffer(player.play_agent.input_size)
+        return self.state_buffers[player].update(
+            self, player_order, player, played_trick, (player.possible_cards_one, player.possible_cards_two)
+        )
 
     def update_scores(self) -> None:
         """
@@ -637,7 +544,7 @@ class Game:
                 print("This is a temp call: \n")
             print(
                 f"\nOrder: {[player.player_name for player in player_order]}, "
-                f"\nPlayed: {self.played_cards}"
+                f"\nPlayed: {[cards.card_tuple(card) for card in self.played_cards]}"
                 f"\n{self.trump}, "
                 f"\nWinner: {winner_index}\n"
             )
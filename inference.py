@@ -0,0 +1,26 @@
+import numpy as np
+import tensorflow as tf
+
+
+class CompiledForward:
+    """
+    Forward pass of a keras model as a tf.function, traced once for a batch of any size.
+    Skips the data adapter and callbacks that model.predict sets up on every call
+    """
+    def __init__(self, model, input_size: int):
+        self.model = model
+        self.input_size = input_size
+        self.function = None
+
+    def __call__(self, states) -> np.ndarray:
+        """
+        :param states: a single state or an array of shape (n, input_size)
+        :return: model output for every state, of shape (n, output_size)
+        """
+        if self.function is None:
+            self.function = tf.function(
+                lambda x: self.model(x, training=False),
+                input_signature=[tf.TensorSpec(shape=(None, self.input_size), dtype=tf.float32)],
+            )
+        states = np.asarray(states, dtype=np.float32).reshape(-1, self.input_size)
+        return self.function(states).numpy()
@@ -0,0 +1,69 @@
+from collections import OrderedDict
+
+CACHE_SIZE = 100000  # How many network outputs to keep per network, 0 disables the cache
+
+
+class InferenceCache:
+    """
+    Bounded LRU cache of network outputs by state key.
+    Every change of the model (training or loading another one) bumps its version,
+    which drops all outputs of the previous version
+    """
+    def __init__(self, max_size=CACHE_SIZE):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, key):
+        """
+        :param key: key of the state
+        :return: cached output of the state, None if it is not cached
+        """
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value) -> None:
+        """
+        Cache an output, the least recently used output is dropped when the cache is full
+        :param key: key of the state
+        :param value: network output for the state
+        :return: None
+        """
+        if self.max_size <= 0:
+            return
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def bump_version(self) -> None:
+        """
+        The model changed, cached outputs are no longer valid
+        :return: None
+        """
+        self.version += 1
+        self.entries.clear()
+
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def reset_counters(self) -> None:
+        self.hits = 0
+        self.misses = 0
+
+    def __str__(self) -> str:
+        return (
+            f"{self.hits} hits, {self.misses} misses ({self.hit_rate():.1%}), "
+            f"{len(self.entries)} cached, model version {self.version}"
+        )
@@ -1,15 +1,17 @@
 import random
 from math import floor
 
+import cards
 import numpy as np
 import player as player_class
+import state_schema
+from playing_state import PlayingStateBuffer
 import utility_functions as util
 
 
 class Game:
     def __init__(
         self,
-        deck_dict: dict,
         guess_type: str,
         player_type: str,
         game_round: int,
@@ -18,7 +20,6 @@ class Game:
         playing_agent=None,
     ) -> None:
 
-        self.deck_dict = deck_dict
         self.deck = None
         self.trump = 4  # placeholder trump, only 0-3 exist
         self.game_round = game_round
@@ -56,6 +57,7 @@ class Game:
         # for playing state
         self.player1.possible_cards_one = [1] * 60
         self.player1.possible_cards_two = [1] * 60
+        self.state_buffer = None
 
     def play_game(self) -> None:
         """
@@ -79,6 +81,8 @@ class Game:
         :return: None
         """
         print(f"\nPlaying round {self.game_round}, order: {[p.player_name for p in self.players]}")
+        if self.player1.player_type.startswith("learn"):
+            self.player1.play_agent.new_round()
         # Player hand
         hand = set(input("Cards in hand? (seperated by space): ").split())
         if len(hand) != self.game_round:
@@ -90,22 +94,21 @@ class Game:
             converted_hand.append(util.str_to_card(card, converted_hand))
         converted_hand.sort(key=lambda x: (x[0], x[1]))
         print(f"Player hand: {converted_hand}")
-        self.player1.hand = converted_hand
-        for card in converted_hand:
-            move = self.deck_dict[card]
+        self.player1.hand = cards.mask_of(cards.deck_to_ids(converted_hand))
+        for move in self.player1.get_hand():
             self.player1.possible_cards_one[move] = 0
             self.player1.possible_cards_two[move] = 0
 
         if self.game_round < 20:
             # Trump card becomes top card after hands are dealt
-            trump_card = util.str_to_card(input("What is the trump card?: "))
-            if trump_card[1] == 0:
+            trump_card = cards.card_id(util.str_to_card(input("What is the trump card?: ")))
+            if cards.VALUE[trump_card] == 0:
                 # trump is a joker, no trump this round
                 self.trump = 4
-            elif trump_card[1] == 14:
+            elif cards.VALUE[trump_card] == 14:
                 # trump is a wizard, dealer decides
                 if self.players[-1].player_name == "player1":
-                    self.trump = trump_card[0]
+                    self.trump = cards.SUIT[trump_card]
                 else:
                     trump_suit = input("What is the trump suit?: ")
                     suits = {"blue": 0, "yellow": 1, "red": 2, "green": 3, "b": 0, "y": 1, "r": 2, "g": 3}
@@ -116,9 +119,9 @@ class Game:
                     self.trump = suits[trump_suit]
             else:
                 # trump is regular card
-                self.trump = trump_card[0]
-            self.player1.possible_cards_one[self.deck_dict[trump_card]] = 0
-            self.player1.possible_cards_two[self.deck_dict[trump_card]] = 0
+                self.trump = cards.SUIT[trump_card]
+            self.player1.possible_cards_one[trump_card] = 0
+            self.player1.possible_cards_two[trump_card] = 0
         else:
             # No trump card in final round
             self.trump = 4
@@ -196,30 +199,30 @@ class Game:
                     # play the passed card to simulate that child-node
                     assert card in player_order[player_index].get_hand(), f"Card {card} is not in hand " \
                                                                           f"{player_order[player_index].get_hand()}."
-                    player_order[player_index].hand.remove(card)
+                    player_order[player_index].remove_card(card)
                     self.played_cards.append(card)
 
             else:
                 card = input(f"What card is played by {player_order[player_index].player_name}: ")
-                card = util.str_to_card(card)
+                card = cards.card_id(util.str_to_card(card))
                 self.played_cards.append(card)
 
             self.update_possible_hands(card, requested_color, player_order, player_index)
 
             if requested_color == 4:
                 # Wizard means no requested color this round
-                if self.played_cards[player_index][1] == 14:
+                if cards.VALUE[self.played_cards[player_index]] == 14:
                     requested_color = 5
 
                 # Joker does not change requested color
-                elif self.played_cards[player_index][1] != 0:
-                    requested_color = self.played_cards[player_index][0]
+                elif cards.VALUE[self.played_cards[player_index]] != 0:
+                    requested_color = cards.SUIT[self.played_cards[player_index]]
 
             player_index += 1
             card = None
 
-            if self.player1.player_type.startswith("learn") and self.player1.play_agent.input_size in [313, 315]:
-                move = self.deck_dict[card]
+            if util.tracks_possible_cards(self.player1):
+                move = self.played_cards[-1]
                 self.player1.possible_cards_one[move] = 0
                 self.player1.possible_cards_two[move] = 0
 
@@ -228,82 +231,44 @@ class Game:
 
     def update_possible_hands(self, card, requested_color, player_order, player):
         # card is not a white card, yet it is not requested color either
-        if 0 < card[1] < 14 and requested_color < 4 and requested_color != card[0]:
+        if 0 < cards.VALUE[card] < 14 and requested_color < 4 and requested_color != cards.SUIT[card]:
             for i in range(1 + 15 * requested_color, 15 * (requested_color + 1) - 1):
                 if player_order[player].player_name == "player2":
                     self.player1.possible_cards_one[i] = 0
                 elif player_order[player].player_name == "player3":
                     self.player1.possible_cards_two[i] = 0
 
-    def hand_state_space(self, player_order: list, player, called: str) -> list:
-        """
-        returns state space representing the hand(s) of players
-        :param player_order: list with the players in turn order
-        :param player: the player for which state is retrieved
-        :param called: whether it is a guessing or playing state space
-        :return:
-        """
-        if (called == "guess" and player.guess_agent.input_size == 188) or \
-           (called == "play" and (player.play_agent.input_size == 3915 or
-                                  player.play_agent.input_size == 315)):
-            # Cheating player sees all three hands
-            one_hot_hand = 60 * [0]
-            one_hot_hand2 = 60 * [0]
-            one_hot_hand3 = 60 * [0]
-
-            other_players = [p for p in player_order if p != player]
-
-            cards_in_hand = player.get_hand()
-            cards_in_hand2 = other_players[0].get_hand()
-            cards_in_hand3 = other_players[1].get_hand()
-
-            for card in cards_in_hand:
-                one_hot_hand[self.deck_dict[card]] = 1
-
-            for card in cards_in_hand2:
-                one_hot_hand2[self.deck_dict[card]] = 1
-
-            for card in cards_in_hand3:
-                one_hot_hand3[self.deck_dict[card]] = 1
-
-            return one_hot_hand + one_hot_hand2 + one_hot_hand3
-        else:
-            # normal player only sees their own hand
-            cards_in_hand = player.get_hand()
-            one_hot_hand = 60 * [0]
-            for card in cards_in_hand:
-                one_hot_hand[self.deck_dict[card]] = 1
-
-            return one_hot_hand
-
     def guessing_state_space(self, player) -> np.ndarray:
         """
         Obtain the state space used to predict during the guessing phase
         :param player: Player that needs the state space to make a guess
         :return: guessing state space
         """
-        state = []
-        state += self.hand_state_space(self.players, player, "guess")
-        trump = [0, 0, 0, 0, 0]
-        trump[self.trump] = 1
-        previous_guesses = self.guesses[:]
-        if len(previous_guesses) >= 2:
-            previous_guesses = previous_guesses[:2]
+        schema = state_schema.guessing_schema(player.guess_agent.input_size)
+        # cheating player sees all three hands
+        other_players = [p for p in self.players if p != player]
+        previous_guesses = self.guesses[:2]
         avg_guess = floor(self.game_round / 3)
         previous_guesses += [avg_guess] * (2 - len(previous_guesses))
-        round_number = [self.game_round]
-        state += trump + previous_guesses + round_number
-
-        if player.guess_agent.input_size == 69:
-            players_turn = self.players.index(player)
-            state += [players_turn]
-
-        if player.guess_agent.input_size == 71:
-            order_names = [int(p.player_name[-1]) for p in self.players]
-            state += order_names
+        return schema.encode(
+            {
+                "hand": player.hand,
+                "hand2": other_players[0].hand,
+                "hand3": other_players[1].hand,
+                "trump": self.trump,
+                "previous_guesses": previous_guesses,
+                "round": self.game_round,
+                "turn": self.players.index(player),
+                "order": [int(p.player_name[-1]) for p in self.players],
+            }
+        )
 
-        state_space = np.array(state, dtype=int)
-        return state_space
+    def playing_state_hash(self, player) -> int:
+        """
+        :param player: player that last requested its playing state
+        :return: zobrist hash of that playing state
+        """
+        return self.state_buffer.hash
 
     def playing_state_space(
         self, player_order: list, player, played_trick: list, temp=False
@@ -316,81 +281,16 @@ class Game:
         :param temp: boolean whether this is for the actual game or simulated
         :return: playing state space
         """
-        state = []
-        inp_size = player.play_agent.input_size
-
-        state += self.hand_state_space(player_order, player, "play")
-
-        trump = [0, 0, 0, 0, 0]
-        trump[self.trump] = 1
-        state += trump
-
-        if inp_size == 3731:
-            # old system, only uses other players' guesses
-            previous_guesses = []
-        else:
-            previous_guesses = [player.get_guesses()]
-
-        round_number = [self.game_round]
-        tricks_needed = [player.get_guesses() - player.get_trick_wins()]
-        tricks_needed_others = []
-
-        for other_player in self.players:
-            # print(
-            #     f"Player {other_player.player_name}, "
-            #     f"guessed {other_player.get_guesses()} "
-            #     f"and won {other_player.get_trick_wins()}"
-            # )
-            if player != other_player:
-                tricks = other_player.get_guesses() - other_player.get_trick_wins()
-                tricks_needed_others.append(tricks)
-                previous_guesses.append(other_player.get_guesses())
-
-        state += previous_guesses + round_number + tricks_needed + tricks_needed_others
-        if inp_size % 100 == 31:
-            # old system, played_trick is unordered
-            played_this_trick = 60 * [0]
-            for card in played_trick:
-                played_this_trick[self.deck_dict[card]] = 1
-            state += played_this_trick
-        else:
-            # played trick is ordered in order of play
-            played_this_trick = 120 * [0]
-
-            if inp_size % 100 == 93 or inp_size == 313:
-                players_turn = player_order.index(player)
-                state += [players_turn]
-            elif inp_size % 100 == 95 or inp_size == 315:
-                order_names = [int(p.player_name[-1]) for p in player_order]
-                state += order_names
-
-            for card in played_trick:
-                one_hot = self.deck_dict[card]
-                offset = played_trick.index(card) * 60
-                played_this_trick[one_hot + offset] = 1
-            state += played_this_trick
-
-        if inp_size > 3600:
-            # 20 rounds of 3 cards that are one-hot encoded
-            played_this_round = 3600 * [0]
-            for trick in range(len(self.played_round)):
-                trick_plays = self.played_round[trick]
-                for turn in range(3):
-                    card = trick_plays[turn]
-                    one_hot = self.deck_dict[card]
-                    played_this_round[one_hot + turn * 60 + trick * 180] = 1
-            state += played_this_round
-
-        if inp_size in [313, 315]:
-            # TODO: add 60 for each other player to determine which cards they might have
-            state += self.player1.possible_cards_one + self.player1.possible_cards_two
-
-        state_space = np.array(state, dtype=int)
-        if len(state) != inp_size:
-            print(f"Len state is {len(state)}, len inp is {inp_size}")
-            print("Input size is wrong")
-            exit()
-        return state_space
+        if self.state_buffer is None:
+            self.state_buffer = PlayingStateBuffer(player.play_agent.input_size)
+        # TODO: add 60 for each other player to determine which cards they might have
+        return self.state_buffer.update(
+            self,
+            player_order,
+            player,
+            played_trick,
+            (self.player1.possible_cards_one, self.player1.possible_cards_two),
+        )
 
     def wrap_up_trick(self, player_order: list, temp: bool) -> tuple:
         """
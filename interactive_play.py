@@ -1,9 +1,8 @@
 import argparse
-import os
-import tensorflow as tf
 import interactive_game
 
 from Guessing_Agent import GuessingAgent
+from numpy_model import load_model
 from Playing_Agent import PlayingAgent
 
 
@@ -51,29 +50,16 @@ def int_game(
     shuffled_players: list,
 ) -> None:
 
-    # Make the deck
-    full_deck = []
-    deck_dict = {}
-
-    for suit in range(4):  # (blue, yellow, red, green)
-        for card_value in range(15):  # (joker, 1-13, wizard)
-            full_deck.append((suit, card_value))
-
-            # to go from card to index
-            deck_dict[(suit, card_value)] = card_value + suit * 15
-
     print("Pair: ", guessing_model, playing_model)
-    guess_agent = GuessingAgent(input_size=guess_inp_size, guess_max=21)
-    playing_agent = PlayingAgent(input_size=player_inp_size, interactive=True)
+    guess_agent = GuessingAgent(input_size=guess_inp_size, guess_max=21, build_model=False)
+    playing_agent = PlayingAgent(input_size=player_inp_size, interactive=True, build_model=False)
 
     if guessing_model == "heuristic" or guessing_model == "random":
         guess_type = guessing_model
 
     else:
         if guessing_model != "none":
-            guess_agent.model = tf.keras.models.load_model(
-                os.path.join("models", guessing_model)
-            )
+            guess_agent.model = load_model(guessing_model)
         guess_type = "learned"
         print(f"Loaded model {guessing_model}, guess_type: {guess_type}")
 
@@ -82,19 +68,18 @@ def int_game(
 
     else:
         if playing_model != "none":
-            playing_agent.network_policy.model = tf.keras.models.load_model(
-                os.path.join("models", playing_model)
-            )
+            playing_agent.network_policy.model = load_model(playing_model)
         player_type = "learned"
         print(f"Loaded model {playing_model}, player_type: {player_type}")
 
-    print(guess_agent.model.summary())
-    print(f"Guesser loss-function: ", guess_agent.model.loss)
-    print(playing_agent.network_policy.model.summary())
-    print(f"Player loss-function: ", playing_agent.network_policy.model.loss)
+    if guess_type == "learned":
+        print(guess_agent.model.summary())
+        print(f"Guesser loss-function: ", guess_agent.model.loss)
+    if player_type == "learned":
+        print(playing_agent.network_policy.model.summary())
+        print(f"Player loss-function: ", playing_agent.network_policy.model.loss)
 
     wizard = interactive_game.Game(
-        deck_dict,
         guess_type=guess_type,
         player_type=player_type,
         game_round=game_round,
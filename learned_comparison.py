@@ -1,13 +1,18 @@
 import argparse
+import cards
 import game
 import matplotlib.pyplot as plt
+import multiprocessing
 import numpy as np
 import os
 import pickle
 import statistics
-import tensorflow as tf
+from batched_inference import InferenceBatcher, MAX_BATCH, MAX_WAIT, run_lockstep
 from Guessing_Agent import GuessingAgent
+from mpi_launch import get_comm, local_rank
+from numpy_model import NumpyModel, load_model
 from Playing_Agent import PlayingAgent
+from thread_budget import CONFIG_PATH, apply_thread_budget
 
 
 def parse_args() -> argparse.Namespace:
@@ -72,6 +77,47 @@ def parse_args() -> argparse.Namespace:
         type=int,
         default=0,
     )
+    parser.add_argument(
+        "--concurrent_games",
+        help="How many games to play at the same time, their network calls are evaluated in batches",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--max_batch",
+        help="Most states in one batched forward pass",
+        type=int,
+        default=MAX_BATCH,
+    )
+    parser.add_argument(
+        "--max_wait",
+        help="Seconds a network call waits for the other games before it is evaluated",
+        type=float,
+        default=MAX_WAIT,
+    )
+    parser.add_argument(
+        "--thread_config",
+        help="thread budget config written by thread_probe.py",
+        type=str,
+        default=CONFIG_PATH,
+    )
+    parser.add_argument(
+        "--workers",
+        help="How many processes play the games, each loads the models once",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--shard",
+        help="What a worker plays at a time: whole games, or single rounds for a better balanced load",
+        choices=["game", "round"],
+        default="game",
+    )
+    parser.add_argument(
+        "--mpi",
+        help="Launched with mpirun, the ranks share the games and rank 0 gathers the results",
+        action="store_true",
+    )
 
     return parser.parse_args()
 
@@ -97,93 +143,44 @@ def learned_n_games(
     opp_playmodel: str,
     opp_size: int,
     opp_play_size: int,
+    concurrent_games=1,
+    max_batch=MAX_BATCH,
+    max_wait=MAX_WAIT,
+    workers=1,
+    shard="game",
+    thread_config=CONFIG_PATH,
+    comm=None,
 ) -> None:
 
-    # Make the deck
-    full_deck = []
-    deck_dict = {}
+    # Make the deck, cards are ids (value + suit * 15) inside the engine
+    full_deck = cards.new_deck()
 
-    for suit in range(4):  # (blue, yellow, red, green)
-        for card_value in range(15):  # (joker, 1-13, wizard)
-            full_deck.append((suit, card_value))
-
-            # to go from card to index
-            deck_dict[(suit, card_value)] = card_value + suit * 15
-
-    all_decks = pickle.load(open(f"{games_folder}/decks.pkl", "rb"))
+    # pre-generated decks are stored as (suit, value) tuples
+    all_decks = [cards.deck_to_ids(deck) for deck in pickle.load(open(f"{games_folder}/decks.pkl", "rb"))]
     all_players = pickle.load(open(f"{games_folder}/players.pkl", "rb"))
     print(len(all_decks), len(all_players), len(all_decks[0]), len(all_players[0]))
 
     print("Pair: ", guessing_model, playing_model)
-    guess_agent = GuessingAgent(input_size=guess_inp_size, guess_max=21)
-    playing_agent = PlayingAgent(input_size=player_inp_size, verbose=verbose)
-
-    if guessing_model == "heuristic" or guessing_model == "random":
-        guess_type = guessing_model
-
-    else:
-        guess_agent.model = tf.keras.models.load_model(
-            os.path.join("models", guessing_model)
-        )
-        guess_type = "learned"
-
-    if playing_model == "heuristic" or playing_model == "random":
-        player_type = playing_model
-
-    else:
-        playing_agent.network_policy.model = tf.keras.models.load_model(
-            os.path.join("models", playing_model)
-        )
-        player_type = "learned"
-
-    guess_agent2 = None
-    playing_agent2 = None
-    guess_agent3 = None
-    playing_agent3 = None
+    agent_settings = (
+        guessing_model, playing_model, guess_inp_size, player_inp_size, verbose,
+        opp_guesstype, opp_playertype, opp_model, opp_playmodel, opp_size, opp_play_size,
+    )
+    agents, guess_type, player_type = load_agents(*agent_settings)
+    guess_agent, playing_agent, guess_agent2, playing_agent2, guess_agent3, playing_agent3 = agents
 
-    if opp_guesstype == "learned":
-        print("Creating guess agents for opponents..")
-        if opp_size == 0:
-            opp_size = guess_inp_size
-        guess_agent2 = GuessingAgent(input_size=opp_size, guess_max=21)
-        guess_agent3 = GuessingAgent(input_size=opp_size, guess_max=21)
+    if guess_agent2 is not None:
         print("\n")
         guess_agent2.model.summary()
-
-        if opp_model == "":
-            print("No guessing agent passed to load to opponents")
-        else:
-            print(f"Loading saved guessing model {opp_model} to opponents")
-            guess_agent2.model = tf.keras.models.load_model(
-                os.path.join("models", opp_model)
-            )
-            guess_agent3.model = tf.keras.models.load_model(
-                os.path.join("models", opp_model)
-            )
-
-    if opp_playertype == "learned":
-        if opp_play_size == 0:
-            opp_play_size = player_inp_size
-        playing_agent2 = PlayingAgent(input_size=opp_play_size, verbose=verbose)
-        playing_agent3 = PlayingAgent(input_size=opp_play_size, verbose=verbose)
+    if playing_agent2 is not None:
         print("\n")
         playing_agent2.network_policy.model.summary()
 
-        if opp_playmodel == "":
-            print("No playing agent passed to load to opponents")
-        else:
-            print(f"Loading saved playing model {opp_playmodel} to opponents")
-            playing_agent2.network_policy.model = tf.keras.models.load_model(
-                os.path.join("models", opp_playmodel)
-            )
-            playing_agent3.network_policy.model = tf.keras.models.load_model(
-                os.path.join("models", opp_playmodel)
-            )
-
-    print(guess_agent.model.summary())
-    print(f"Guesser loss-function: ", guess_agent.model.loss)
-    print(playing_agent.network_policy.model.summary())
-    print(f"Player loss-function: ", playing_agent.network_policy.model.loss)
+    if guess_type == "learned":
+        print(guess_agent.model.summary())
+        print(f"Guesser loss-function: ", guess_agent.model.loss)
+    if player_type == "learned":
+        print(playing_agent.network_policy.model.summary())
+        print(f"Player loss-function: ", playing_agent.network_policy.model.loss)
 
     pair_name = (guessing_model, playing_model)
 
@@ -199,29 +196,58 @@ def learned_n_games(
     total_actual = np.zeros(21, dtype=int)
     total_overshoot = np.zeros(20, dtype=int)
 
+    learned = (
+        guess_type == "learned",
+        player_type == "learned",
+        opp_guesstype == "learned",
+        opp_playertype == "learned",
+        opp_guesstype == "learned",
+        opp_playertype == "learned",
+    )
+
+    def play(game_number, game_agents, rounds=None):
+        return play_generated_game(
+            game_number, full_deck, all_decks, all_players, guess_type, player_type, game_agents, verbose,
+            opp_guesstype, opp_playertype, rounds,
+        )
+
+    batcher = None
+    results = None
+    settings = {
+        "games": n,
+        "shard": shard,
+        "games_folder": games_folder,
+        "agents": agent_settings,
+        "verbose": verbose,
+        "opp_guesstype": opp_guesstype,
+        "opp_playertype": opp_playertype,
+        "thread_config": thread_config,
+    }
+    if comm is not None:
+        results = play_in_mpi(comm, settings, lambda game_number, rounds: play(game_number, agents, rounds))
+    elif workers > 1:
+        results = play_in_workers(n, workers, shard, settings)
+    elif concurrent_games > 1:
+        # games are played in threads with their own agents, sharing the models through one batcher
+        batcher = InferenceBatcher(max_batch, max_wait)
+        batch_forward_passes(agents, learned, batcher)
+        worker_agents = [agents] + [copy_agents(agents, learned) for _ in range(concurrent_games - 1)]
+        results = run_lockstep(
+            [
+                lambda game_agents, game_number=game_number: play(game_number, game_agents)
+                for game_number in range(1, n + 1)
+            ],
+            worker_agents,
+            batcher,
+        )
+
     for game_instance in range(1, n + 1):
         print(f"Game instance: {game_instance}")
-        shuffled_decks = all_decks[
-            (game_instance - 1) * 20: (game_instance - 1) * 20 + 20
-        ]
-        shuffled_players = all_players[game_instance - 1]
-        off_game, scores, offs, round_offs, guess_distribution, actual_distribution, overshoot = play_game(
-            full_deck,
-            deck_dict,
-            guess_type,
-            player_type,
-            shuffled_decks,
-            shuffled_players,
-            guess_agent,
-            playing_agent,
-            verbose,
-            opp_guesstype=opp_guesstype,
-            opp_playertype=opp_playertype,
-            guess_agent2=guess_agent2,
-            playing_agent2=playing_agent2,
-            guess_agent3=guess_agent3,
-            playing_agent3=playing_agent3,
-        )
+        if results is None:
+            result = play(game_instance, agents)
+        else:
+            result = results[game_instance - 1]
+        off_game, scores, offs, round_offs, guess_distribution, actual_distribution, overshoot = result
         total_distribution = np.add(total_distribution, guess_distribution)
         total_actual = np.add(total_actual, actual_distribution)
         total_round_offs = np.add(total_round_offs, round_offs)
@@ -269,6 +295,14 @@ def learned_n_games(
     print(f"Guesses: {list(total_distribution)}")
     print(f"Actual: {list(total_actual)}")
     print(f"Total round offs: {list(total_round_offs)}")
+    # the caches of worker processes stay in the workers
+    local = workers <= 1 and comm is None
+    if guess_type == "learned" and local:
+        print(f"Guess cache: {guess_agent.cache}")
+    if player_type == "learned" and local:
+        print(f"Play cache: {playing_agent.network_policy.cache}")
+    if batcher is not None:
+        print(f"Batched inference: {batcher}")
 
     plt.hist(scores_player1, bins=30)
     if not os.path.exists("plots/score_plots/"):
@@ -277,9 +311,304 @@ def learned_n_games(
     plt.close()
 
 
+def load_agents(
+    guessing_model: str,
+    playing_model: str,
+    guess_inp_size: int,
+    player_inp_size: int,
+    verbose: int,
+    opp_guesstype: str,
+    opp_playertype: str,
+    opp_model: str,
+    opp_playmodel: str,
+    opp_size: int,
+    opp_play_size: int,
+) -> tuple:
+    """
+    Create the agents of the three players and load their models, the opponents share one model
+    :return: the guessing and playing agents of the three players, guess type and player type of player 1
+    """
+    guess_agent = GuessingAgent(input_size=guess_inp_size, guess_max=21, build_model=False)
+    playing_agent = PlayingAgent(input_size=player_inp_size, verbose=verbose, build_model=False)
+
+    if guessing_model == "heuristic" or guessing_model == "random":
+        guess_type = guessing_model
+
+    else:
+        guess_agent.model = load_model(guessing_model)
+        guess_type = "learned"
+
+    if playing_model == "heuristic" or playing_model == "random":
+        player_type = playing_model
+
+    else:
+        playing_agent.network_policy.model = load_model(playing_model)
+        player_type = "learned"
+
+    guess_agent2 = None
+    playing_agent2 = None
+    guess_agent3 = None
+    playing_agent3 = None
+
+    if opp_guesstype == "learned":
+        print("Creating guess agents for opponents..")
+        if opp_size == 0:
+            opp_size = guess_inp_size
+        guess_agent2 = GuessingAgent(input_size=opp_size, guess_max=21, build_model=False)
+        guess_agent3 = GuessingAgent(input_size=opp_size, guess_max=21, build_model=False)
+
+        if opp_model == "":
+            print("No guessing agent passed to load to opponents")
+        else:
+            print(f"Loading saved guessing model {opp_model} to opponents")
+            guess_agent2.model = load_model(opp_model)
+            guess_agent3.share_model(guess_agent2)
+
+    if opp_playertype == "learned":
+        if opp_play_size == 0:
+            opp_play_size = player_inp_size
+        playing_agent2 = PlayingAgent(input_size=opp_play_size, verbose=verbose, build_model=False)
+        playing_agent3 = PlayingAgent(input_size=opp_play_size, verbose=verbose, build_model=False)
+
+        if opp_playmodel == "":
+            print("No playing agent passed to load to opponents")
+        else:
+            print(f"Loading saved playing model {opp_playmodel} to opponents")
+            playing_agent2.network_policy.model = load_model(opp_playmodel)
+            playing_agent3.network_policy.share_model(playing_agent2.network_policy)
+
+    agents = (guess_agent, playing_agent, guess_agent2, playing_agent2, guess_agent3, playing_agent3)
+    return agents, guess_type, player_type
+
+
+def batch_forward_passes(agents: tuple, learned: tuple, batcher: InferenceBatcher) -> None:
+    """
+    Give the learned agents with keras models a forward pass that is batched with the other games
+    :param agents: guessing and playing agents of the three players
+    :param learned: for every agent whether it uses its model
+    :param batcher: batcher of the concurrent games
+    :return: None
+    """
+    wrapped = dict()
+    for agent, uses_model in zip(agents, learned):
+        if not uses_model:
+            continue
+        network = agent if isinstance(agent, GuessingAgent) else agent.network_policy
+        if isinstance(network.forward, NumpyModel):
+            # exported models have little overhead per call and keep their sparse first layer
+            continue
+        if id(network.model) not in wrapped:
+            wrapped[id(network.model)] = batcher.wrap(network.forward, network.input_size)
+        network.forward = wrapped[id(network.model)]
+
+
+def copy_agents(agents: tuple, learned: tuple) -> tuple:
+    """
+    Agents for another concurrent game, learned agents share the model and forward pass of the original
+    :param agents: guessing and playing agents of the three players
+    :param learned: for every agent whether it uses its model
+    :return: new agents in the same order
+    """
+    copies = []
+    for agent, uses_model in zip(agents, learned):
+        if agent is None:
+            copies.append(None)
+            continue
+        if isinstance(agent, GuessingAgent):
+            copy = GuessingAgent(input_size=agent.input_size, guess_max=agent.guess_max, build_model=False)
+            network, copy_network = agent, copy
+        else:
+            copy = PlayingAgent(input_size=agent.input_size, verbose=agent.verbose, build_model=False)
+            network, copy_network = agent.network_policy, copy.network_policy
+        if uses_model:
+            copy_network.model = network.model
+            copy_network.forward = network.forward
+        copies.append(copy)
+    return tuple(copies)
+
+
+def play_generated_game(
+    game_number: int,
+    full_deck: list,
+    all_decks: list,
+    all_players: list,
+    guess_type: str,
+    player_type: str,
+    agents: tuple,
+    verbose: int,
+    opp_guesstype: str,
+    opp_playertype: str,
+    rounds=None,
+) -> tuple:
+    """
+    Play a game of the generated games, seeded by its number so it plays the same in any process
+    :param game_number: number of the game in the generated games, from 1
+    :param agents: guessing and playing agents of the three players
+    :param rounds: the rounds to play, all by default
+    :return: result of play_game
+    """
+    return play_game(
+        full_deck,
+        guess_type,
+        player_type,
+        all_decks[(game_number - 1) * 20: (game_number - 1) * 20 + 20],
+        all_players[game_number - 1],
+        agents[0],
+        agents[1],
+        verbose,
+        opp_guesstype=opp_guesstype,
+        opp_playertype=opp_playertype,
+        guess_agent2=agents[2],
+        playing_agent2=agents[3],
+        guess_agent3=agents[4],
+        playing_agent3=agents[5],
+        seed=game_number,
+        rounds=rounds,
+    )
+
+
+# games and agents of a worker process, loaded once by init_worker
+worker_state = dict()
+
+
+def init_worker(settings: dict, workers_started) -> None:
+    """
+    Prepare a worker process of the pool before it plays its first task
+    :param settings: settings of the run, see load_worker
+    :param workers_started: shared counter that gives every worker its index
+    :return: None
+    """
+    with workers_started.get_lock():
+        index = workers_started.value
+        workers_started.value += 1
+    apply_thread_budget(settings["thread_config"], worker=index)
+    load_worker(settings)
+
+
+def load_worker(settings: dict) -> None:
+    """
+    Load the generated games and the models of a worker process or MPI rank once
+    :param settings: games folder, agent settings, verbosity and thread config of the run
+    :return: None
+    """
+    agents, guess_type, player_type = load_agents(*settings["agents"])
+    games_folder = settings["games_folder"]
+    worker_state.update(
+        settings,
+        agents=agents,
+        guess_type=guess_type,
+        player_type=player_type,
+        full_deck=cards.new_deck(),
+        all_decks=[cards.deck_to_ids(deck) for deck in pickle.load(open(f"{games_folder}/decks.pkl", "rb"))],
+        all_players=pickle.load(open(f"{games_folder}/players.pkl", "rb")),
+    )
+
+
+def play_task(task: tuple) -> tuple:
+    """
+    Play a task in a worker process
+    :param task: game number and the rounds to play, None for the whole game
+    :return: game number and the result of its rounds
+    """
+    game_number, rounds = task
+    return game_number, play_generated_game(
+        game_number,
+        worker_state["full_deck"],
+        worker_state["all_decks"],
+        worker_state["all_players"],
+        worker_state["guess_type"],
+        worker_state["player_type"],
+        worker_state["agents"],
+        worker_state["verbose"],
+        worker_state["opp_guesstype"],
+        worker_state["opp_playertype"],
+        rounds,
+    )
+
+
+def play_in_workers(n: int, workers: int, shard: str, settings: dict) -> list:
+    """
+    Play the games in a pool of worker processes, split into whole games or single rounds
+    :param n: how many games to play
+    :param workers: number of worker processes
+    :param shard: "game" or "round"
+    :param settings: settings for init_worker
+    :return: the result of every game, in the order of the games
+    """
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(workers, initializer=init_worker, initargs=(settings, context.Value("i", 0))) as pool:
+        return merge_games(n, pool.imap_unordered(play_task, shard_tasks(n, shard)))
+
+
+def play_in_mpi(comm, settings: dict, play) -> list:
+    """
+    Play the games across the ranks of an MPI run, every rank plays an equal share of the tasks.
+    Rank 0 uses the agents it already loaded and gathers the results of the other ranks
+    :param comm: world communicator
+    :param settings: settings of the run, see load_worker
+    :param play: plays the rounds of a game with the agents of rank 0, given game number and rounds
+    :return: the result of every game, in the order of the games
+    """
+    comm.bcast(settings, root=0)
+    tasks = shard_tasks(settings["games"], settings["shard"])
+    played = [(game_number, play(game_number, rounds)) for game_number, rounds in tasks[::comm.Get_size()]]
+    gathered = comm.gather(played, root=0)
+    return merge_games(settings["games"], [part for rank_parts in gathered for part in rank_parts])
+
+
+def mpi_rank(comm) -> None:
+    """
+    Rank other than 0 of an MPI run, plays its share of the tasks and sends the results to rank 0
+    :param comm: world communicator
+    :return: None
+    """
+    settings = comm.bcast(None, root=0)
+    load_worker(settings)
+    tasks = shard_tasks(settings["games"], settings["shard"])
+    comm.gather([play_task(task) for task in tasks[comm.Get_rank()::comm.Get_size()]], root=0)
+
+
+def shard_tasks(n: int, shard: str) -> list:
+    """
+    :param n: how many games to play
+    :param shard: "game" or "round"
+    :return: (game number, rounds) of every task, rounds is None for a whole game
+    """
+    if shard == "round":
+        # the long last rounds go first, so the short ones even out the workers at the end
+        return [(game_number, [game_round]) for game_round in range(20, 0, -1) for game_number in range(1, n + 1)]
+    return [(game_number, None) for game_number in range(1, n + 1)]
+
+
+def merge_games(n: int, parts) -> list:
+    """
+    :param n: how many games were played
+    :param parts: (game number, result) of every task
+    :return: the result of every game, in the order of the games
+    """
+    games = [[] for _ in range(n)]
+    for game_number, result in parts:
+        games[game_number - 1].append(result)
+    return [merge_results(game_parts) for game_parts in games]
+
+
+def merge_results(parts: list) -> tuple:
+    """
+    Add up the results of the rounds of a game that were played separately
+    :param parts: results of play_game for different rounds of the same game
+    :return: result of the whole game
+    """
+    merged = []
+    for values in zip(*parts):
+        if isinstance(values[0], list):
+            merged.append([sum(column) for column in zip(*values)])
+        else:
+            merged.append(sum(values[1:], values[0]))
+    return tuple(merged)
+
+
 def play_game(
     full_deck,
-    deck_dict,
     guess_type,
     player_type,
     shuffled_decks,
@@ -293,11 +622,12 @@ def play_game(
     playing_agent2,
     guess_agent3,
     playing_agent3,
+    seed=None,
+    rounds=None,
 ):
 
     wizard = game.Game(
         full_deck,
-        deck_dict,
         guess_type=guess_type,
         player_type=player_type,
         shuffled_decks=shuffled_decks,
@@ -312,8 +642,9 @@ def play_game(
         playing_agent2=playing_agent2,
         guess_agent3=guess_agent3,
         playing_agent3=playing_agent3,
+        seed=seed,
     )
-    loss, scores, offs, round_offs = wizard.play_game()
+    loss, scores, offs, round_offs = wizard.play_game(rounds)
     off_game = wizard.get_game_performance()
     distribution = wizard.get_distribution()
     overshoot = wizard.get_overshoot()
@@ -322,6 +653,16 @@ def play_game(
 
 if __name__ == "__main__":
     args = parse_args()
+    comm = None
+    worker = None
+    if args.mpi:
+        comm = get_comm()
+        worker = local_rank(comm)
+        if comm.Get_rank() != 0:
+            apply_thread_budget(args.thread_config, worker=worker)
+            mpi_rank(comm)
+            exit()
+    print(f"Thread budget: {apply_thread_budget(args.thread_config, worker=worker)}")
     print(f"Opponent guesstype: {args.opp_guesstype}")
     print(f"Opponent playertype: {args.opp_playertype}")
     print(f"Opponent model: {args.opp_model}")
@@ -340,4 +681,11 @@ if __name__ == "__main__":
         args.opp_playmodel,
         args.opp_size,
         args.opp_playersize,
+        args.concurrent_games,
+        args.max_batch,
+        args.max_wait,
+        args.workers,
+        args.shard,
+        args.thread_config,
+        comm,
     )
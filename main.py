@@ -1,12 +1,17 @@
 import argparse
+import cards
 import game
 import numpy as np
 import matplotlib.pyplot as plt
 import os
 import statistics
 import time
-import tensorflow as tf
+from actor_learner import ActorLearner, MPIActorLearner, mpi_actor
 from Guessing_Agent import GuessingAgent
+from mpi_launch import get_comm, local_rank
+from node_table import MAX_NODES, NodeTable
+from numpy_model import from_keras
+from thread_budget import CONFIG_PATH, apply_thread_budget
 from Playing_Agent import PlayingAgent
 
 
@@ -129,6 +134,43 @@ def parse_args() -> argparse.Namespace:
                         default="round",
                         type=str,
                         )
+    parser.add_argument("--separate_opp_models", action="store_true",
+                        help="optional argument to give both opponents their own copy of the opponent models, "
+                             "by default they share one model that is trained by both")
+    parser.add_argument("--publish_every",
+                        help="optional arg to publish the learning models every n games as memory-mapped weights "
+                             "(models/<save_folder>/<guessing|playing><size>.weights) for worker processes",
+                        default=0,
+                        type=int,
+                        )
+    parser.add_argument("--actors",
+                        help="optional arg to play the games in this many actor processes, "
+                             "this process only trains on their experiences and publishes the weights",
+                        default=0,
+                        type=int,
+                        )
+    parser.add_argument("--thread_config",
+                        help="optional arg for the thread budget config written by thread_probe.py",
+                        default=CONFIG_PATH,
+                        type=str,
+                        )
+    parser.add_argument("--max_nodes",
+                        help="optional arg for the most search nodes a learning player keeps, 0 for no limit",
+                        default=MAX_NODES,
+                        type=int,
+                        )
+    parser.add_argument("--node_memory",
+                        help="optional arg for the estimated MB of search nodes a learning player keeps, "
+                             "0 for no limit",
+                        default=0,
+                        type=int,
+                        )
+    parser.add_argument("--round_quotas", action="store_true",
+                        help="optional argument to give every round an equal share of the node budget")
+    parser.add_argument("--mpi",
+                        help="optional arg to launch with mpirun, rank 0 trains and every other rank is an actor",
+                        action="store_true",
+                        )
 
     return parser.parse_args()
 
@@ -175,6 +217,28 @@ def save_models(
     )
 
 
+def publish_models(
+    guess_agent: GuessingAgent,
+    playing_agent: PlayingAgent,
+    guess_type: str,
+    player_type: str,
+    save_folder: str,
+) -> None:
+    """
+    Publish a new version of the learning models as memory-mapped weights,
+    worker processes that load them share one copy and can switch to the new version at any time
+    """
+    folder = os.path.join("models", save_folder)
+    if guess_type == "learning":
+        path = os.path.join(folder, f"guessing{guess_agent.input_size}.weights")
+        version = from_keras(guess_agent.model).publish(path)
+        print(f"Published {path} {version}")
+    if player_type == "learning":
+        path = os.path.join(folder, f"playing{playing_agent.input_size}.weights")
+        version = from_keras(playing_agent.network_policy.model).publish(path)
+        print(f"Published {path} {version}")
+
+
 def avg_n_games(
     n: int,
     guess_type: str,
@@ -201,7 +265,18 @@ def avg_n_games(
     iters_done: int,
     reoccur_bool: bool,
     train_every: str,
+    separate_opp_models=False,
+    publish_every=0,
+    actors=0,
+    thread_config=CONFIG_PATH,
+    comm=None,
+    max_nodes=MAX_NODES,
+    node_memory=0,
+    round_quotas=False,
 ) -> None:
+    # TensorFlow is only needed here, not in the actor processes that import this module
+    import tensorflow as tf
+
     input_size_guess = guesser_size
     input_size_play = player_size
     opp_size = opp_guesser_size
@@ -221,9 +296,10 @@ def avg_n_games(
     elif player_model is not None:
         name = player_model.split("/")[0].split("_")[1]
 
+    node_bytes = node_memory * 2 ** 20
     guess_agent = GuessingAgent(input_size=input_size_guess, guess_max=21, soft_guess=soft_guess)
     playing_agent = PlayingAgent(input_size=input_size_play, name=name, verbose=verbose, punish=punish,
-                                 score=score, diff=diff)
+                                 score=score, diff=diff, nodes=NodeTable(max_nodes, node_bytes, round_quotas))
     guess_agent2 = None
     playing_agent2 = None
     guess_agent3 = None
@@ -231,8 +307,11 @@ def avg_n_games(
 
     if opp_guesstype.startswith("learn"):
         print("Creating guess agents for opponents..")
+        # opponents loading the same model share it, unless they are kept separate
+        share_guesser = opp_model != "" and not separate_opp_models
         guess_agent2 = GuessingAgent(input_size=opp_size, guess_max=21, soft_guess=soft_guess)
-        guess_agent3 = GuessingAgent(input_size=opp_size, guess_max=21, soft_guess=soft_guess)
+        guess_agent3 = GuessingAgent(input_size=opp_size, guess_max=21, soft_guess=soft_guess,
+                                     build_model=not share_guesser)
         print("Opposing guess model:\n")
         guess_agent2.model.summary()
         print(f"\nGuesser loss-function opponents: ", guess_agent2.model.loss)
@@ -244,16 +323,21 @@ def avg_n_games(
             guess_agent2.model = tf.keras.models.load_model(
                 os.path.join("models", opp_model)
             )
-            guess_agent3.model = tf.keras.models.load_model(
-                os.path.join("models", opp_model)
-            )
+            if share_guesser:
+                guess_agent3.share_model(guess_agent2)
+            else:
+                guess_agent3.model = tf.keras.models.load_model(
+                    os.path.join("models", opp_model)
+                )
 
     if opp_playertype.startswith("learn"):
         print("Creating play agents for opponents..")
+        share_player = opp_playmodel != "" and not separate_opp_models
         playing_agent2 = PlayingAgent(input_size=opp_play_size, name=name, verbose=verbose, punish=punish,
-                                      score=score, diff=diff)
+                                      score=score, diff=diff, nodes=NodeTable(max_nodes, node_bytes, round_quotas))
         playing_agent3 = PlayingAgent(input_size=opp_play_size, name=name, verbose=verbose, punish=punish,
-                                      score=score, diff=diff)
+                                      score=score, diff=diff, build_model=not share_player,
+                                      nodes=NodeTable(max_nodes, node_bytes, round_quotas))
         print("Opposing play model:\n")
         playing_agent2.network_policy.model.summary()
         print(f"\nPlayer loss-function opponents: ", playing_agent2.network_policy.model.loss)
@@ -265,9 +349,12 @@ def avg_n_games(
             playing_agent2.network_policy.model = tf.keras.models.load_model(
                 os.path.join("models", opp_playmodel)
             )
-            playing_agent3.network_policy.model = tf.keras.models.load_model(
-                os.path.join("models", opp_playmodel)
-            )
+            if share_player:
+                playing_agent3.network_policy.share_model(playing_agent2.network_policy)
+            else:
+                playing_agent3.network_policy.model = tf.keras.models.load_model(
+                    os.path.join("models", opp_playmodel)
+                )
 
     if guess_type == "learned" or (guess_type == "learning" and model_path is not None):
         print(f"Loading saved guessing model {model_path}")
@@ -300,16 +387,8 @@ def avg_n_games(
     total_offs = [0, 0]
     total_round_offs = np.zeros(20, dtype=int)
 
-    # Make the deck
-    full_deck = []
-    deck_dict = {}
-
-    for suit in range(4):  # (blue, yellow, red, green)
-        for card_value in range(15):  # (joker, 1-13, wizard)
-            full_deck.append((suit, card_value))
-
-            # to go from card to index
-            deck_dict[(suit, card_value)] = card_value + suit * 15
+    # Make the deck, cards are ids (value + suit * 15) inside the engine
+    full_deck = cards.new_deck()
 
     # Run n-amount of games
     last_ten_performance = np.zeros(21, dtype=int)
@@ -327,35 +406,82 @@ def avg_n_games(
     if train_every.isnumeric():
         train_every_games = int(train_every)
 
+    actor_learner = None
+    if actors or comm is not None:
+        if opp_guesstype == "learning" or opp_playertype == "learning":
+            print("Learning opponents can not be trained with --actors, use learned opponents instead")
+            exit()
+        settings = {
+            "games": n,
+            "guess_type": guess_type,
+            "player_type": player_type,
+            "opp_guesstype": opp_guesstype,
+            "opp_playertype": opp_playertype,
+            "guesser_size": input_size_guess,
+            "player_size": input_size_play,
+            "opp_guesser_size": opp_size,
+            "opp_player_size": opp_play_size,
+            "verbose": verbose,
+            "punish": punish,
+            "score": score,
+            "diff": diff,
+            "soft_guess": soft_guess,
+            "epsilon": epsilon,
+            "player_epsilon": player_epsilon,
+            "epsilon_decay": epsilon_decay,
+            "player_decay": player_decay,
+            "min_epsilon": min_epsilon,
+            "save_folder": save_folder,
+            "train_every": train_every,
+            "thread_config": thread_config,
+            "max_nodes": max_nodes,
+            "node_bytes": node_bytes,
+            "round_quotas": round_quotas,
+        }
+        if comm is not None:
+            actor_learner = MPIActorLearner(
+                comm, guess_agent, playing_agent, (guess_agent2, playing_agent2), settings, publish_every
+            )
+        else:
+            actor_learner = ActorLearner(
+                actors, guess_agent, playing_agent, (guess_agent2, playing_agent2), settings, publish_every
+            )
+        actor_results = actor_learner.results()
+
     for game_instance in range(1 + iters_done, n + 1 + iters_done):
         print("\nGame instance: ", game_instance)
-        wizard = game.Game(
-            full_deck,
-            deck_dict,
-            guess_type=guess_type,
-            player_type=player_type,
-            output_path=output_path,
-            guess_agent=guess_agent,
-            playing_agent=playing_agent,
-            epsilon=epsilon,
-            player_epsilon=player_epsilon,
-            verbose=verbose,
-            opp_guesstype=opp_guesstype,
-            opp_playertype=opp_playertype,
-            guess_agent2=guess_agent2,
-            playing_agent2=playing_agent2,
-            guess_agent3=guess_agent3,
-            playing_agent3=playing_agent3,
-            save_folder=save_folder,
-            reoccur_bool=reoccur_bool,
-            train_every=train_every,
-        )
-        game_loss, scores, offs, round_offs = wizard.play_game()
+        if actor_learner is not None:
+            game_loss, scores, offs, round_offs, game_performance = next(actor_results)
+            print(f"Learner: {len(playing_agent.network_policy.replay_memory)} play experiences, "
+                  f"{len(guess_agent.replay_memory)} guess experiences")
+        else:
+            wizard = game.Game(
+                full_deck,
+                guess_type=guess_type,
+                player_type=player_type,
+                output_path=output_path,
+                guess_agent=guess_agent,
+                playing_agent=playing_agent,
+                epsilon=epsilon,
+                player_epsilon=player_epsilon,
+                verbose=verbose,
+                opp_guesstype=opp_guesstype,
+                opp_playertype=opp_playertype,
+                guess_agent2=guess_agent2,
+                playing_agent2=playing_agent2,
+                guess_agent3=guess_agent3,
+                playing_agent3=playing_agent3,
+                save_folder=save_folder,
+                reoccur_bool=reoccur_bool,
+                train_every=train_every,
+            )
+            game_loss, scores, offs, round_offs = wizard.play_game()
+            game_performance = wizard.get_game_performance()
         total_round_offs += round_offs
         avg_loss += game_loss
 
         # For command-line output while training
-        last_ten_performance += wizard.get_game_performance()
+        last_ten_performance += game_performance
         scores_player1.append(scores[0])
         scores_player2.append(scores[1])
         scores_player3.append(scores[2])
@@ -366,7 +492,7 @@ def avg_n_games(
         total_offs[0] += offs[0]
         total_offs[1] += offs[1]
 
-        if train_every_games and (game_instance-iters_done) % train_every_games == 0:
+        if actor_learner is None and train_every_games and (game_instance-iters_done) % train_every_games == 0:
             for player in wizard.players:
                 avg_loss += wizard.train_network(player)
 
@@ -382,7 +508,12 @@ def avg_n_games(
                 f"Last10: {last_ten_performance}"
             )
             print(f"Total states: {playing_agent.full_cntr}")
-            print(f"Re-occured states: {playing_agent.cntr}\n")
+            print(f"Re-occured states: {playing_agent.cntr}")
+            print(f"Guess cache: {guess_agent.cache}")
+            print(f"Play cache: {playing_agent.network_policy.cache}")
+            if actor_learner is None:
+                print(f"Nodes: {playing_agent.nodes}")
+            print()
             print(f"Total mistakes made in each round: {list(total_round_offs)}")
             avg_loss = 0.0
             last_ten_performance *= 0
@@ -392,6 +523,9 @@ def avg_n_games(
                 last_max = game_instance
                 max_acc = accuracy
 
+        if actor_learner is None and publish_every and game_instance % publish_every == 0:
+            publish_models(guess_agent, playing_agent, guess_type, player_type, save_folder)
+
         if player_type == "learning" or guess_type == "learning":
             if game_instance % 1000 == 0:
                 if save_bool.startswith("y"):
@@ -481,13 +615,8 @@ def avg_n_games(
             player_epsilon *= player_decay
             player_epsilon = max(0.25, player_epsilon)
 
-        if game_instance % 850 == 0:
-            for player in wizard.players:
-                if player.player_type.startswith("learn"):
-                    print(
-                        "Forgetting ", len(player.play_agent.nodes.keys()), " nodes.."
-                    )
-                    player.play_agent.nodes = dict()
+    if actor_learner is not None:
+        actor_learner.close()
 
     print("Avg Scores: ", score_counter)
     print("Max/Min/Median scores p1: ", {max(scores_player1)}, {min(scores_player1)},
@@ -506,6 +635,19 @@ def avg_n_games(
 
 if __name__ == "__main__":
     args = parse_args()
+    comm = None
+    worker = None
+    if args.mpi:
+        comm = get_comm()
+        if comm.Get_size() < 2:
+            print("--mpi needs at least 2 ranks, a learner and an actor")
+            exit()
+        worker = local_rank(comm)
+        if comm.Get_rank() != 0:
+            apply_thread_budget(args.thread_config, worker=worker)
+            mpi_actor(comm)
+            exit()
+    print(f"Thread budget: {apply_thread_budget(args.thread_config, worker=worker)}")
     print(f"Save bool: '{args.save}'")
     print(f"Save folder: '{args.save_folder}'")
     if args.save.startswith("y") and args.save_folder == "":
@@ -521,6 +663,11 @@ if __name__ == "__main__":
     print(f"Guess based on softmax curve instead of argmax: {args.soft_guess}")
     print(f"Save reoccuring states?: {args.reoccur_bool}")
     print(f"Train every: {args.train_every}")
+    print(f"Separate opponent models: {args.separate_opp_models}")
+    print(f"Publish every: {args.publish_every}")
+    print(f"Actors: {args.actors}")
+    print(f"MPI: {args.mpi}")
+    print(f"Max nodes: {args.max_nodes}, node memory: {args.node_memory} MB, round quotas: {args.round_quotas}")
 
     if not args.opp_guesstype.startswith("learn") and args.opp_model:
         print("Guessing agent given but not used")
@@ -554,4 +701,12 @@ if __name__ == "__main__":
         args.iters_done,
         args.reoccur_bool,
         args.train_every,
+        args.separate_opp_models,
+        args.publish_every,
+        args.actors,
+        args.thread_config,
+        comm,
+        args.max_nodes,
+        args.node_memory,
+        args.round_quotas,
     )
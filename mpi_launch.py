@@ -0,0 +1,19 @@
+def get_comm():
+    """
+    :return: the world communicator of an MPI run, mpi4py is only imported when --mpi is used
+    """
+    try:
+        from mpi4py import MPI
+    except ImportError:
+        print("--mpi needs mpi4py, install it or run without --mpi")
+        exit()
+    return MPI.COMM_WORLD
+
+
+def local_rank(comm) -> int:
+    """
+    :param comm: world communicator
+    :return: index of this rank among the ranks on the same node, for its thread budget and cores
+    """
+    from mpi4py import MPI
+    return comm.Split_type(MPI.COMM_TYPE_SHARED).Get_rank()
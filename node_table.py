@@ -0,0 +1,167 @@
+import numpy as np
+from collections import OrderedDict
+from itertools import islice
+
+from utility_functions import state_to_key
+
+MAX_NODES = 1000000  # Most nodes a table keeps, 0 for no limit. About 1 GB for the 3731 input playing state
+NODE_BYTES = 600  # Estimated bytes of a stored node besides its key: the node, its lists and the table entries
+EVICTION_SAMPLE = 8  # Least recently used nodes of which the one with the fewest encounters is evicted
+
+
+class NodeTable:
+    """
+    Nodes of the search tree by zobrist hash of their state,
+    the full key of a state is only compared when its hash is found.
+    The table is bounded by a number of nodes and/or an estimate of their memory. When it is full,
+    the node with the fewest actual encounters among the least recently used nodes is evicted,
+    so re-occurring nodes outlive the ones that were seen once.
+    With round quotas every round gets an equal share of the budget, so the many states
+    of the last rounds can not crowd out the early rounds
+    """
+    def __init__(self, max_nodes=MAX_NODES, max_bytes=0, round_quotas=False):
+        self.max_nodes = max_nodes
+        self.max_bytes = max_bytes
+        self.round_quotas = round_quotas
+        self.table = dict()
+
+        # nodes whose hash is already taken by a different state
+        self.collisions = dict()
+
+        # stored nodes from least to most recently used, per round with quotas else all in group 0
+        self.recency = dict()
+        self.group_bytes = dict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self.table) + len(self.collisions)
+
+    def keys(self):
+        """
+        :return: iterator over the keys of all stored states
+        """
+        for node in self.table.values():
+            yield node.state
+        yield from self.collisions.keys()
+
+    def get(self, state_hash: int, key: bytes):
+        """
+        :param state_hash: zobrist hash of the state
+        :param key: key of the state, see utility_functions.state_to_key
+        :return: the stored node of the state, None if it is not in the table
+        """
+        node = self.table.get(state_hash)
+        if node is not None and node.state != key:
+            node = self.collisions.get(key)
+        if node is not None:
+            self.recency[self.group(node)].move_to_end(node)
+        return node
+
+    def get_state(self, state_hash: int, state_space: np.ndarray):
+        """
+        Same as get, the key is only made from the playing state when the hash is found.
+        Counts as a hit or miss of the table
+        :param state_hash: zobrist hash of the state
+        :param state_space: playing state
+        :return: the stored node of the state, None if it is not in the table
+        """
+        node = None
+        if state_hash in self.table:
+            node = self.get(state_hash, state_to_key(state_space))
+        if node is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return node
+
+    def add(self, node) -> None:
+        """
+        Store a node, unless a node with the same state is already stored.
+        Evicts nodes when the table, or the quota of the round of the node, is over budget
+        :param node: node with state key, hash and round
+        :return: None
+        """
+        stored = self.table.setdefault(node.hash, node)
+        if stored is not node:
+            if stored.state == node.state:
+                self.recency[self.group(stored)].move_to_end(stored)
+                return
+            if node.state in self.collisions:
+                self.recency[self.group(node)].move_to_end(self.collisions[node.state])
+                return
+            self.collisions[node.state] = node
+
+        group = self.group(node)
+        self.recency.setdefault(group, OrderedDict())[node] = None
+        self.group_bytes[group] = self.group_bytes.get(group, 0) + NODE_BYTES + len(node.state)
+        while self.over_budget(group):
+            self.evict(group)
+
+    def group(self, node) -> int:
+        return node.game_round if self.round_quotas else 0
+
+    def over_budget(self, group: int) -> bool:
+        """
+        :param group: round of the added node with quotas, else 0
+        :return: whether the nodes of the group exceed their share of the node or memory budget,
+        a group always keeps its newest node
+        """
+        if len(self.recency[group]) <= 1:
+            return False
+        shares = 20 if self.round_quotas else 1
+        if self.max_nodes and len(self.recency[group]) > max(self.max_nodes // shares, 1):
+            return True
+        return bool(self.max_bytes) and self.group_bytes[group] > self.max_bytes / shares
+
+    def evict(self, group: int) -> None:
+        """
+        Remove the node with the fewest actual encounters among the least recently used nodes of a group,
+        the oldest one on a tie. The newest node is never sampled, so an added node is not evicted right away.
+        The node is only freed once the nodes below it are gone as well
+        :param group: group to evict from
+        :return: None
+        """
+        recency = self.recency[group]
+        sample = islice(recency, min(EVICTION_SAMPLE, len(recency) - 1))
+        node = min(sample, key=lambda candidate: candidate.actual_encounters)
+        del recency[node]
+        self.group_bytes[group] -= NODE_BYTES + len(node.state)
+        if self.table.get(node.hash) is node:
+            del self.table[node.hash]
+            # a colliding state takes over the hash, else get would never look it up
+            collision = next((other for other in self.collisions.values() if other.hash == node.hash), None)
+            if collision is not None:
+                self.table[node.hash] = self.collisions.pop(collision.state)
+        elif self.collisions.get(node.state) is node:
+            del self.collisions[node.state]
+        self.evictions += 1
+
+    def nbytes(self) -> int:
+        """
+        :return: estimated memory of the stored nodes
+        """
+        return sum(self.group_bytes.values())
+
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def reset_counters(self) -> None:
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def clear(self) -> None:
+        self.table.clear()
+        self.collisions.clear()
+        self.recency.clear()
+        self.group_bytes.clear()
+
+    def __str__(self) -> str:
+        return (
+            f"{len(self)} nodes (~{self.nbytes() / 2 ** 20:.0f} MB), {self.hits} hits, {self.misses} misses "
+            f"({self.hit_rate():.1%}), {self.evictions} evicted"
+        )
@@ -0,0 +1,366 @@
+import json
+import numpy as np
+import os
+import shutil
+
+
+def relu(x: np.ndarray) -> np.ndarray:
+    return np.maximum(x, 0, out=x)
+
+
+def linear(x: np.ndarray) -> np.ndarray:
+    return x
+
+
+def softmax(x: np.ndarray) -> np.ndarray:
+    x = np.exp(x - x.max(axis=1, keepdims=True))
+    return x / x.sum(axis=1, keepdims=True)
+
+
+ACTIVATIONS = {"relu": relu, "linear": linear, "softmax": softmax}
+
+# input rows of a quantized kernel that are dequantized at once, small enough to stay in cache
+QUANT_BLOCK = 64
+
+# published versions of a mapped model that are kept on disk, older ones are removed
+MAPPED_VERSIONS_KEPT = 2
+
+
+def quantize(weights: np.ndarray) -> tuple:
+    """
+    Post-training int8 quantization of a kernel, with a scale per output channel
+    :param weights: float32 kernel of shape (inputs, outputs)
+    :return: int8 kernel and the per-channel scales
+    """
+    scales = np.abs(weights).max(axis=0) / 127
+    scales[scales == 0] = 1
+    quantized = np.clip(np.rint(weights / scales), -127, 127).astype(np.int8)
+    return quantized, scales.astype(np.float32)
+
+
+def dense(x: np.ndarray, weights: np.ndarray, biases: np.ndarray, scales=None) -> np.ndarray:
+    """
+    x @ weights + biases, int8 kernels are dequantized in blocks of input rows
+    so only the small int8 weights are read from memory
+    :param x: float32 input of shape (n, inputs)
+    :param weights: kernel of shape (inputs, outputs), float32 or int8
+    :param biases: float32 biases
+    :param scales: per output channel scales of an int8 kernel
+    :return: float32 output of shape (n, outputs)
+    """
+    if weights.dtype == np.float32:
+        return x @ weights + biases
+    out = np.zeros((x.shape[0], weights.shape[1]), dtype=np.float32)
+    for start in range(0, weights.shape[0], QUANT_BLOCK):
+        block = weights[start: start + QUANT_BLOCK].astype(np.float32)
+        out += x[:, start: start + QUANT_BLOCK] @ block
+    if scales is not None:
+        out *= scales
+    return out + biases
+
+
+class NumpyModel:
+    """
+    Forward pass of an exported Dense stack in plain NumPy, loading it does not import TensorFlow
+    """
+    def __init__(self, weights: list, biases: list, activations: list, loss=None, scales=None):
+        # quantized kernels keep their int8 type, everything else is float32
+        self.weights = [w if w.dtype == np.int8 else np.asarray(w, dtype=np.float32) for w in weights]
+        self.biases = [np.asarray(b, dtype=np.float32) for b in biases]
+        self.activations = list(activations)
+        self.loss = loss
+        self.scales = scales if scales is not None else [None] * len(self.weights)
+        self.input_size = self.weights[0].shape[0]
+
+        # published version for memory-mapped models
+        self.version = None
+
+    def __call__(self, states) -> np.ndarray:
+        """
+        :param states: a single state or an array of shape (n, input_size)
+        :return: model output for every state, of shape (n, output_size)
+        """
+        x = np.asarray(states, dtype=np.float32).reshape(-1, self.input_size)
+        for weights, biases, scales, activation in zip(self.weights, self.biases, self.scales, self.activations):
+            x = ACTIVATIONS[activation](dense(x, weights, biases, scales))
+        return x
+
+    def sparse_forward(self, indices: list, values=None) -> np.ndarray:
+        """
+        Forward pass from the non-zero features only, the first layer sums the kernel rows
+        of the active features instead of multiplying with the mostly empty dense states
+        :param indices: for every state an array with the indices of its non-zero features
+        :param values: for every state an array with the values of those features, None if they are all 1
+        :return: model output for every state, of shape (n, output_size)
+        """
+        return self.forward_accumulated(self.accumulate(indices, values))
+
+    def accumulate(self, indices: list, values=None) -> np.ndarray:
+        """
+        First layer of the sparse forward pass, before scales, biases and activation
+        :param indices: for every state an array with the indices of its non-zero features
+        :param values: for every state an array with the values of those features, None if they are all 1
+        :return: accumulator of every state, of shape (n, first layer size)
+        """
+        kernel = self.weights[0]
+        accumulators = np.empty((len(indices), kernel.shape[1]), dtype=np.float32)
+        for state, state_indices in enumerate(indices):
+            rows = kernel[state_indices].astype(np.float32, copy=False)
+            if values is None:
+                accumulators[state] = rows.sum(axis=0)
+            else:
+                accumulators[state] = np.asarray(values[state], dtype=np.float32) @ rows
+        return accumulators
+
+    def update_accumulator(self, accumulator: np.ndarray, indices: np.ndarray, deltas: np.ndarray) -> np.ndarray:
+        """
+        Accumulator of a state that differs from an accumulated state in a few features
+        :param accumulator: accumulator of the original state, see accumulate
+        :param indices: indices of the changed features
+        :param deltas: new minus old value of every changed feature
+        :return: accumulator of the changed state
+        """
+        rows = self.weights[0][indices].astype(np.float32, copy=False)
+        return accumulator + np.asarray(deltas, dtype=np.float32) @ rows
+
+    def forward_accumulated(self, accumulators: np.ndarray) -> np.ndarray:
+        """
+        Rest of the forward pass after the first layer is accumulated
+        :param accumulators: array of shape (n, first layer size), see accumulate
+        :return: model output for every state, of shape (n, output_size)
+        """
+        x = np.array(accumulators, dtype=np.float32)
+        if self.scales[0] is not None:
+            x *= self.scales[0]
+        x = ACTIVATIONS[self.activations[0]](x + self.biases[0])
+
+        # deeper layers are small and dense
+        for weights, biases, scales, activation in zip(
+            self.weights[1:], self.biases[1:], self.scales[1:], self.activations[1:]
+        ):
+            x = ACTIVATIONS[activation](dense(x, weights, biases, scales))
+        return x
+
+    def quantized(self):
+        """
+        :return: copy of the model with int8 kernels, a quarter of the memory at about the same speed
+        """
+        weights = []
+        scales = []
+        for kernel in self.weights:
+            quantized_kernel, kernel_scales = quantize(kernel.astype(np.float32))
+            weights.append(quantized_kernel)
+            scales.append(kernel_scales)
+        return NumpyModel(weights, self.biases, self.activations, loss=self.loss, scales=scales)
+
+    def nbytes(self) -> int:
+        """
+        :return: memory used by the weights
+        """
+        scale_bytes = sum(s.nbytes for s in self.scales if s is not None)
+        return sum(w.nbytes + b.nbytes for w, b in zip(self.weights, self.biases)) + scale_bytes
+
+    def predict(self, states) -> np.ndarray:
+        return self(states)
+
+    def summary(self) -> None:
+        print(f"NumpyModel, loss: {self.loss}")
+        for i, (weights, activation) in enumerate(zip(self.weights, self.activations)):
+            print(f"dense {i}: {weights.shape[0]} -> {weights.shape[1]} ({activation}, {weights.dtype})")
+        print(f"Total params: {sum(w.size + b.size for w, b in zip(self.weights, self.biases))}")
+        print(f"Weight memory: {self.nbytes() / 2 ** 20:.2f} MiB")
+
+    def save(self, path: str) -> None:
+        arrays = {"activations": np.array(self.activations)}
+        if self.loss is not None:
+            arrays["loss"] = np.array(self.loss)
+        for i, (weights, biases) in enumerate(zip(self.weights, self.biases)):
+            arrays[f"kernel_{i}"] = weights
+            arrays[f"bias_{i}"] = biases
+            if self.scales[i] is not None:
+                arrays[f"scale_{i}"] = self.scales[i]
+        np.savez(path, **arrays)
+
+    def publish(self, path: str) -> str:
+        """
+        Write the weights as a new version of a mapped model folder, one .npy file per array.
+        The version is written under a temporary name and then renamed, after which the CURRENT
+        file is replaced, so readers always see a complete version
+        :param path: folder of the mapped model, like models/<name>.weights
+        :return: the published version
+        """
+        os.makedirs(path, exist_ok=True)
+        current = mapped_version(path)
+        version = f"v{int(current[1:]) + 1 if current else 1}"
+        temp_path = os.path.join(path, f".tmp-{os.getpid()}")
+        shutil.rmtree(temp_path, ignore_errors=True)
+        os.mkdir(temp_path)
+        for i, (weights, biases) in enumerate(zip(self.weights, self.biases)):
+            np.save(os.path.join(temp_path, f"kernel_{i}.npy"), weights)
+            np.save(os.path.join(temp_path, f"bias_{i}.npy"), biases)
+            if self.scales[i] is not None:
+                np.save(os.path.join(temp_path, f"scale_{i}.npy"), self.scales[i])
+        with open(os.path.join(temp_path, "meta.json"), "w") as f:
+            json.dump({"activations": self.activations, "loss": self.loss}, f)
+        os.rename(temp_path, os.path.join(path, version))
+
+        with open(os.path.join(path, "CURRENT.tmp"), "w") as f:
+            f.write(version)
+        os.replace(os.path.join(path, "CURRENT.tmp"), os.path.join(path, "CURRENT"))
+
+        # processes that still map an old version keep their pages after the files are removed
+        versions = sorted((v for v in os.listdir(path) if v.startswith("v")), key=lambda v: int(v[1:]))
+        for old_version in versions[:-MAPPED_VERSIONS_KEPT]:
+            shutil.rmtree(os.path.join(path, old_version), ignore_errors=True)
+        return version
+
+    @staticmethod
+    def load_mapped(path: str):
+        """
+        Map the current version of a mapped model read-only, the forward pass runs on the mapped pages
+        so every process using the model shares one copy of the weights
+        :param path: folder of the mapped model, see publish
+        :return: NumpyModel with memory-mapped weights
+        """
+        for _ in range(3):
+            version = mapped_version(path)
+            if version is None:
+                print(f"No published model in {path}")
+                exit()
+            version_path = os.path.join(path, version)
+            try:
+                with open(os.path.join(version_path, "meta.json")) as f:
+                    meta = json.load(f)
+                layers = range(len(meta["activations"]))
+                weights = [np.load(os.path.join(version_path, f"kernel_{i}.npy"), mmap_mode="r") for i in layers]
+                biases = [np.load(os.path.join(version_path, f"bias_{i}.npy"), mmap_mode="r") for i in layers]
+                scales = [
+                    np.load(os.path.join(version_path, f"scale_{i}.npy"), mmap_mode="r")
+                    if os.path.exists(os.path.join(version_path, f"scale_{i}.npy")) else None
+                    for i in layers
+                ]
+            except FileNotFoundError:
+                # version was removed while loading it, newer ones were published in the meantime
+                continue
+            loss = None if meta.get("loss") == "None" else meta.get("loss")
+            model = NumpyModel(weights, biases, meta["activations"], loss=loss, scales=scales)
+            model.version = version
+            return model
+        print(f"Could not load a version of {path}, it keeps changing")
+        exit()
+
+    @staticmethod
+    def load(path: str):
+        data = np.load(path)
+        activations = data["activations"].tolist()
+        weights = [data[f"kernel_{i}"] for i in range(len(activations))]
+        biases = [data[f"bias_{i}"] for i in range(len(activations))]
+        scales = [data[f"scale_{i}"] if f"scale_{i}" in data else None for i in range(len(activations))]
+        # exports made before the loss was optional stored a missing loss as "None"
+        loss = str(data["loss"]) if "loss" in data else None
+        return NumpyModel(weights, biases, activations, loss=None if loss == "None" else loss, scales=scales)
+
+
+def accuracy_report(model: NumpyModel, quantized_model: NumpyModel, states: np.ndarray) -> dict:
+    """
+    Compare the outputs of a quantized model with the float model it was made from
+    :param model: float32 model
+    :param quantized_model: quantized copy of the model
+    :param states: array of shape (n, input_size) with the states to evaluate
+    :return: dict with the error statistics and the memory of both models
+    """
+    expected = model(states)
+    actual = quantized_model(states)
+    error = np.abs(actual - expected)
+    report = {
+        "states": len(states),
+        "mean_abs_error": float(error.mean()),
+        "max_abs_error": float(error.max()),
+        "float_mib": model.nbytes() / 2 ** 20,
+        "quantized_mib": quantized_model.nbytes() / 2 ** 20,
+    }
+    if expected.shape[1] > 1:
+        # guessing models, how often the same guess comes out
+        report["same_argmax"] = float((expected.argmax(axis=1) == actual.argmax(axis=1)).mean())
+    return report
+
+
+def from_keras(model) -> NumpyModel:
+    """
+    Copy the weights of a keras model made of Dense layers
+    :param model: keras model, like the ones of PlayingNetwork and GuessingAgent
+    :return: NumpyModel with the same forward pass
+    """
+    weights = []
+    biases = []
+    activations = []
+    for layer in model.layers:
+        layer_weights = layer.get_weights()
+        if not layer_weights:
+            # input layer
+            continue
+        activation = layer.get_config().get("activation")
+        if len(layer_weights) != 2 or activation not in ACTIVATIONS:
+            print(f"Can not export layer {layer.name}, only Dense layers with relu/linear/softmax are supported")
+            exit()
+        weights.append(layer_weights[0])
+        biases.append(layer_weights[1])
+        activations.append(activation)
+    loss = model.loss if isinstance(model.loss, str) else None
+    return NumpyModel(weights, biases, activations, loss=loss)
+
+
+def mapped_version(path: str):
+    """
+    :param path: folder of a mapped model, see NumpyModel.publish
+    :return: the current version, None if nothing is published yet
+    """
+    try:
+        with open(os.path.join(path, "CURRENT")) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+def modified_time(path: str):
+    """
+    :param path: file or folder
+    :return: latest modification time of the file or of anything in the folder, None if it does not exist
+    """
+    if not os.path.exists(path):
+        return None
+    times = [os.path.getmtime(path)]
+    for root, _, files in os.walk(path):
+        times.extend(os.path.getmtime(os.path.join(root, file)) for file in files)
+    return max(times)
+
+
+def load_model(name: str, folder="models"):
+    """
+    Load a model by name, a published mapped model is preferred over the exported .npz,
+    which is preferred over the saved keras model. An export that is older than the keras model
+    is skipped, the keras model was saved again after it was exported
+    :param name: name of the model in the models folder
+    :param folder: folder with the models
+    :return: NumpyModel or keras model
+    """
+    keras_path = os.path.join(folder, name)
+    keras_time = modified_time(keras_path)
+    exports = [
+        (os.path.join(folder, f"{name}.weights"), NumpyModel.load_mapped),
+        (os.path.join(folder, f"{name}.npz"), NumpyModel.load),
+    ]
+    for path, load in exports:
+        export_time = modified_time(path)
+        if export_time is None:
+            continue
+        if keras_time is not None and export_time < keras_time:
+            print(f"Skipping {path}, it is older than {keras_path}; export the model again")
+            continue
+        print(f"Loading model {path}")
+        return load(path)
+
+    # TensorFlow is only imported for models that were not exported
+    import tensorflow as tf
+    print(f"Loading model {keras_path}")
+    return tf.keras.models.load_model(keras_path)
@@ -1,14 +1,11 @@
 import numpy as np
 import os
 import pickle
-import random
 
+import cards
 import Playing_Agent
 import utility_functions as util
 
-#
-# TODO: MAKE HAND SORTED ONCE AT START
-
 
 class Player:
     def __init__(
@@ -34,8 +31,7 @@ class Player:
         self.reoccur_bool = reoccur_bool
         self.verbose = verbose
         self.player_name = player_name
-        self.hand = []
-        self.idx_dict = dict()
+        self.hand = 0  # bitmask of card ids
         self.win_cards = []
         self.player_guesses = 0
         self.trick_wins = 0
@@ -62,10 +58,15 @@ class Player:
         :return: return the deck after drawing
         """
         for card in range(amount):
-            self.hand.append(deck.pop())
-        self.hand.sort(key=lambda x: (x[0], x[1]))
+            self.hand |= 1 << deck.pop()
         return deck
 
+    def remove_card(self, card: int) -> None:
+        """
+        :param card: card id to remove from the hand
+        """
+        self.hand &= ~(1 << card)
+
     def play_card(
         self,
         trump: int,
@@ -74,7 +75,7 @@ class Player:
         player_order,
         game_instance,
         state_space=None,
-    ) -> tuple:
+    ) -> int:
         """
         Plays a card from players hand
         :param trump: The trump card of the current round
@@ -86,22 +87,8 @@ class Player:
         :param state_space: Observation state used for playing agent
         :return: the played card
         """
-        requested_cards = []
-        white_cards = []
-
-        for idx in range(len(self.hand)):
-            card_in_hand = self.hand[idx]
-            self.idx_dict[card_in_hand] = idx
-            if requested_color < 4:
-                if card_in_hand[1] == 0 or card_in_hand[1] == 14:
-                    white_cards.append(card_in_hand)
-                elif card_in_hand[0] == requested_color:
-                    requested_cards.append(card_in_hand)
-
-        if not requested_cards:
-            legal_cards = self.hand[:]
-        else:
-            legal_cards = requested_cards + white_cards
+        legal_cards = cards.legal_cards(self.hand, requested_color)
+        hand_size = cards.count(self.hand)
 
         #  print(f"\ncolor: {requested_color}\n hand: {self.hand}\n legal: {legal_cards}\n")
         card = None
@@ -109,20 +96,21 @@ class Player:
         if self.player_type == "learning":
             if self.verbose >= 3:
                 print("Round: ", game_instance.game_round)
-                print("Amount of nodes: ", len(self.play_agent.nodes.keys()))
+                print("Amount of nodes: ", len(self.play_agent.nodes))
 
             # NODE IS HERE BEFORE PLAY
-            key_state = util.state_to_key(state_space)
+            state_hash = game_instance.playing_state_hash(self)
             self.play_agent.full_cntr[game_instance.game_round - 1] += 1
 
             # ROOT NODE (cards in hand == round) -> add root and children
-            if len(self.hand) == game_instance.game_round:
+            if hand_size == game_instance.game_round:
+                root_node = self.play_agent.get_node(state_hash, state_space)
                 # Unseen root node
-                if key_state not in self.play_agent.nodes.keys():
-                    self.play_agent.unseen_state(state_space)
+                if root_node is None:
+                    self.play_agent.unseen_state(state_space, state_hash, game_instance.game_round)
                 # Previously seen root node
                 else:
-                    self.play_agent.parent_node = self.play_agent.get_node(state_space)
+                    self.play_agent.parent_node = root_node
 
                 # expand either way in case of unseen children
                 self.play_agent.expand(
@@ -131,10 +119,12 @@ class Player:
                     game_instance,
                     requested_color,
                     played_cards,
-                    self.hand,
+                    hand_size,
+                    state_space,
+                    state_hash,
                 )
 
-                if np.random.random() > self.player_epsilon:
+                if util.get_np_random().random() > self.player_epsilon:
                     # evaluate the best state
                     card = self.play_agent.predict()
                 else:
@@ -150,9 +140,11 @@ class Player:
                     game_instance,
                     requested_color,
                     played_cards,
-                    self.hand,
+                    hand_size,
+                    state_space,
+                    state_hash,
                 )
-                if np.random.random() > self.player_epsilon:
+                if util.get_np_random().random() > self.player_epsilon:
                     # evaluate the best resulting state and return the corresponding move
                     card = self.play_agent.predict()
                 else:
@@ -163,19 +155,22 @@ class Player:
                 new_parent = self.play_agent.parent_node
                 new_state = new_parent.state
                 sparse_state = util.key_to_state(self.play_agent.input_size, new_state)
-                nodes = self.play_agent.nodes
+                stored_node = self.play_agent.nodes.get(new_parent.hash, new_state)
+                if stored_node is None:
+                    # already evicted again by a small node budget
+                    stored_node = new_parent
 
-                nodes[new_state].actual_encounters += 1
+                stored_node.actual_encounters += 1
 
                 if self.verbose >= 2:
                     util.write_state(sparse_state, "all-states", self.play_agent.input_size)
 
                 # if node was encountered before
-                if nodes[new_state].actual_encounters > 1:
+                if stored_node.actual_encounters > 1:
                     self.play_agent.cntr[game_instance.game_round - 1] += 1
 
                     if self.reoccur_bool:
-                        if len(self.hand) > 1:
+                        if hand_size > 1:
                             util.write_state(sparse_state, os.path.join(self.reoccur_path, "reoccured-states"),
                                              self.play_agent.input_size)
                             file_path = os.path.join(self.reoccur_path, "reoccured-states.pkl")
@@ -209,7 +204,7 @@ class Player:
         elif self.player_type == "learned":
             key_state = util.state_to_key(state_space)
             # ROOT NODE (cards in hand == round) -> add root and children
-            if len(self.hand) == game_instance.game_round:
+            if hand_size == game_instance.game_round:
                 self.play_agent.parent_node = Playing_Agent.Node(key_state, root=1)
 
             self.play_agent.expand(
@@ -218,7 +213,8 @@ class Player:
                 game_instance,
                 requested_color,
                 played_cards,
-                self.hand,
+                hand_size,
+                state_space,
                 run_type="learned",
             )
             # get action from network
@@ -229,44 +225,40 @@ class Player:
             card = legal_cards[0]
 
         elif self.player_type == "random":
-            card = random.choice(legal_cards)
+            card = util.get_random().choice(legal_cards)
 
 
         elif self.player_type == "heuristic":
             # dodge win as high as possible if I am already at my goal
             if self.player_guesses <= self.trick_wins:
-                sorted_legal = sorted(legal_cards, key=lambda x: x[1], reverse=True)
+                sorted_legal = sorted(legal_cards, key=lambda x: cards.VALUE[x], reverse=True)
+                # probe each option against blue jokers for the players that still have to play
+                turn = len(played_cards)
+                trick = played_cards + [0] * (3 - turn)
                 for card_option in sorted_legal:
-                    if util.trick_winner(
-                        played_cards
-                        + [card_option]
-                        + [(0, 0)] * (2 - len(played_cards)),
-                        trump,
-                    ) != len(played_cards):
+                    trick[turn] = card_option
+                    if cards.trick_winner(trick[0], trick[1], trick[2], trump) != turn:
                         card = card_option
                         break
 
             # Still need wins
             else:
-                reversed_sort_legal = sorted(legal_cards, key=lambda x: x[1])
+                reversed_sort_legal = sorted(legal_cards, key=lambda x: cards.VALUE[x])
                 # see if I can for sure win this round with lowest card possible
                 if len(played_cards) == 2:
                     for card_option in reversed_sort_legal:
-                        if (
-                            util.trick_winner(played_cards + [card_option], trump)
-                            == 2
-                        ):
+                        if cards.trick_winner(played_cards[0], played_cards[1], card_option, trump) == 2:
                             card = card_option
                             break
 
                     if card is None:
                         card = reversed_sort_legal[0]
                         # Throw away lowest non-trump (if there is one), unless card is much higher than trump
-                        if card[0] == trump:
+                        if cards.SUIT[card] == trump:
                             for card_option in reversed_sort_legal[1:]:
                                 if (
-                                    card_option[0] != trump
-                                    and card_option[1] - card[1] < 10
+                                    cards.SUIT[card_option] != trump
+                                    and cards.VALUE[card_option] - cards.VALUE[card] < 10
                                 ):
                                     card = card_option
                                     break
@@ -276,21 +268,17 @@ class Player:
             # card = random.choice(legal_cards)
 
         if self.verbose >= 3:
-            print("Card at end of play_card: ", self.hand, card)
+            print("Card at end of play_card: ", self.get_hand(), card)
 
-        if card not in self.idx_dict.keys():
+        if not self.hand >> card & 1:
             print("Card not in hand? error..")
-            print(legal_cards, card, self.idx_dict, self.hand)
+            print(legal_cards, card, self.get_hand())
             print(f"Player: {self.player_name}, Type: {self.player_type}")
 
-        elif card != self.hand[self.idx_dict[card]]:
-            print("Oh no! it went wrong!, card is not at that index?")
-            self.hand.remove(card)
-
         else:
-            del self.hand[self.idx_dict[card]]
+            self.remove_card(card)
 
-        assert type(card) == tuple, f"tuple card expected, got: {card}, which is type {type(card)}"
+        assert type(card) == int, f"int card expected, got: {card}, which is type {type(card)}"
         return card
 
     def guess_wins(self, max_guesses: int, trump: int, state_space=None) -> int:
@@ -302,41 +290,43 @@ class Player:
         :return: None
         """
         if self.guess_type == "random":
-            self.player_guesses = random.randrange(max_guesses + 1)
+            self.player_guesses = util.get_random().randrange(max_guesses + 1)
         else:
             # print("im the smart one")
             if self.guess_type == "learning":
                 self.current_state = state_space
-                if np.random.random() > self.epsilon:
+                if util.get_np_random().random() > self.epsilon:
                     # Get action from Q table
                     self.player_guesses = self.guess_agent.get_guess(state_space)
                 else:
                     # Get random action
-                    self.player_guesses = random.randrange(max_guesses + 1)
+                    self.player_guesses = util.get_random().randrange(max_guesses + 1)
             elif self.guess_type == "learned":
                 self.current_state = state_space
                 self.player_guesses = np.argmax(self.guess_agent.get_qs(state_space))
             else:
                 guesses = 0
-                for card in self.hand:
+                for card in cards.cards_of(self.hand):
+                    suit = cards.SUIT[card]
+                    value = cards.VALUE[card]
 
                     # count wizards as win
-                    if card[1] == 14:
+                    if value == 14:
                         guesses += 1
                         self.win_cards.append(card)
 
                     # count high trumps as win
-                    elif card[0] == trump and card[1] > 7:
+                    elif suit == trump and value > 7:
                         guesses += 1
                         self.win_cards.append(card)
 
                     # count low trumps when there are few cards
-                    elif max_guesses < 5 and card[0] == trump and card[1] > 0:
+                    elif max_guesses < 5 and suit == trump and value > 0:
                         guesses += 1
                         self.win_cards.append(card)
 
                     # count non-trump high cards as win except for early rounds
-                    elif max_guesses > 4 and card[1] > 10:
+                    elif max_guesses > 4 and value > 10:
                         guesses += 1
                         self.win_cards.append(card)
 
@@ -355,8 +345,8 @@ class Player:
             )
             self.guess_agent.train()
 
-    def get_hand(self):
-        return self.hand[:]
+    def get_hand(self) -> list:
+        return cards.cards_of(self.hand)
 
     def get_guesses(self):
         return self.player_guesses
@@ -0,0 +1,136 @@
+import numpy as np
+
+import cards
+import state_schema
+import utility_functions as util
+
+
+class PlayingStateBuffer:
+    """
+    Preallocated playing state of one player, kept up to date in place.
+    Only the parts of the game that changed since the previous request are rewritten,
+    so getting the state costs a copy instead of rebuilding it.
+    The zobrist hash of the state is updated along with every changed feature
+    """
+    def __init__(self, input_size: int):
+        self.input_size = input_size
+        self.layout = util.playing_layout(input_size)
+        self.zobrist_rows = state_schema.playing_schema(input_size).zobrist_rows()
+        self.state = np.zeros(input_size, dtype=int)
+        self.hash = 0
+
+        # what is currently written in the buffer
+        self.hand = 0
+        self.trick_indices = []
+        self.history_tricks = []
+        self.history_indices = []
+
+    def set(self, index: int, value: int) -> None:
+        """
+        Write a single feature and update the hash
+        :param index: index of the feature
+        :param value: new value
+        :return: None
+        """
+        old_value = self.state[index]
+        if old_value != value:
+            row = self.zobrist_rows[index]
+            self.hash ^= row[old_value] ^ row[value]
+            self.state[index] = value
+
+    def set_range(self, start: int, values) -> None:
+        """
+        Write consecutive features, only the ones that changed touch the hash
+        :param start: index of the first feature
+        :param values: new values
+        :return: None
+        """
+        values = np.asarray(values)
+        for offset in np.flatnonzero(self.state[start: start + len(values)] != values).tolist():
+            self.set(start + offset, values[offset])
+
+    def update(self, game_instance, player_order: list, player, played_trick: list, possible_cards: tuple):
+        """
+        Bring the buffer up to date with the game and return the playing state
+        :param game_instance: instance of the game, either game.Game or interactive_game.Game
+        :param player_order: list of players in turn order
+        :param player: player that needs to make a move using the state space
+        :param played_trick: Cards played in the current trick thus far
+        :param possible_cards: the two lists of cards the other players might still have
+        :return: copy of the playing state
+        """
+        layout = self.layout
+
+        if player.hand != self.hand:
+            for card in cards.cards_of(player.hand ^ self.hand):
+                self.set(layout["hand"] + card, (player.hand >> card) & 1)
+            self.hand = player.hand
+
+        for suit in range(5):
+            self.set(layout["trump"] + suit, int(suit == game_instance.trump))
+
+        guess_pos = layout["guesses"]
+        if layout["n_guesses"] == 3:
+            # own guess first, the old system only uses other players' guesses
+            self.set(guess_pos, player.get_guesses())
+            guess_pos += 1
+        self.set(layout["round"], game_instance.game_round)
+        self.set(layout["tricks_needed"], player.get_guesses() - player.get_trick_wins())
+
+        others = [p for p in game_instance.players if p != player]
+        for i, other_player in enumerate(others):
+            self.set(guess_pos + i, other_player.get_guesses())
+            self.set(layout["tricks_needed_others"] + i, other_player.get_guesses() - other_player.get_trick_wins())
+
+        if layout["order_size"] == 1:
+            self.set(layout["order"], player_order.index(player))
+        elif layout["order_size"] == 3:
+            for i, p in enumerate(player_order):
+                self.set(layout["order"] + i, int(p.player_name[-1]))
+
+        # played trick is ordered in order of play, except for the old system
+        for index in self.trick_indices:
+            self.set(index, 0)
+        slot_size = 60 if layout["trick_ordered"] else 0
+        self.trick_indices = [layout["trick"] + turn * slot_size + card for turn, card in enumerate(played_trick)]
+        for index in self.trick_indices:
+            self.set(index, 1)
+
+        if layout["round_history"] is not None:
+            self.update_history(game_instance.played_round)
+
+        if layout["possible_cards"] is not None:
+            self.set_range(layout["possible_cards"], possible_cards[0])
+            self.set_range(layout["possible_cards"] + 60, possible_cards[1])
+
+        return self.state.copy()
+
+    def update_history(self, played_round: list) -> None:
+        """
+        Sync the 20 tricks of 3 one-hot encoded cards with the tricks played this round
+        :param played_round: tricks played so far this round
+        :return: None
+        """
+        # written tricks are kept while the played round starts with the same cards, the rest is cleared.
+        # Compared by content, the game may reuse and change the list of a trick
+        kept = 0
+        while (
+            kept < len(self.history_tricks)
+            and kept < len(played_round)
+            and self.history_tricks[kept] == tuple(played_round[kept])
+        ):
+            kept += 1
+        for indices in self.history_indices[kept:]:
+            for index in indices:
+                self.set(index, 0)
+        del self.history_tricks[kept:]
+        del self.history_indices[kept:]
+
+        start = self.layout["round_history"]
+        for trick in range(kept, len(played_round)):
+            trick_plays = played_round[trick]
+            indices = [start + trick_plays[turn] + turn * 60 + trick * 180 for turn in range(3)]
+            for index in indices:
+                self.set(index, 1)
+            self.history_tricks.append(tuple(trick_plays))
+            self.history_indices.append(indices)
@@ -2,6 +2,7 @@ import argparse
 import pickle
 import Playing_Agent
 import numpy as np
+import state_schema
 import utility_functions as util
 
 from collections import Counter
@@ -37,6 +38,7 @@ if __name__ == "__main__":
 
     print(util.key_to_state(args.player_size, reoccur_nonterminal[0]), len(reoccur_nonterminal), len(reoccur_terminal))
     print(len(set(reoccur_nonterminal)), len(set(reoccur_terminal)))
+    round_index = state_schema.playing_schema(args.player_size).offset("round")
     cntr = Counter(reoccur_terminal)
     for value in [20, 100, 215, 1000, 2000, 5000, 9011]:
         top_half = cntr.most_common(value)
@@ -47,9 +49,8 @@ if __name__ == "__main__":
         print(f"Unique states: {len(top_half)}")
         rounds = []
         for state in top_half_states:
-            input_size = 192
-            play_state = util.key_to_state(input_size, state)
-            rounds.append(play_state[68])
+            play_state = util.key_to_state(args.player_size, state)
+            rounds.append(play_state[round_index])
         cntr_rounds = Counter(rounds)
         print(f"Unique states round 1-5: {sum([cntr_rounds[i] for i in range(1,6)])}")
         print(f"Unique states round 6-10: {sum([cntr_rounds[i] for i in range(6, 11)])}")
@@ -0,0 +1,317 @@
+import numpy as np
+
+import cards
+
+
+class Segment:
+    """
+    Named part of a state, the kind determines how its value is encoded:
+    "mask": bitmask of cards, one-hot over the 60 cards
+    "cards": list of card ids, one-hot over the 60 cards
+    "sequence": card ids in order of play, every card gets its own slot of 60
+    "onehot": a single index
+    "flags": one 0/1 value per card
+    "values": plain integers
+    """
+    def __init__(self, name: str, size: int, kind: str, label: str):
+        self.name = name
+        self.size = size
+        self.kind = kind
+        self.label = label
+
+
+def _write_mask(state: np.ndarray, start: int, size: int, mask: int) -> None:
+    state[start: start + size] = cards.one_hot_array(mask)
+
+
+def _write_cards(state: np.ndarray, start: int, size: int, card_list: list) -> None:
+    for card in card_list:
+        state[start + card] = 1
+
+
+def _write_sequence(state: np.ndarray, start: int, size: int, card_list: list) -> None:
+    for slot, card in enumerate(card_list):
+        state[start + slot * 60 + card] = 1
+
+
+def _write_onehot(state: np.ndarray, start: int, size: int, index: int) -> None:
+    state[start + index] = 1
+
+
+def _write_values(state: np.ndarray, start: int, size: int, values) -> None:
+    state[start: start + size] = values
+
+
+def _read_cards(state: np.ndarray, start: int, size: int) -> list:
+    return np.nonzero(state[start: start + size])[0].tolist()
+
+
+def _read_sequence(state: np.ndarray, start: int, size: int) -> list:
+    return [index % 60 for index in np.nonzero(state[start: start + size])[0].tolist()]
+
+
+def _read_onehot(state: np.ndarray, start: int, size: int) -> int:
+    return int(np.argmax(state[start: start + size]))
+
+
+def _read_values(state: np.ndarray, start: int, size: int):
+    if size == 1:
+        return int(state[start])
+    return state[start: start + size].astype(int).tolist()
+
+
+# writer and reader for every kind of segment
+_KINDS = {
+    "mask": (_write_mask, _read_cards),
+    "cards": (_write_cards, _read_cards),
+    "sequence": (_write_sequence, _read_sequence),
+    "onehot": (_write_onehot, _read_onehot),
+    "flags": (_write_values, _read_cards),
+    "values": (_write_values, _read_values),
+}
+
+
+# counters are hashed in [-32, 32)
+ZOBRIST_VALUES = 64
+
+
+class StateSchema:
+    """
+    Layout of a state as an ordered list of segments,
+    compiled once into the offsets and the encode/decode steps of every segment
+    """
+    def __init__(self, name: str, segments: list):
+        self.name = name
+        self.segments = {segment.name: segment for segment in segments}
+        self.offsets = dict()
+        self._steps = []
+        current_pos = 0
+        for segment in segments:
+            self.offsets[segment.name] = current_pos
+            writer, reader = _KINDS[segment.kind]
+            self._steps.append((segment.name, current_pos, segment.size, writer, reader))
+            current_pos += segment.size
+        self.size = current_pos
+
+        # keys pack the 0/1 features as bits, followed by the counters as int8
+        is_value = np.zeros(self.size, dtype=bool)
+        for segment in segments:
+            if segment.kind == "values":
+                is_value[self.offsets[segment.name]: self.offsets[segment.name] + segment.size] = True
+        self._bit_index = np.flatnonzero(~is_value)
+        self._value_index = np.flatnonzero(is_value)
+        self._n_bit_bytes = (len(self._bit_index) + 7) // 8
+        self.key_size = self._n_bit_bytes + len(self._value_index)
+        self._zobrist = None
+        self._zobrist_rows = None
+
+    def has(self, name: str) -> bool:
+        return name in self.offsets
+
+    def offset(self, name: str):
+        """
+        :param name: name of the segment
+        :return: start index of the segment, None if it is not in the state
+        """
+        return self.offsets.get(name)
+
+    def encode(self, values: dict, out=None) -> np.ndarray:
+        """
+        Encode a single state, values for segments that are not in the schema are ignored
+        :param values: dict with the value of every segment by name
+        :param out: optional zeroed array to write the state into
+        :return: encoded state
+        """
+        state = np.zeros(self.size, dtype=int) if out is None else out
+        for name, start, size, writer, _ in self._steps:
+            writer(state, start, size, values[name])
+        return state
+
+    def state_to_key(self, state: np.ndarray) -> bytes:
+        """
+        :param state: encoded state
+        :return: compact hashable key of the state
+        """
+        bits = np.packbits(state[self._bit_index] != 0)
+        return bits.tobytes() + state[self._value_index].astype(np.int8).tobytes()
+
+    def states_to_keys(self, states: np.ndarray) -> list:
+        """
+        :param states: array of shape (n, size) with encoded states
+        :return: list with the key of every state
+        """
+        bits = np.packbits(states[:, self._bit_index] != 0, axis=1)
+        counters = states[:, self._value_index].astype(np.int8).view(np.uint8)
+        packed = np.concatenate((bits, counters), axis=1).tobytes()
+        return [packed[start: start + self.key_size] for start in range(0, len(packed), self.key_size)]
+
+    def key_to_state(self, key: bytes) -> np.ndarray:
+        """
+        :param key: key made by state_to_key
+        :return: the state as float32 array
+        """
+        raw = np.frombuffer(key, dtype=np.uint8)
+        state = np.zeros(self.size, dtype="float32")
+        state[self._bit_index] = np.unpackbits(raw[:self._n_bit_bytes], count=len(self._bit_index))
+        state[self._value_index] = raw[self._n_bit_bytes:].view(np.int8)
+        return state
+
+    def keys_to_states(self, keys: list) -> np.ndarray:
+        """
+        :param keys: list of keys made by state_to_key
+        :return: array of shape (n, size) with the states as float32
+        """
+        raw = np.frombuffer(b"".join(keys), dtype=np.uint8).reshape(len(keys), self.key_size)
+        states = np.zeros((len(keys), self.size), dtype="float32")
+        states[:, self._bit_index] = np.unpackbits(raw[:, :self._n_bit_bytes], axis=1, count=len(self._bit_index))
+        states[:, self._value_index] = raw[:, self._n_bit_bytes:].view(np.int8)
+        return states
+
+    def keys_to_features(self, keys: list) -> tuple:
+        """
+        Non-zero features of many keys, without building the dense states
+        :param keys: list of keys made by state_to_key
+        :return: for every key an array with the indices of its non-zero features, and one with their values
+        """
+        raw = np.frombuffer(b"".join(keys), dtype=np.uint8).reshape(len(keys), self.key_size)
+        bits = np.unpackbits(raw[:, :self._n_bit_bytes], axis=1, count=len(self._bit_index))
+        counters = raw[:, self._n_bit_bytes:].view(np.int8)
+        bit_rows, bit_columns = np.nonzero(bits)
+        counter_rows, counter_columns = np.nonzero(counters)
+
+        rows = np.concatenate((bit_rows, counter_rows))
+        order = np.argsort(rows, kind="stable")
+        indices = np.concatenate((self._bit_index[bit_columns], self._value_index[counter_columns]))[order]
+        values = np.concatenate(
+            (np.ones(len(bit_rows), dtype=np.float32), counters[counter_rows, counter_columns].astype(np.float32))
+        )[order]
+        splits = np.cumsum(np.bincount(rows, minlength=len(keys)))[:-1]
+        return np.split(indices, splits), np.split(values, splits)
+
+    def zobrist_rows(self) -> list:
+        """
+        Random 64-bit value of every feature value, built on first use and the same in every process.
+        Row i gives the value for feature i, indexed by the feature value (negative counters wrap around),
+        a feature that is 0 adds nothing to the hash
+        :return: list with a row for every feature
+        """
+        if self._zobrist_rows is None:
+            rng = np.random.default_rng(self.size)
+            table = rng.integers(0, 2 ** 64, size=(self.size, ZOBRIST_VALUES), dtype=np.uint64, endpoint=False)
+            table[:, 0] = 0
+            rows = table.tolist()
+            for index in self._bit_index:
+                rows[index] = rows[index][:2]
+            # the rows are set last, games in other threads may build the table at the same time
+            self._zobrist = table
+            self._zobrist_rows = rows
+        return self._zobrist_rows
+
+    def state_hash(self, state: np.ndarray) -> int:
+        """
+        :param state: encoded state
+        :return: zobrist hash of the full state
+        """
+        self.zobrist_rows()
+        values = state.astype(np.intp) % ZOBRIST_VALUES
+        return int(np.bitwise_xor.reduce(self._zobrist[np.arange(self.size), values]))
+
+    def hash_delta(self, state: np.ndarray, indices: list, values: list) -> int:
+        """
+        :param state: encoded state before the change
+        :param indices: changed features
+        :param values: new values of the changed features
+        :return: value to xor with the hash of state to get the hash of the changed state
+        """
+        rows = self.zobrist_rows()
+        delta = 0
+        for index, value in zip(indices, values):
+            delta ^= rows[index][state[index]] ^ rows[index][value]
+        return delta
+
+    def decode(self, state: np.ndarray) -> dict:
+        """
+        :param state: encoded state
+        :return: dict with the value of every segment, card segments are lists of card ids
+        """
+        return {name: reader(state, start, size) for name, start, size, _, reader in self._steps}
+
+
+HAND = Segment("hand", 60, "mask", "Hand")
+HAND2 = Segment("hand2", 60, "mask", "Hand2")
+HAND3 = Segment("hand3", 60, "mask", "Hand3")
+TRUMP = Segment("trump", 5, "onehot", "Trump")
+ROUND = Segment("round", 1, "values", "Round")
+TURN = Segment("turn", 1, "values", "Order")
+ORDER = Segment("order", 3, "values", "Order")
+
+# guessing, guesses made before the player (padded with the average guess)
+PREVIOUS_GUESSES = Segment("previous_guesses", 2, "values", "Previous guesses")
+
+# playing, the old system only uses the other players' guesses and an unordered trick
+GUESSES = Segment("guesses", 3, "values", "Guesses")
+OTHER_GUESSES = Segment("guesses", 2, "values", "Guesses")
+TRICKS_NEEDED = Segment("tricks_needed", 1, "values", "Tricks needed")
+TRICKS_NEEDED_OTHERS = Segment("tricks_needed_others", 2, "values", "Tricks needed others")
+TRICK = Segment("trick", 120, "sequence", "played trick")
+UNORDERED_TRICK = Segment("trick", 60, "cards", "played trick")
+ROUND_HISTORY = Segment("round_history", 3600, "sequence", "played round")
+POSSIBLE_CARDS_ONE = Segment("possible_cards_one", 60, "flags", "possible cards one")
+POSSIBLE_CARDS_TWO = Segment("possible_cards_two", 60, "flags", "possible cards two")
+
+_PLAYING_BASE = [HAND, TRUMP, GUESSES, ROUND, TRICKS_NEEDED, TRICKS_NEEDED_OTHERS]
+
+GUESSING_SCHEMAS = {
+    schema.size: schema
+    for schema in [
+        StateSchema("guess", [HAND, TRUMP, PREVIOUS_GUESSES, ROUND]),
+        StateSchema("guess with turn", [HAND, TRUMP, PREVIOUS_GUESSES, ROUND, TURN]),
+        StateSchema("guess with order", [HAND, TRUMP, PREVIOUS_GUESSES, ROUND, ORDER]),
+        StateSchema("cheating guess", [HAND, HAND2, HAND3, TRUMP, PREVIOUS_GUESSES, ROUND]),
+    ]
+}
+
+PLAYING_SCHEMAS = {
+    schema.size: schema
+    for schema in [
+        StateSchema("play", _PLAYING_BASE + [TRICK]),
+        StateSchema("play with turn", _PLAYING_BASE + [TURN, TRICK]),
+        StateSchema("play with order", _PLAYING_BASE + [ORDER, TRICK]),
+        StateSchema(
+            "old play",
+            [HAND, TRUMP, OTHER_GUESSES, ROUND, TRICKS_NEEDED, TRICKS_NEEDED_OTHERS, UNORDERED_TRICK, ROUND_HISTORY],
+        ),
+        StateSchema("play with history", _PLAYING_BASE + [TRICK, ROUND_HISTORY]),
+        StateSchema("play with turn and history", _PLAYING_BASE + [TURN, TRICK, ROUND_HISTORY]),
+        StateSchema("play with order and history", _PLAYING_BASE + [ORDER, TRICK, ROUND_HISTORY]),
+        StateSchema(
+            "play with turn and possible cards", _PLAYING_BASE + [TURN, TRICK, POSSIBLE_CARDS_ONE, POSSIBLE_CARDS_TWO]
+        ),
+        StateSchema(
+            "play with order and possible cards", _PLAYING_BASE + [ORDER, TRICK, POSSIBLE_CARDS_ONE, POSSIBLE_CARDS_TWO]
+        ),
+    ]
+}
+
+
+def _get_schema(schemas: dict, input_size: int, kind: str) -> StateSchema:
+    if input_size not in schemas:
+        print(f"No {kind} state schema for input size {input_size}, known sizes are {sorted(schemas)}")
+        exit()
+    return schemas[input_size]
+
+
+def guessing_schema(input_size: int) -> StateSchema:
+    """
+    :param input_size: input size of the guessing model
+    :return: schema of the guessing state
+    """
+    return _get_schema(GUESSING_SCHEMAS, input_size, "guessing")
+
+
+def playing_schema(input_size: int) -> StateSchema:
+    """
+    :param input_size: input size of the playing model
+    :return: schema of the playing state
+    """
+    return _get_schema(PLAYING_SCHEMAS, input_size, "playing")
@@ -0,0 +1,69 @@
+import json
+import os
+import sys
+
+CONFIG_PATH = "thread_config.json"  # Written by thread_probe.py
+
+# thread pools of the BLAS libraries behind NumPy, read when they are loaded
+BLAS_VARIABLES = ["OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"]
+
+
+def load_config(path=CONFIG_PATH):
+    """
+    :param path: path to the config written by thread_probe.py
+    :return: the config as dict, None if there is no config
+    """
+    if not path or not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def worker_cores(threads: int, worker: int) -> list:
+    """
+    :param threads: cores per process
+    :param worker: index of the process among the processes sharing the node
+    :return: the cores of the worker, consecutive blocks of the cores this process may use
+    """
+    available = sorted(os.sched_getaffinity(0))
+    start = (worker * threads) % len(available)
+    return [available[(start + i) % len(available)] for i in range(min(threads, len(available)))]
+
+
+def apply_thread_budget(path=CONFIG_PATH, worker=None):
+    """
+    Limit the thread pools of TensorFlow and NumPy to the budget in the config and,
+    for a worker of a pool, pin the process to its own cores.
+    TensorFlow reads its settings when it starts, so call this before the first model is used
+    :param path: path to the config written by thread_probe.py
+    :param worker: index of the process in a pool of workers, None for a single process
+    :return: the applied config, None if there is no config
+    """
+    config = load_config(path)
+    if config is None:
+        return None
+
+    if worker is not None and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, worker_cores(config["threads_per_process"], worker))
+
+    for variable in BLAS_VARIABLES:
+        os.environ[variable] = str(config["numpy_threads"])
+    os.environ["TF_NUM_INTRAOP_THREADS"] = str(config["intra_op_threads"])
+    os.environ["TF_NUM_INTEROP_THREADS"] = str(config["inter_op_threads"])
+
+    if "tensorflow" in sys.modules:
+        # already imported, set the pools directly as long as they are not created yet
+        import tensorflow as tf
+        try:
+            tf.config.threading.set_intra_op_parallelism_threads(config["intra_op_threads"])
+            tf.config.threading.set_inter_op_parallelism_threads(config["inter_op_threads"])
+        except RuntimeError:
+            print("TensorFlow is already running, its thread pools keep their size")
+
+    try:
+        # the BLAS of NumPy is loaded already, its pools can only be limited at runtime with threadpoolctl
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(config["numpy_threads"])
+    except ImportError:
+        print(f"threadpoolctl is not installed, numpy_threads {config['numpy_threads']} is not applied to NumPy")
+    return config
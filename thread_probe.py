@@ -0,0 +1,117 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from thread_budget import CONFIG_PATH
+
+PREDICTS_PER_FIT = 60  # Batched predicts between two training steps, about one per trick of every player in a round
+CHILDREN = 20  # Batch size of a predict, the children of an expanded node
+
+
+def parse_args() -> argparse.Namespace:
+    """
+    Function to parse arguments.
+    Returns:
+    parser: Argument parser containing arguments.
+    """
+
+    parser = argparse.ArgumentParser(
+        description="Benchmark the models under different thread settings and write the recommended config"
+    )
+    parser.add_argument("--player_size", help="input size of the playing model", default=3731, type=int)
+    parser.add_argument("--processes", help="How many runs share the node", default=1, type=int)
+    parser.add_argument("--repeats", help="How many times to time every call", default=50, type=int)
+    parser.add_argument("--output", help="Where to write the config", default=CONFIG_PATH, type=str)
+    parser.add_argument("--measure", help=argparse.SUPPRESS, nargs=2, type=int, default=None)
+    return parser.parse_args()
+
+
+def measure(player_size: int, intra_op: int, inter_op: int, repeats: int) -> dict:
+    """
+    Time the calls the project makes, run in its own process because TensorFlow only reads
+    its thread settings once
+    :return: seconds per training step, per predict of one state and per predict of the children of a node
+    """
+    os.environ["TF_NUM_INTRAOP_THREADS"] = str(intra_op)
+    os.environ["TF_NUM_INTEROP_THREADS"] = str(inter_op)
+    import numpy as np
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(intra_op)
+    tf.config.threading.set_inter_op_parallelism_threads(inter_op)
+    from Playing_Network import MINIBATCH_SIZE, PlayingNetwork
+
+    network = PlayingNetwork(player_size, None)
+    rng = np.random.default_rng(0)
+    states = (rng.random((MINIBATCH_SIZE, player_size)) < 0.02).astype(np.float32)
+    rewards = rng.random(MINIBATCH_SIZE)
+
+    def seconds(call) -> float:
+        call()
+        start = time.perf_counter()
+        for _ in range(repeats):
+            call()
+        return (time.perf_counter() - start) / repeats
+
+    return {
+        "fit": seconds(lambda: network.model.fit(states, rewards, batch_size=MINIBATCH_SIZE, verbose=0)),
+        "predict": seconds(lambda: network.forward(states[:1])),
+        "predict_children": seconds(lambda: network.forward(states[:CHILDREN])),
+    }
+
+
+def candidates(threads: int) -> list:
+    """
+    :param threads: cores per process
+    :return: (intra op, inter op) settings to try
+    """
+    intra_ops = sorted({1, 2, 4, 8, threads} & set(range(1, threads + 1)))
+    return [(intra_op, inter_op) for intra_op in intra_ops for inter_op in (1, 2) if inter_op <= threads]
+
+
+def probe(player_size: int, processes: int, repeats: int, output: str) -> None:
+    threads = max(len(os.sched_getaffinity(0)) // processes, 1)
+    print(f"{threads} cores per process for {processes} processes")
+
+    results = []
+    for intra_op, inter_op in candidates(threads):
+        run = subprocess.run(
+            [sys.executable, __file__, "--player_size", str(player_size), "--repeats", str(repeats),
+             "--measure", str(intra_op), str(inter_op)],
+            capture_output=True,
+            text=True,
+        )
+        if run.returncode != 0:
+            print(f"intra {intra_op}, inter {inter_op} failed:\n{run.stderr[-2000:]}")
+            continue
+        timings = json.loads(run.stdout.strip().splitlines()[-1])
+        cost = timings["fit"] + PREDICTS_PER_FIT * timings["predict_children"]
+        results.append((cost, intra_op, inter_op, timings))
+        print(f"intra {intra_op}, inter {inter_op}: {timings}, cost {cost * 1000:.2f} ms")
+
+    if not results:
+        print("No thread setting could be measured")
+        exit()
+    cost, intra_op, inter_op, timings = min(results)
+    config = {
+        "threads_per_process": threads,
+        "intra_op_threads": intra_op,
+        "inter_op_threads": inter_op,
+        "numpy_threads": intra_op,
+        "processes": processes,
+        "player_size": player_size,
+        "timings": timings,
+    }
+    with open(output, "w") as f:
+        json.dump(config, f, indent=2)
+    print(f"Recommended intra {intra_op}, inter {inter_op}, written to {output}")
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.measure:
+        print(json.dumps(measure(args.player_size, args.measure[0], args.measure[1], args.repeats)))
+    else:
+        probe(args.player_size, args.processes, args.repeats, args.output)
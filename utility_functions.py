@@ -1,9 +1,40 @@
-import copy
 import numpy as np
+import random
+import threading
 
-import game
-import interactive_game
-from scipy.sparse import coo_matrix
+import cards
+import state_schema
+
+# playing layouts by input size, filled on first use
+_PLAYING_LAYOUTS = dict()
+
+# random state of the game the current thread plays, set by seed_thread
+_THREAD_RANDOM = threading.local()
+
+
+def seed_thread(seed: int) -> None:
+    """
+    Give the current thread its own seeded random states, so games played at the same time
+    in different threads do not draw from (or reseed) the same random state
+    :param seed: seed of the python and numpy random state
+    :return: None
+    """
+    _THREAD_RANDOM.random = random.Random(seed)
+    _THREAD_RANDOM.np_random = np.random.RandomState(seed)
+
+
+def get_random():
+    """
+    :return: python random state of the current thread, the random module when the thread was never seeded
+    """
+    return getattr(_THREAD_RANDOM, "random", random)
+
+
+def get_np_random():
+    """
+    :return: numpy random state of the current thread, np.random when the thread was never seeded
+    """
+    return getattr(_THREAD_RANDOM, "np_random", np.random)
 
 
 def write_state(play_state: np.ndarray, output_path: str, input_size: int, actual=False, write_mode="a") -> None:
@@ -16,158 +47,71 @@ def write_state(play_state: np.ndarray, output_path: str, input_size: int, actua
     :param write_mode: for manually setting the write mode
     :return:
     """
+    schema = state_schema.playing_schema(input_size)
     f = open(f"{output_path}.txt", write_mode)
     f.write("\n\n\n")
-    np.set_printoptions(threshold=np.inf)
     if actual:
         f.write("Actual node\n")
     else:
         f.write("Simulated node\n")
-    f.write("Hand: " + str(np.nonzero(play_state[:60])[0].tolist()) + "\n")
-    current_pos = 60
-    # # if cheater
-    # if input_size % 100 == 15 or input_size % 100 == 13:
-    #     f.write("Hand2: " + str(np.nonzero(play_state[60:120])[0].tolist()) + "\n")
-    #     f.write("Hand3: " + str(np.nonzero(play_state[120:180])[0].tolist()) + "\n")
-    #     current_pos = 180
-    f.write("Trump: " + str(play_state[current_pos: current_pos + 5]) + "\n")
-    current_pos += 5
-
-    # if old
-    if input_size % 100 == 31:
-        f.write("Guesses: " + str(play_state[current_pos: current_pos + 2]) + "\n")
-        current_pos += 2
-    else:
-        f.write("Guesses: " + str(play_state[current_pos: current_pos + 3]) + "\n")
-        current_pos += 3
-    f.write("Round: " + str(play_state[current_pos]) + "\n")
-    f.write("Tricks needed: " + str(play_state[current_pos + 1]) + "\n")
-    current_pos += 2
-
-    f.write(
-        "Tricks needed others: " + str(play_state[current_pos: current_pos + 2]) + "\n"
-    )
-    current_pos += 2
-
-    if input_size % 100 == 92:
-        f.write(
-            "played trick: "
-            + str(
-                np.nonzero(play_state[current_pos: current_pos + 120])[0].tolist()
-            )
-            + "\n"
-        )
-        current_pos += 120
-    # if not olds
-    elif input_size % 100 == 93 or input_size == 313:
-        f.write("Order: " + str(play_state[current_pos]) + "\n")
-        f.write(
-            "played trick: "
-            + str(
-                np.nonzero(play_state[current_pos + 1: current_pos + 121])[0].tolist()
-            )
-            + "\n"
-        )
-        current_pos += 121
-    elif input_size % 100 == 95 or input_size == 315:
-        f.write("Order: " + str(play_state[current_pos: current_pos + 3]) + "\n")
-        f.write(
-            "played trick: "
-            + str(
-                np.nonzero(play_state[current_pos + 3: current_pos + 123])[0].tolist()
-            )
-            + "\n"
-        )
-        current_pos += 123
-    elif input_size % 100 == 31:
-        f.write(
-            "played trick: "
-            + str(np.nonzero(play_state[current_pos: current_pos + 60])[0].tolist())
-            + "\n"
-        )
-        current_pos += 60
-
-    # if not small
-    if input_size > 3600:
-        f.write(
-            "played round: "
-            + str(np.nonzero(play_state[current_pos:])[0].tolist())
-            + "\n"
-        )
-
-    if input_size in [313, 315]:
-        f.write(
-            "possible cards one: "
-            + str(np.nonzero(~(play_state[current_pos:current_pos+60] != 0))[0].tolist())
-            + "\n"
-        )
-        f.write(
-            "possible cards two: "
-            + str(np.nonzero(~(play_state[current_pos+60:] != 0))[0].tolist())
-            + "\n"
-        )
+    for name, value in schema.decode(play_state).items():
+        f.write(f"{schema.segments[name].label}: {value}\n")
     f.close()
 
 
 def trick_winner(played_cards: list, trump: int) -> int:
     """
     Determine the winner of a trick
-    :param played_cards: cards played in the trick
+    :param played_cards: card ids played in the trick
     :param trump: trump-suit, used to determine the winner
     :return: index of the winning card
     """
-    strongest_card = 0
-    if played_cards[0][1] == 14:  # If first player played a wizard
-        return 0
-
-    for i in range(1, 3):
-
-        if played_cards[i][1] == 14:  # If i-th player played a wizard
-            return i
-
-        # if i-th card is trump and strongest card is not
-        if played_cards[i][0] == trump and played_cards[strongest_card][0] != trump:
-            if played_cards[i][1] > 0:  # joker does not count as trump card
-                strongest_card = i
-
-        # if cards are the same suit
-        if played_cards[i][0] == played_cards[strongest_card][0]:
-            if played_cards[i][1] > played_cards[strongest_card][1]:
-                strongest_card = i
-
-        # if strongest card is a joker and i-th card is not
-        if played_cards[strongest_card][1] == 0 and played_cards[i][1] != 0:
-            strongest_card = i
-
-    return strongest_card
-
-
-def key_to_state(input_size: int, node_state: tuple) -> np.ndarray:
-    split = int(len(node_state) / 3)
-    sparse_state = (
-        coo_matrix(
-            (
-                node_state[:split],
-                (node_state[split: split * 2], node_state[split * 2:]),
-            )
-        )
-        .toarray()[0]
-        .astype("float32")
-    )
-    sparse_state = np.pad(
-        sparse_state, (0, input_size - len(sparse_state)), "constant"
-    )
-    return sparse_state
+    return cards.trick_winner(played_cards[0], played_cards[1], played_cards[2], trump)
 
 
-def state_to_key(state_space: np.ndarray) -> tuple:
-    compressed_state = coo_matrix(state_space)
-    key_state = tuple(
-        np.concatenate(
-            (compressed_state.data, compressed_state.row, compressed_state.col)
-        )
-    )
-    return key_state
+def key_to_state(input_size: int, node_state: bytes) -> np.ndarray:
+    """
+    :param input_size: input size of the playing model
+    :param node_state: key of the state, see state_to_key
+    :return: playing state as float32 array
+    """
+    return state_schema.playing_schema(input_size).key_to_state(node_state)
+
+
+def keys_to_states(input_size: int, node_states: list) -> np.ndarray:
+    """
+    :param input_size: input size of the playing model
+    :param node_states: keys of the states, see state_to_key
+    :return: array of shape (n, input_size) with the playing states as float32
+    """
+    return state_schema.playing_schema(input_size).keys_to_states(node_states)
+
+
+def keys_to_features(input_size: int, node_states: list) -> tuple:
+    """
+    :param input_size: input size of the playing model
+    :param node_states: keys of the states, see state_to_key
+    :return: for every state the indices of its non-zero features and their values
+    """
+    return state_schema.playing_schema(input_size).keys_to_features(node_states)
+
+
+def state_to_key(state_space: np.ndarray) -> bytes:
+    """
+    Compact hashable key of a playing state, the 0/1 features are packed as bits
+    and the counters (guesses, round, tricks needed, order) follow as int8
+    :param state_space: playing state
+    :return: key of the state
+    """
+    return state_schema.playing_schema(len(state_space)).state_to_key(state_space)
+
+
+def states_to_keys(states: np.ndarray) -> list:
+    """
+    :param states: array of shape (n, input_size) with playing states
+    :return: list with the key of every state
+    """
+    return state_schema.playing_schema(states.shape[1]).states_to_keys(states)
 
 
 def str_to_card(card: str, hand=None) -> tuple:
@@ -193,108 +137,143 @@ def str_to_card(card: str, hand=None) -> tuple:
     return suits[suit], int(value)
 
 
-def card_to_str(card: tuple) -> str:
+def card_to_str(card: int) -> str:
     # cards are suit {0-3} (blue, yellow, red, green), value {0-14} (0 == joker, 14 == wizard)
     try:
-        suit, value = card
-    except (TypeError, ValueError) as error:
+        suit, value = cards.card_tuple(card)
+    except (TypeError, IndexError) as error:
         print(f"Obtained {card} in card_to_str, which is type {type(card)}. This caused {error}")
         exit()
     suits = {0: "blue", 1: "yellow", 2: "red", 3: "green"}
     return " ".join([suits[suit], str(value)])
 
 
-def temp_game(game_instance, played_cards, interactive=False):
+def tracks_possible_cards(player) -> bool:
     """
-    returns a temporary copy of game_instance to simulate different plays
-    :param game_instance: the game to copy
-    :param played_cards: cards played in trick so far
-    :return:
+    :param player: player of the game
+    :return: whether the player uses a playing state with the cards the opponents may still hold
     """
-    old_guess_agent = None
-    old_epsilon = None
-
-    old_play_agent = None
-    old_play_epsilon = None
-
-    if game_instance.player1.guess_type.startswith("learn"):
-        old_guess_agent = game_instance.player1.guess_agent
-        old_epsilon = game_instance.player1.epsilon
-    if game_instance.player1.player_type.startswith("learn"):
-        old_play_agent = game_instance.player1.play_agent
-        old_play_epsilon = game_instance.player1.player_epsilon
-
-    old_guess_agent2 = None
-    old_play_agent2 = None
-    old_guess_agent3 = None
-    old_play_agent3 = None
-
-    if not interactive and game_instance.opp_guesstype.startswith("learn"):
-        old_guess_agent2 = game_instance.player2.guess_agent
-        old_guess_agent3 = game_instance.player3.guess_agent
-    if not interactive and game_instance.opp_playertype.startswith("learn"):
-        old_play_agent2 = game_instance.player2.play_agent
-        old_play_agent3 = game_instance.player3.play_agent
-
-    if not interactive:
-        temp_instance = game.Game(
-            full_deck=copy.deepcopy(game_instance.full_deck),
-            deck_dict=copy.deepcopy(game_instance.deck_dict),
-            guess_type=copy.deepcopy(game_instance.player1.guess_type),
-            player_type=copy.deepcopy(game_instance.player1.player_type),
-            guess_agent=copy.copy(old_guess_agent),
-            playing_agent=copy.copy(old_play_agent),
-            epsilon=copy.deepcopy(old_epsilon),
-            player_epsilon=copy.deepcopy(old_play_epsilon),
-            verbose=copy.deepcopy(game_instance.player1.verbose),
-            opp_guesstype=copy.deepcopy(game_instance.opp_guesstype),
-            opp_playertype=copy.deepcopy(game_instance.opp_playertype),
-            guess_agent2=copy.copy(old_guess_agent2),
-            playing_agent2=copy.copy(old_play_agent2),
-            guess_agent3=copy.copy(old_guess_agent3),
-            playing_agent3=copy.copy(old_play_agent3),
-        )
-        temp_instance.output_path = copy.deepcopy(game_instance.output_path)
-        temp_instance.game_round = copy.deepcopy(game_instance.game_round)
-    else:
-        temp_instance = interactive_game.Game(
-            deck_dict=copy.deepcopy(game_instance.deck_dict),
-            guess_type=copy.deepcopy(game_instance.player1.guess_type),
-            game_round=copy.deepcopy(game_instance.game_round),
-            player_type=copy.deepcopy(game_instance.player1.player_type),
-            guess_agent=copy.copy(old_guess_agent),
-            playing_agent=copy.copy(old_play_agent),
-        )
-
-    temp_instance.deck = copy.deepcopy(game_instance.deck)
-    temp_instance.trump = copy.deepcopy(game_instance.trump)
-    temp_instance.played_cards = copy.deepcopy(played_cards)
-    temp_instance.played_round = copy.deepcopy(game_instance.played_round)
-    temp_instance.guesses = copy.deepcopy(game_instance.guesses)
-
-    temp_instance.player1.hand = copy.deepcopy(game_instance.player1.hand)
-    temp_instance.player2.hand = copy.deepcopy(game_instance.player2.hand)
-    temp_instance.player3.hand = copy.deepcopy(game_instance.player3.hand)
-
-    temp_instance.player1.player_guesses = copy.deepcopy(
-        game_instance.player1.player_guesses
-    )
-    temp_instance.player2.player_guesses = copy.deepcopy(
-        game_instance.player2.player_guesses
-    )
-    temp_instance.player3.player_guesses = copy.deepcopy(
-        game_instance.player3.player_guesses
-    )
-
-    temp_instance.player1.trick_wins = copy.deepcopy(game_instance.player1 .trick_wins)
-    temp_instance.player2.trick_wins = copy.deepcopy(game_instance.player2.trick_wins)
-    temp_instance.player3.trick_wins = copy.deepcopy(game_instance.player3.trick_wins)
+    if not player.player_type.startswith("learn"):
+        return False
+    return playing_layout(player.play_agent.input_size)["possible_cards"] is not None
 
-    temp_instance.player1.possible_cards_one = copy.deepcopy(game_instance.player1.possible_cards_one)
-    temp_instance.player1.possible_cards_two = copy.deepcopy(game_instance.player1.possible_cards_two)
-    temp_instance.player2.possible_cards_one = copy.deepcopy(game_instance.player1.possible_cards_one)
-    temp_instance.player2.possible_cards_two = copy.deepcopy(game_instance.player1.possible_cards_two)
-    temp_instance.player3.possible_cards_one = copy.deepcopy(game_instance.player1.possible_cards_one)
-    temp_instance.player3.possible_cards_two = copy.deepcopy(game_instance.player1.possible_cards_two)
 
-    return temp_instance
+def playing_layout(input_size: int) -> dict:
+    """
+    Start index of every part of the playing state, taken from its schema
+    :param input_size: input size of the playing model
+    :return: dict with the start of each part, None for parts that are not in the state
+    """
+    if input_size not in _PLAYING_LAYOUTS:
+        schema = state_schema.playing_schema(input_size)
+        order = "order" if schema.has("order") else "turn"
+        layout = {
+            name: schema.offset(name)
+            for name in [
+                "hand", "trump", "guesses", "round", "tricks_needed", "tricks_needed_others", "trick", "round_history"
+            ]
+        }
+        layout["n_guesses"] = schema.segments["guesses"].size
+        layout["order"] = schema.offset(order)
+        layout["order_size"] = schema.segments[order].size if schema.has(order) else 0
+        layout["trick_ordered"] = schema.segments["trick"].kind == "sequence"
+        layout["possible_cards"] = schema.offset("possible_cards_one")
+        layout["size"] = schema.size
+        _PLAYING_LAYOUTS[input_size] = layout
+    return _PLAYING_LAYOUTS[input_size]
+
+
+def afterstate_delta(
+    parent_state: np.ndarray,
+    input_size: int,
+    move: int,
+    played_cards: list,
+    trump: int,
+    win_slots: list,
+    following_cards=(),
+) -> tuple:
+    """
+    Changes to the playing state of a player when they play move, without simulating the game
+    :param parent_state: playing state of the player before the move
+    :param input_size: input size of the playing model
+    :param move: the card the player plays
+    :param played_cards: cards played in the trick before the move
+    :param trump: trump-suit of the round
+    :param win_slots: for each player in trick order, -1 for the player itself,
+                      else their index in tricks_needed_others
+    :param following_cards: last cards of the players after the move, for terminal nodes
+    :return: indices and new values of the changed features
+    """
+    layout = playing_layout(input_size)
+    trick_start = layout["trick"]
+    ordered = layout["trick_ordered"]
+    turn = len(played_cards)
+
+    # card leaves the hand
+    indices = [layout["hand"] + move]
+    values = [0]
+
+    trick = played_cards + [move] + list(following_cards)
+    if len(trick) < 3:
+        # trick continues, card fills the next slot
+        indices.append(trick_start + turn * 60 * ordered + move)
+        values.append(1)
+        return indices, values
+
+    # trick is wrapped up, slots are cleared and the winner needs one trick less
+    for slot, card in enumerate(played_cards):
+        indices.append(trick_start + slot * 60 * ordered + card)
+        values.append(0)
+
+    winner_index = cards.trick_winner(trick[0], trick[1], trick[2], trump)
+    if win_slots[winner_index] == -1:
+        needed_index = layout["tricks_needed"]
+    else:
+        needed_index = layout["tricks_needed_others"] + win_slots[winner_index]
+    indices.append(needed_index)
+    values.append(parent_state[needed_index] - 1)
+
+    # winner starts the next trick
+    if layout["order_size"] == 1:
+        indices.append(layout["order"])
+        values.append((turn - winner_index) % 3)
+    elif layout["order_size"] == 3:
+        order_names = parent_state[layout["order"]: layout["order"] + 3]
+        for i in range(3):
+            indices.append(layout["order"] + i)
+            values.append(order_names[(i + winner_index) % 3])
+
+    if layout["round_history"] is not None:
+        # tricks played so far is the round number minus the cards in hand before this trick
+        trick_number = int(parent_state[layout["round"]] - parent_state[:60].sum())
+        for slot, card in enumerate(trick):
+            indices.append(layout["round_history"] + card + slot * 60 + trick_number * 180)
+            values.append(1)
+
+    return indices, values
+
+
+def afterstate(
+    parent_state: np.ndarray,
+    input_size: int,
+    move: int,
+    played_cards: list,
+    trump: int,
+    win_slots: list,
+    following_cards=(),
+    parent_hash=None,
+) -> tuple:
+    """
+    Playing state of a child node, computed from the parent state and the move (see afterstate_delta)
+    :param parent_hash: zobrist hash of the parent state, None to skip hashing
+    :return: child playing state and its zobrist hash (None without parent_hash)
+    """
+    indices, values = afterstate_delta(
+        parent_state, input_size, move, played_cards, trump, win_slots, following_cards
+    )
+    child_hash = None
+    if parent_hash is not None:
+        child_hash = parent_hash ^ state_schema.playing_schema(input_size).hash_delta(parent_state, indices, values)
+    child_state = parent_state.copy()
+    child_state[indices] = values
+    return child_state, child_hash
@@ -0,0 +1,369 @@
+import argparse
+import numpy as np
+import time
+
+import cards
+
+# small dtypes keep the (n_games, 60) work arrays in cache
+SUIT = np.array(cards.SUIT, dtype=np.int16)
+VALUE = np.array(cards.VALUE, dtype=np.int16)
+CARD = np.arange(cards.NUM_CARDS, dtype=np.int16)
+WHITE = (VALUE == 0) | (VALUE == 14)
+
+# sort keys for highest value first (dodging) and lowest value first (winning), ties keep the legal order
+DESCENDING = (14 - VALUE) * 256
+ASCENDING = VALUE * 256
+
+# regular cards that have to be followed for each requested color, 4 and 5 (none yet, none this round) are empty
+COLORED = np.zeros((6, cards.NUM_CARDS), dtype=bool)
+for _suit in range(4):
+    COLORED[_suit] = (SUIT == _suit) & ~WHITE
+
+PLAYER_NAMES = ["player1", "player2", "player3"]
+SEAT_TYPES = ("heuristic", "random")
+NO_CARD = np.int16(1 << 12)  # sort key larger than any card option
+
+
+class VecGame:
+    """
+    Plays n games of wizard in lockstep with NumPy arrays,
+    supports heuristic and random agents for both guessing and playing
+    """
+    def __init__(
+        self,
+        n_games: int,
+        guess_type="heuristic",
+        player_type="heuristic",
+        opp_guesstype="heuristic",
+        opp_playertype="heuristic",
+        shuffled_decks=None,
+        shuffled_players=None,
+        seed=None,
+    ) -> None:
+        for agent_type in (guess_type, player_type, opp_guesstype, opp_playertype):
+            if agent_type not in SEAT_TYPES:
+                raise ValueError(f"VecGame only supports {SEAT_TYPES} agents, got '{agent_type}'")
+
+        self.n_games = n_games
+        self.rng = np.random.default_rng(seed)
+        self.games = np.arange(n_games)
+
+        # seat 0 is player1, seat 1 and 2 are the opponents
+        self.heuristic_guess = np.array([t == "heuristic" for t in (guess_type, opp_guesstype, opp_guesstype)])
+        self.heuristic_play = np.array([t == "heuristic" for t in (player_type, opp_playertype, opp_playertype)])
+
+        # card ids of shape (n_games, 20, 60), decks are shuffled on the fly if not given
+        self.shuffled_decks = None
+        if shuffled_decks is not None:
+            self.shuffled_decks = np.asarray(shuffled_decks, dtype=np.int64)
+
+        # seats in turn order of the current round
+        if shuffled_players is not None:
+            self.order = np.array(
+                [[PLAYER_NAMES.index(name) for name in players] for players in shuffled_players], dtype=np.int64
+            )
+        else:
+            self.order = np.argsort(self.rng.random((n_games, 3)), axis=1)
+        self.game_round = 1
+
+        self.hands = np.zeros((n_games, 3, cards.NUM_CARDS), dtype=bool)
+        self.trump = np.full(n_games, 4, dtype=np.int64)
+        self.guesses = np.zeros((n_games, 3), dtype=np.int64)
+        self.trick_wins = np.zeros((n_games, 3), dtype=np.int64)
+
+        # per game results, same as returned by game.Game.play_game
+        self.scores = np.zeros((n_games, 3), dtype=np.int64)
+        self.offs = np.zeros((n_games, 2), dtype=np.int64)
+        self.round_offs = np.zeros((n_games, 20), dtype=np.int64)
+
+        # summed over all games, same as the getters of game.Game
+        self.off_game = np.zeros(21, dtype=int)
+        self.guess_distribution = np.zeros(21, dtype=int)
+        self.actual_distribution = np.zeros(21, dtype=int)
+        self.overshoot = np.zeros(20, dtype=int)
+
+    def play_game(self) -> tuple:
+        """
+        Plays all games of wizard
+        :return: tuple with scores, player1 mistakes (too high guess, too low guess) and mistakes per round
+        """
+        for game_round in range(20):
+            if self.shuffled_decks is None:
+                deck = np.argsort(self.rng.random((self.n_games, cards.NUM_CARDS)), axis=1)
+            else:
+                deck = self.shuffled_decks[:, game_round]
+
+            self.play_round(deck)
+            self.game_round += 1
+            self.order = np.roll(self.order, -1, axis=1)  # Rotate player order
+
+        return self.scores, self.offs, self.round_offs
+
+    def play_round(self, deck: np.ndarray) -> None:
+        """
+        Play a single round of wizard in every game
+        :param deck: shuffled decks of shape (n_games, 60), cards are dealt from the end
+        :return: None
+        """
+        games = self.games
+        game_round = self.game_round
+        self.hands[:] = False
+        self.trick_wins[:] = 0
+
+        # Players get dealt their hands
+        for position in range(3):
+            dealt = deck[:, 60 - (position + 1) * game_round: 60 - position * game_round]
+            self.hands[games[:, None], self.order[:, position, None], dealt] = True
+
+        if game_round < 20:
+            # Trump card becomes top card after hands are dealt, a joker means no trump
+            trump_card = deck[:, 60 - 3 * game_round - 1]
+            self.trump = np.where(VALUE[trump_card] == 0, 4, SUIT[trump_card])
+        else:
+            # No trump card in final round
+            self.trump = np.full(self.n_games, 4, dtype=np.int64)
+
+        # Guessing phase
+        self.guesses = np.where(
+            self.heuristic_guess, self.heuristic_guesses(), self.rng.integers(0, game_round + 1, (self.n_games, 3))
+        )
+
+        # Playing phase
+        trick_order = self.order.copy()  # order will change after every trick
+        for trick in range(game_round):
+            trick_order = self.play_trick(trick_order)
+
+        self.update_scores()
+
+    def heuristic_guesses(self) -> np.ndarray:
+        """
+        Vectorized version of the heuristic in player.Player.guess_wins
+        :return: guesses of shape (n_games, 3)
+        """
+        trump = self.trump[:, None]
+        is_trump = SUIT == trump
+        win_cards = (VALUE == 14) | (is_trump & (VALUE > 7))
+        if self.game_round < 5:
+            # count low trumps when there are few cards
+            win_cards |= is_trump & (VALUE > 0)
+        else:
+            # count non-trump high cards as win except for early rounds
+            win_cards |= VALUE > 10
+        return (self.hands & win_cards[:, None, :]).sum(axis=2)
+
+    def play_trick(self, trick_order: np.ndarray) -> np.ndarray:
+        """
+        Plays one entire trick in every game
+        :param trick_order: seats in the order they play this trick
+        :return: seats in the order they play the next trick
+        """
+        games = self.games
+        played = np.zeros((self.n_games, 3), dtype=np.int64)
+        requested_color = np.full(self.n_games, 4, dtype=np.int64)
+
+        for turn in range(3):
+            seat = trick_order[:, turn]
+            hand = self.hands[games, seat]
+            card = self.choose_cards(hand, seat, played, turn, requested_color)
+
+            self.hands[games, seat, card] = False
+            played[:, turn] = card
+
+            # Wizard means no requested color this round, joker does not change requested color
+            value = VALUE[card]
+            open_color = requested_color == 4
+            requested_color = np.where(open_color & (value == 14), 5, requested_color)
+            requested_color = np.where(open_color & (value > 0) & (value < 14), SUIT[card], requested_color)
+
+        winner_index = cards.trick_winners(played[:, 0], played[:, 1], played[:, 2], self.trump)
+        self.trick_wins[games, trick_order[games, winner_index]] += 1
+        return trick_order[games[:, None], (np.arange(3) + winner_index[:, None]) % 3]
+
+    def choose_cards(
+        self, hand: np.ndarray, seat: np.ndarray, played: np.ndarray, turn: int, requested_color: np.ndarray
+    ) -> np.ndarray:
+        """
+        Vectorized version of the heuristic and random branches of player.Player.play_card
+        :param hand: hands of the players to move, shape (n_games, 60)
+        :param seat: seat of the player to move in every game
+        :param played: cards played in the trick so far
+        :param turn: how manieth player it is in this trick
+        :param requested_color: the requested color that has to be played if possible
+        :return: the card played in every game
+        """
+        games = self.games
+        following = (hand & COLORED[requested_color]).any(axis=1)
+        legal = np.where(following[:, None], hand & (COLORED[requested_color] | WHITE), hand)
+
+        # position in the list of legal cards: requested cards first followed by white cards, else sorted hand
+        position = np.where(following[:, None] & WHITE, CARD + 60, CARD)
+        legal_position = np.where(legal, position, NO_CARD)
+        first_legal = np.argmin(legal_position, axis=1)
+        card = first_legal
+
+        heuristic = self.heuristic_play[seat]
+        if not heuristic.all():
+            # random agents pick uniformly from their legal cards
+            random_card = np.argmax(np.where(legal, self.rng.random(legal.shape), -1.0), axis=1)
+            card = np.where(heuristic, card, random_card)
+
+        trump = self.trump[:, None]
+        dodge = heuristic & (self.guesses[games, seat] <= self.trick_wins[games, seat])
+        need = heuristic & ~dodge
+
+        if dodge.any():
+            # dodge win as high as possible if I am already at my goal, unplayed cards are probed as blue jokers
+            loses = cards.trick_winner_rows(played, turn, self.trump) != turn
+            dodge_key = np.where(loses, legal_position + DESCENDING, NO_CARD)
+            dodge_card = np.argmin(dodge_key, axis=1)
+            dodge_found = dodge_key[games, dodge_card] < NO_CARD
+            card = np.where(dodge & dodge_found, dodge_card, card)
+
+        # Still need wins, see if I can for sure win this round with lowest card possible as last player
+        if turn == 2 and need.any():
+            ascending_key = np.where(legal, position + ASCENDING, NO_CARD)
+            wins = cards.trick_winner_rows(played, 2, self.trump) == 2
+            win_key = np.where(wins, ascending_key, NO_CARD)
+            win_card = np.argmin(win_key, axis=1)
+            win_found = win_key[games, win_card] < NO_CARD
+
+            # Throw away lowest non-trump (if there is one), unless card is much higher than trump
+            lowest_card = np.argmin(ascending_key, axis=1)
+            lowest_value = VALUE[lowest_card]
+            throw_key = np.where(
+                (SUIT != trump) & (VALUE - lowest_value[:, None] < 10) & (CARD != lowest_card[:, None]),
+                ascending_key,
+                NO_CARD,
+            )
+            throw_card = np.argmin(throw_key, axis=1)
+            throw_found = (throw_key[games, throw_card] < NO_CARD) & (SUIT[lowest_card] == self.trump)
+            need_card = np.where(win_found, win_card, np.where(throw_found, throw_card, lowest_card))
+            card = np.where(need, need_card, card)
+
+        # Play the only legal card if theres only one
+        return np.where(legal.sum(axis=1) == 1, first_legal, card)
+
+    def update_scores(self) -> None:
+        """
+        update scores and keep track of player1 mistakes
+        :return: None
+        """
+        off_mark = np.abs(self.trick_wins - self.guesses)
+        self.scores += np.where(off_mark == 0, 20 + 10 * self.guesses, -10 * off_mark)
+
+        guesses = self.guesses[:, 0]
+        trick_wins = self.trick_wins[:, 0]
+        self.round_offs[:, self.game_round - 1] += off_mark[:, 0] > 0
+        self.offs[:, 0] += guesses > trick_wins
+        self.offs[:, 1] += guesses < trick_wins
+
+        self.guess_distribution += np.bincount(guesses, minlength=21)[:21]
+        self.actual_distribution += np.bincount(trick_wins, minlength=21)[:21]
+        self.off_game += np.bincount(off_mark[:, 0], minlength=21)[:21]
+        self.overshoot += np.bincount(np.maximum(0, guesses - self.game_round), minlength=20)[:20]
+
+    def get_game_performance(self) -> np.ndarray:
+        return self.off_game
+
+    def get_distribution(self) -> tuple:
+        return self.guess_distribution, self.actual_distribution
+
+    def get_overshoot(self) -> np.ndarray:
+        return self.overshoot
+
+
+def parse_args() -> argparse.Namespace:
+    """
+    Function to parse arguments.
+    Returns:
+    parser: Argument parser containing arguments.
+    """
+
+    parser = argparse.ArgumentParser(description="Run n-games in lockstep")
+    parser.add_argument("games", help="How many games to run", type=int)
+    parser.add_argument("guesstype", help="type of agent for player 1 (random, heuristic)")
+    parser.add_argument("playertype", help="type of agent for player 1 (random, heuristic)")
+    parser.add_argument(
+        "--opp_guesstype",
+        help="type of guessing agent for opponents (random, heuristic)",
+        default="heuristic",
+    )
+    parser.add_argument(
+        "--opp_playertype",
+        help="type of playing agent for opponents (random, heuristic)",
+        default="heuristic",
+    )
+    parser.add_argument(
+        "--batch_size",
+        help="optional argument to set how many games are played in lockstep",
+        default=10000,
+        type=int,
+    )
+    parser.add_argument("--seed", help="optional seed for the random generator", default=None, type=int)
+
+    return parser.parse_args()
+
+
+def vec_n_games(
+    n: int,
+    guess_type: str,
+    player_type: str,
+    opp_guesstype: str,
+    opp_playertype: str,
+    batch_size: int,
+    seed=None,
+) -> None:
+    start = time.time()
+    rng = np.random.default_rng(seed)
+
+    win_counter = np.zeros(3, dtype=int)
+    score_counter = np.zeros(3)
+    total_offs = np.zeros(2, dtype=int)
+    total_round_offs = np.zeros(20, dtype=int)
+    total_distribution = np.zeros(21, dtype=int)
+    total_actual = np.zeros(21, dtype=int)
+
+    games_done = 0
+    while games_done < n:
+        n_games = min(batch_size, n - games_done)
+        wizard = VecGame(
+            n_games,
+            guess_type=guess_type,
+            player_type=player_type,
+            opp_guesstype=opp_guesstype,
+            opp_playertype=opp_playertype,
+            seed=rng.integers(2 ** 32),
+        )
+        scores, offs, round_offs = wizard.play_game()
+
+        score_counter += scores.sum(axis=0) / n
+        win_counter += (scores == scores.max(axis=1, keepdims=True)).sum(axis=0)
+        total_offs += offs.sum(axis=0)
+        total_round_offs += round_offs.sum(axis=0)
+        guess_distribution, actual_distribution = wizard.get_distribution()
+        total_distribution += guess_distribution
+        total_actual += actual_distribution
+
+        games_done += n_games
+        print(f"Games done: {games_done}, {round(time.time() - start, 1)}s")
+
+    print("Avg Scores: ", score_counter.tolist())
+    print("Wins: ", win_counter.tolist())
+    print("Total draws: ", win_counter.sum() - n)
+    print("Mistakes: ", total_offs.tolist())
+    print("Mistakes in each round: ", total_round_offs.tolist())
+    print(f"Guesses: {total_distribution.tolist()}")
+    print(f"Actual: {total_actual.tolist()}")
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    vec_n_games(
+        args.games,
+        args.guesstype,
+        args.playertype,
+        args.opp_guesstype,
+        args.opp_playertype,
+        args.batch_size,
+        args.seed,
+    )